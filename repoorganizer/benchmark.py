@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+"""Benchmark a sync against local fixture repos and a fake API.
+
+Generates N bare repos with M branches (and a configurable amount of
+history), serves a GitHub-compatible listing of them with FakeGitHub,
+then times each phase:
+- cold: Clone everything into an empty destination.
+- noop: Sync again with nothing changed.
+- partial: Sync again after new commits were pushed to some repos.
+
+Results (wall time, git subprocess count, bytes written, API requests)
+are written as JSON so that runs can be compared to catch regressions.
+Counting git processes uses a wrapper script placed first in PATH, so
+this requires a POSIX shell.
+
+Example:
+    python -m repoorganizer.benchmark --repos 50 --branches 4 --jobs 8
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from repoorganizer.fakegithub import FakeGitHub
+from repoorganizer.repocollection import RepoCollection
+from repoorganizer.repoindex import RepoIndex
+from repoorganizer.tracing import git_subcommand
+
+OWNER = "bench-org"
+GIT_LOG_ENV = "REPOORGANIZER_GIT_LOG"
+
+
+def write_history(real_git, repo_path, branches, commits, blob_size,
+                  start=0):
+    """Add commits to each branch of a bare repo using git fast-import.
+
+    Args:
+        real_git (str): Path to git (not the counting wrapper).
+        repo_path (str): Existing bare repo.
+        branches (list[str]): Branch names. The first one is created
+            from scratch (if new) and the others start from it.
+        commits (int): Commits to add to each branch.
+        blob_size (int): Bytes of (incompressible) data in each commit.
+        start (int, optional): Number used in file names and messages
+            so that later calls add new files rather than replace.
+    """
+    existing = subprocess.run(
+        [real_git, "-C", repo_path, "for-each-ref", "--format=%(refname)",
+         "refs/heads"],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    stream = io.BytesIO()
+    mark = 0
+    when = int(time.time())
+    for index, branch in enumerate(branches):
+        parent = None
+        ref = "refs/heads/" + branch
+        if ref in existing:
+            parent = ref + "^0"  # "^0" reads the ref from the repo
+        elif index > 0:
+            parent = "refs/heads/" + branches[0]  # as of this stream
+        for number in range(start, start + commits):
+            mark += 1
+            blob_mark = mark
+            data = os.urandom(blob_size)
+            stream.write(b"blob\nmark :%d\ndata %d\n" % (blob_mark, len(data)))
+            stream.write(data + b"\n")
+            mark += 1
+            message = "{} commit {}".format(branch, number).encode("utf-8")
+            stream.write(b"commit %s\nmark :%d\n"
+                         % (ref.encode("utf-8"), mark))
+            stream.write(b"committer Bench <bench@example.com> %d +0000\n"
+                         % when)
+            stream.write(b"data %d\n%s\n" % (len(message), message))
+            if parent:
+                stream.write(b"from %s\n" % parent.encode("utf-8"))
+                parent = None  # fast-import continues the branch itself
+            stream.write(b"M 100644 :%d %s-%d.bin\n\n"
+                         % (blob_mark, branch.encode("utf-8"), number))
+        existing.append(ref)
+    subprocess.run(
+        [real_git, "-C", repo_path, "fast-import", "--quiet"],
+        input=stream.getvalue(), check=True,
+    )
+
+
+def make_fixtures(real_git, root, fake, count, branches, commits,
+                  blob_size):
+    """Create count bare repos under root and add them to fake.
+
+    Returns:
+        list[dict]: Listing entries added to fake.
+    """
+    names = ["main"] + ["branch{}".format(i) for i in range(1, branches)]
+    repos = []
+    for number in range(count):
+        name = "repo{:04d}".format(number)
+        path = os.path.join(root, OWNER, name + ".git")
+        subprocess.run([real_git, "init", "-q", "--bare",
+                        "--initial-branch=main", path], check=True)
+        write_history(real_git, path, names, commits, blob_size)
+        size_kb = (branches * commits * blob_size) // 1024
+        repos.append(fake.add_repo(OWNER, name, path, size_kb=size_kb))
+    return repos
+
+
+def install_git_counter(bin_dir, real_git):
+    """Put a git wrapper first in PATH that logs each invocation.
+
+    Returns:
+        str: Path of the log (one line per git process).
+    """
+    os.makedirs(bin_dir)
+    log_path = os.path.join(os.path.dirname(bin_dir), "git-commands.log")
+    wrapper = os.path.join(bin_dir, "git")
+    with open(wrapper, "w") as stream:
+        stream.write('#!/bin/sh\n'
+                     'echo "$*" >> "${}"\n'
+                     'exec "{}" "$@"\n'.format(GIT_LOG_ENV, real_git))
+    os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR)
+    os.environ[GIT_LOG_ENV] = log_path
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    return log_path
+
+
+def file_states(roots):
+    """Get the identity, size and time of each file under roots."""
+    states = {}
+    for root in roots:
+        for parent, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(parent, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue  # such as a lock file removed meanwhile
+                states[path] = (info.st_ino, info.st_size, info.st_mtime_ns)
+    return states
+
+
+def bytes_written(before, after):
+    """Total size of files that are new or changed in after.
+
+    Args:
+        before (dict): Result of file_states before a phase.
+        after (dict): Result of file_states after it.
+    """
+    return sum(state[1] for path, state in after.items()
+               if before.get(path) != state)
+
+
+def run_phase(name, sync, log_path, roots, fake):
+    """Run sync and measure it.
+
+    Returns:
+        dict: Phase results.
+    """
+    open(log_path, "w").close()
+    requests = fake.requests
+    not_modified = fake.not_modified
+    # Compare file states instead of times so that writes which end just
+    #   before the phase aren't counted (file times are coarse).
+    before = file_states(roots)
+    start = time.perf_counter()
+    summaries = sync()
+    wall = time.perf_counter() - start
+    with open(log_path, "r") as stream:
+        lines = [line for line in stream.read().splitlines() if line]
+    by_command = {}
+    for line in lines:
+        command = git_subcommand(line.split())
+        by_command[command] = by_command.get(command, 0) + 1
+    return {
+        'phase': name,
+        'wall_seconds': round(wall, 3),
+        'git_processes': len(lines),
+        'git_processes_by_command': dict(sorted(by_command.items())),
+        'bytes_written': bytes_written(before, file_states(roots)),
+        'api_requests': fake.requests - requests,
+        'api_not_modified': fake.not_modified - not_modified,
+        'repos_failed': len([s for s in summaries if not s.get('ok')]),
+        'repos_skipped': len([s for s in summaries
+                              if s.get('action') == "skip"]),
+    }
+
+
+def run_benchmark(repos=20, branches=3, commits=10, blob_size=1024,
+                  changed=0.1, jobs=4, branch_mode="refs", mirror=False,
+                  precheck=False, workdir=None, verbose=False):
+    """Create fixtures, run each phase, and return the results.
+
+    Args:
+        workdir (str, optional): Where to put fixtures and the backup
+            tree (kept afterward). A temporary directory (removed
+            afterward) if None.
+        verbose (bool, optional): Show sync output instead of hiding it.
+
+    Returns:
+        dict: 'params' and a result (see run_phase) for each phase.
+    """
+    real_git = shutil.which("git")
+    if not real_git:
+        raise RuntimeError("git was not found in PATH")
+    remove = workdir is None
+    if remove:
+        workdir = tempfile.mkdtemp(prefix="repo-organizer-bench-")
+    old_path = os.environ.get("PATH", "")
+    old_cache_root = RepoCollection.cache_root
+    fake = FakeGitHub()
+    index = None
+    try:
+        fixtures_dir = os.path.join(workdir, "remotes")
+        destination = os.path.join(workdir, "backup")
+        RepoCollection.cache_root = os.path.join(workdir, "cache")
+        listing = make_fixtures(real_git, fixtures_dir, fake, repos,
+                                branches, commits, blob_size)
+        fake.start()
+        log_path = install_git_counter(os.path.join(workdir, "bin"),
+                                       real_git)
+        index = RepoIndex(RepoCollection.index_path())
+
+        def sync():
+            collection = RepoCollection()
+            collection.set_name(OWNER, True)
+            collection.api_url = fake.url
+            output = io.StringIO()
+            redirect = contextlib.redirect_stdout(output)
+            if verbose:
+                redirect = contextlib.nullcontext()
+            with redirect:
+                return collection.clone_repos(
+                    destination=destination, jobs=jobs,
+                    branch_mode=branch_mode, mirror=mirror,
+                    precheck=precheck, index=index)
+
+        roots = [destination, RepoCollection.cache_root]
+        results = [run_phase("cold", sync, log_path, roots, fake)]
+        results.append(run_phase("noop", sync, log_path, roots, fake))
+        step = max(1, int(round(1.0 / changed))) if changed else 0
+        names = ["main"] + ["branch{}".format(i)
+                            for i in range(1, branches)]
+        if step:
+            for repo in listing[::step]:
+                path = repo['ssh_url'][len("file://"):]
+                write_history(real_git, path, names[:2], 1, blob_size,
+                              start=commits)
+                fake.touch(repo['full_name'])
+        results.append(run_phase("partial", sync, log_path, roots, fake))
+        return {
+            'params': {
+                'repos': repos,
+                'branches': branches,
+                'commits': commits,
+                'blob_size': blob_size,
+                'changed': changed,
+                'changed_repos': len(listing[::step]) if step else 0,
+                'jobs': jobs,
+                'branch_mode': branch_mode,
+                'mirror': mirror,
+                'precheck': precheck,
+            },
+            'phases': results,
+        }
+    finally:
+        fake.stop()
+        if index is not None:
+            index.close()
+        os.environ["PATH"] = old_path
+        os.environ.pop(GIT_LOG_ENV, None)
+        RepoCollection.cache_root = old_cache_root
+        if remove:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repos", type=int, default=20)
+    parser.add_argument("--branches", type=int, default=3)
+    parser.add_argument("--commits", type=int, default=10,
+                        help="Commits per branch.")
+    parser.add_argument("--blob-size", type=int, default=1024,
+                        help="Bytes added by each commit.")
+    parser.add_argument("--changed", type=float, default=0.1,
+                        help="Fraction of repos changed for 'partial'.")
+    parser.add_argument("--jobs", "-j", type=int, default=4)
+    parser.add_argument("--branch-mode", choices=["refs", "switch"],
+                        default="refs")
+    parser.add_argument("--mirror", action="store_true")
+    parser.add_argument("--precheck", action="store_true")
+    parser.add_argument("--workdir",
+                        help="Keep fixtures and backup here (not removed).")
+    parser.add_argument("--output", "-o",
+                        help="Write JSON here instead of stdout.")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args()
+    results = run_benchmark(
+        repos=args.repos, branches=args.branches, commits=args.commits,
+        blob_size=args.blob_size, changed=args.changed, jobs=args.jobs,
+        branch_mode=args.branch_mode, mirror=args.mirror,
+        precheck=args.precheck, workdir=args.workdir, verbose=args.verbose,
+    )
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as stream:
+            stream.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
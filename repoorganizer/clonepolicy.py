@@ -0,0 +1,128 @@
+"""Choose how much history and data to download for each repo."""
+from __future__ import print_function
+
+POLICIES = ("full", "blobless", "treeless", "shallow")
+DEFAULT_DEPTH = 1
+# Listing "size" is in KB, so this is 1 GB:
+DEFAULT_LARGE_REPO_SIZE_KB = 1024 * 1024
+
+
+def parse_policy(value):
+    """Split a policy into its name and depth.
+
+    Args:
+        value (str): One of POLICIES, where "shallow" may be followed by
+            a depth such as "shallow:50". None means "full".
+
+    Returns:
+        tuple(str, int): Policy name and depth (None unless shallow).
+    """
+    if not value:
+        return "full", None
+    name, _, depth = value.partition(":")
+    name = name.strip().lower()
+    if name not in POLICIES:
+        raise ValueError("Expected one of {} (or shallow:N) got {}"
+                         .format(POLICIES, repr(value)))
+    if name != "shallow":
+        if depth:
+            raise ValueError("Only shallow can have a depth, got {}"
+                             .format(repr(value)))
+        return name, None
+    if not depth:
+        return name, DEFAULT_DEPTH
+    return name, int(depth)
+
+
+def clone_args(policy):
+    """Get extra git clone arguments for a policy.
+
+    All branches are still cloned (a shallow clone is otherwise
+    limited to the default branch).
+    """
+    name, depth = parse_policy(policy)
+    if name == "blobless":
+        return ["--filter=blob:none"]
+    if name == "treeless":
+        return ["--filter=tree:0"]
+    if name == "shallow":
+        return ["--depth", str(depth), "--no-single-branch"]
+    return []
+
+
+def fetch_args(policy):
+    """Get extra git fetch or pull arguments for a policy.
+
+    A partial (blobless or treeless) clone already stores its filter in
+    the repo's config, so later fetches apply it without arguments.
+    A shallow clone stays shallow with a plain fetch, which gets every
+    commit since the last one, so branches can still be fast-forwarded.
+    Passing --depth again would cut the new commits off from the local
+    history instead (so every branch would look diverged). Depth is
+    never passed to a full clone either, so it is never truncated by a
+    policy that changed later.
+
+    Args:
+        policy (str): See parse_policy.
+    """
+    parse_policy(policy)  # validate
+    return []
+
+
+class ClonePolicies:
+    """Clone policy for each repo, from the "github" settings dict.
+
+    Precedence (first match wins):
+    1. "clone_policies" entry for the repo's full name ("owner/name").
+    2. "clone_policies" entry for the collection (org or user) name.
+    3. "large_repo_policy" if the listing's size (KB) is at least
+       "large_repo_size_kb" (default 1 GB).
+    4. "clone_policy" (default "full").
+
+    Example settings:
+        "clone_policy": "full",
+        "clone_policies": {"some-org": "blobless",
+                           "some-org/huge-assets": "shallow:1"},
+        "large_repo_policy": "treeless",
+        "large_repo_size_kb": 524288
+    """
+
+    def __init__(self, default="full", policies=None, large_repo_policy=None,
+                 large_repo_size_kb=DEFAULT_LARGE_REPO_SIZE_KB):
+        self.default = default or "full"
+        self.policies = policies or {}
+        self.large_repo_policy = large_repo_policy
+        self.large_repo_size_kb = large_repo_size_kb
+        # Validate now so a typo is reported before anything is cloned:
+        for value in [self.default, self.large_repo_policy]:
+            parse_policy(value)
+        for value in self.policies.values():
+            parse_policy(value)
+
+    @classmethod
+    def from_settings(cls, github):
+        """Create from the "github" dict in settings.json."""
+        size = github.get('large_repo_size_kb')
+        if size is None:
+            size = DEFAULT_LARGE_REPO_SIZE_KB
+        return cls(
+            default=github.get('clone_policy'),
+            policies=github.get('clone_policies'),
+            large_repo_policy=github.get('large_repo_policy'),
+            large_repo_size_kb=size,
+        )
+
+    def policy_for(self, repo, collection_name=None):
+        """Get the policy (see parse_policy) for a listing entry."""
+        policy = self.policies.get(repo.get('full_name'))
+        if policy:
+            return policy
+        if collection_name:
+            policy = self.policies.get(collection_name)
+            if policy:
+                return policy
+        if self.large_repo_policy:
+            size = repo.get('size')
+            if size is not None and size >= self.large_repo_size_kb:
+                return self.large_repo_policy
+        return self.default
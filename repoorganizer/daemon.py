@@ -0,0 +1,548 @@
+"""Keep running and sync each repo as soon as GitHub reports a push.
+
+A scheduled run only notices a push when it lists the repos again, so a
+change waits for the next run. SyncDaemon instead serves a local HTTP
+endpoint for GitHub push webhooks (the payload format GitHub sends for
+a repo, org or app webhook, relayed by a reverse proxy or a forwarder
+such as smee.io if the machine is not reachable). It fetches only the
+pushed ref of the pushed repo, usually within seconds. The repo index,
+the listings and the API connections stay loaded between pushes. A full
+run (see scheduler.sync_collections) still reconciles every repo every
+few hours, to catch pushes whose webhook was missed and repos that were
+deleted or renamed.
+
+Try it by posting a sample payload (see sample_push_payload) signed
+with the webhook's secret (see payload_signature):
+
+    curl -X POST http://127.0.0.1:8765/webhook \\
+        -H "X-GitHub-Event: push" -H "Content-Type: application/json" \\
+        -H "X-Hub-Signature-256: sha256=..." \\
+        -d '{"ref": "refs/heads/main",
+             "repository": {"full_name": "some-org/some-repo"}}'
+
+then see GET http://127.0.0.1:8765/status for the result.
+"""
+from __future__ import print_function
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+
+if sys.version_info.major >= 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # type:ignore  # noqa: E501
+    from SocketServer import ThreadingMixIn  # type:ignore
+    from urlparse import urlparse  # type:ignore
+
+from repoorganizer.githubapi import is_full_name
+from repoorganizer.maintenance import maintain_collections
+from repoorganizer.ratelimit import QuotaExhausted
+from repoorganizer.scheduler import (
+    DEFAULT_LIST_JOBS,
+    WorkQueue,
+    repo_owner,
+    sync_collections,
+)
+from repoorganizer.syncpool import url_host
+
+MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(MODULE_DIR)
+REPOS_DIR = os.path.dirname(REPO_DIR)
+if os.path.isfile(os.path.join(REPOS_DIR, "hierosoft", "hierosoft",
+                               "__init__.py")):
+    sys.path.insert(0, os.path.join(REPOS_DIR, "hierosoft"))
+
+from hierosoft.logging2 import getLogger  # noqa: E402  #type:ignore
+
+logger = getLogger(__name__)
+
+DEFAULT_LISTEN = "127.0.0.1:8765"
+DEFAULT_RECONCILE_HOURS = 6.0
+WEBHOOK_PATHS = ("/", "/webhook")
+MAX_PAYLOAD = 25 * 1024 * 1024  # GitHub doesn't send larger payloads
+RECENT_SYNCS = 50  # syncs kept for the status page
+# Options of RepoCollection.configure (the rest of the options of
+#   sync_collections only apply to a full run).
+CONFIGURE_OPTIONS = (
+    "forks",
+    "destination",
+    "branch_mode",
+    "force",
+    "mirror",
+    "clone_policies",
+    "index",
+    "metadata",
+    "listing",
+    "discovery",
+    "full_listing_days",
+    "share_forks",
+    "journal",
+)
+
+
+def parse_listen(value):
+    """Split an address such as "127.0.0.1:8765" into host and port.
+
+    Raises:
+        ValueError: If there is no port or it is not a number.
+    """
+    host, sep, port = (value or "").rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError("Expected HOST:PORT for listen, got {}"
+                         .format(repr(value)))
+    return host or "127.0.0.1", int(port)
+
+
+def payload_signature(secret, body):
+    """Get the X-Hub-Signature-256 GitHub sends for body.
+
+    Args:
+        secret (str): The webhook's secret.
+        body (bytes): The payload as sent.
+    """
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256)
+    return "sha256=" + digest.hexdigest()
+
+
+def verify_signature(secret, body, header):
+    """Check a payload's X-Hub-Signature-256 header (False if no secret)."""
+    if not secret or not header:
+        return False
+    return hmac.compare_digest(payload_signature(secret, body), header)
+
+
+def sample_push_payload(full_name, ref="refs/heads/main", after=None,
+                        clone_url=None, ssh_url=None):
+    """Make a minimal push payload like GitHub sends (for testing).
+
+    Args:
+        full_name (str): Such as "some-org/some-repo".
+        ref (str, optional): Full name of the pushed ref.
+        after (str, optional): Commit the ref points to after the push.
+        clone_url (str, optional): Defaults to the github.com URL.
+        ssh_url (str, optional): Defaults to the github.com URL.
+
+    Returns:
+        dict: Payload to post with "X-GitHub-Event: push".
+    """
+    return {
+        'ref': ref,
+        'before': "0" * 40,
+        'after': after or "0" * 40,
+        'created': False,
+        'deleted': False,
+        'repository': {
+            'name': full_name.split("/")[-1],
+            'full_name': full_name,
+            'fork': False,
+            'clone_url': clone_url
+            or "https://github.com/{}.git".format(full_name),
+            'ssh_url': ssh_url or "git@github.com:{}.git".format(full_name),
+            'pushed_at': int(time.time()),
+        },
+    }
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/status":
+            self.send_json(404, {'message': "Not Found"})
+            return
+        self.send_json(200, self.server.sync_daemon.status())
+
+    def do_POST(self):
+        daemon = self.server.sync_daemon
+        if urlparse(self.path).path not in WEBHOOK_PATHS:
+            self.send_json(404, {'message': "Not Found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {'message': "Bad Content-Length"})
+            self.close_connection = True
+            return
+        if length > MAX_PAYLOAD:
+            self.send_json(413, {'message': "Payload Too Large"})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+        if not verify_signature(daemon.secret, body,
+                                self.headers.get("X-Hub-Signature-256")):
+            logger.warning("Ignored a webhook from {} with a bad signature"
+                           .format(self.address_string()))
+            self.send_json(401, {'message': "Bad signature"})
+            return
+        try:
+            payload = json.loads(body.decode("utf-8"))
+        except ValueError as ex:
+            self.send_json(400, {'message': "Bad JSON: {}".format(ex)})
+            return
+        if not isinstance(payload, dict):
+            self.send_json(400, {'message': "Expected a JSON object"})
+            return
+        code, data = daemon.handle_event(
+            self.headers.get("X-GitHub-Event") or "", payload)
+        self.send_json(code, data)
+
+    def send_json(self, code, data):
+        body = json.dumps(data, sort_keys=True).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SyncDaemon:
+    """Sync pushed repos on request and every repo now and then.
+
+    Args:
+        collections (list[RepoCollection]): Collections with names set.
+            Only repos of these owners are synced.
+        listen (str, optional): Address for the webhook endpoint, such
+            as "127.0.0.1:8765" (see parse_listen). Port 0 picks a free
+            port (see url).
+        secret (str): The webhook's secret (required). Payloads
+            without a matching X-Hub-Signature-256 are refused.
+        reconcile_hours (float, optional): Hours between full runs
+            (the first starts right away). 0 for none.
+        jobs (int, optional): Repos to sync at once (for pushes, and
+            separately within a full run).
+        jobs_per_host (int, optional): See WorkQueue per_host.
+        jobs_per_owner (int, optional): See WorkQueue per_owner.
+        fairness (str, optional): See WorkQueue.
+        list_jobs (int, optional): See sync_collections.
+        maintenance (dict, optional): Options of
+            maintenance.maintain_collections to run it after each full
+            run (None for no maintenance).
+        options: Passed to RepoCollection.prepare_sync for each full
+            run (see sync_collections). The ones in CONFIGURE_OPTIONS
+            also apply to syncs of pushed repos.
+
+    Attributes:
+        url (str): Base URL of the endpoint, once started.
+    """
+
+    handler_class = WebhookHandler
+
+    def __init__(self, collections, listen=DEFAULT_LISTEN, secret=None,
+                 reconcile_hours=DEFAULT_RECONCILE_HOURS, jobs=1,
+                 jobs_per_host=None, jobs_per_owner=None,
+                 fairness="round-robin", list_jobs=DEFAULT_LIST_JOBS,
+                 maintenance=None, **options):
+        if not secret:
+            # Otherwise anyone who can reach the endpoint could make it
+            #   fetch whatever they like.
+            raise ValueError("A webhook secret is required")
+        self.collections = collections
+        self.host, self.port = parse_listen(listen)
+        self.secret = secret
+        self.reconcile_hours = reconcile_hours
+        self.maintenance = maintenance
+        self.jobs = max(1, jobs or 1)
+        self.options = options
+        self.run_options = dict(
+            options, jobs=jobs, jobs_per_host=jobs_per_host,
+            jobs_per_owner=jobs_per_owner, fairness=fairness,
+            list_jobs=list_jobs)
+        self.queue = WorkQueue(1, fairness=fairness,
+                               per_owner=jobs_per_owner,
+                               per_host=jobs_per_host)
+        self.url = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pending = {}  # full name to queued sync (see enqueue)
+        self._repos = {}  # full name to (collection, RepoRecord)
+        self._owners = {collection.name.lower(): collection
+                        for collection in collections}
+        self._recent = deque(maxlen=RECENT_SYNCS)
+        self._counts = {'received': 0, 'queued': 0, 'synced': 0,
+                        'failed': 0, 'ignored': 0}
+        self._reconciles = {'count': 0, 'started': None, 'ended': None}
+        self._server = None
+        self._threads = []
+
+    def _index_repos(self):
+        """Remember every listed repo, so pushes use its listing entry."""
+        repos = {}
+        for collection in self.collections:
+            for repo in collection.repos or []:
+                repos[repo['full_name'].lower()] = (collection, repo)
+        with self._lock:
+            self._repos = repos
+
+    def find(self, full_name):
+        """Find which collection syncs a repo.
+
+        A repo that was not listed yet (such as one created since the
+        last full run) is requested from the API, so that its clone URL
+        never comes from the payload.
+
+        Args:
+            full_name (str): Such as "some-org/some-repo".
+
+        Returns:
+            tuple(RepoCollection, RepoRecord): Or None if no collection
+                has the repo's owner, the API doesn't have the repo, or
+                it is a fork and forks are excluded.
+        """
+        with self._lock:
+            found = self._repos.get(full_name.lower())
+        if found is not None:
+            return found
+        collection = self._owners.get(repo_owner({'full_name': full_name})
+                                      .lower())
+        if collection is None:
+            return None
+        record = collection.lookup_repo(full_name)
+        if record is None:
+            return None
+        if record.get('fork') and not self.options.get('forks', True):
+            return None
+        with self._lock:
+            self._repos[record['full_name'].lower()] = (collection, record)
+        return collection, record
+
+    def enqueue(self, collection, repo, refs=None):
+        """Queue a sync of one repo, unless one is already waiting.
+
+        Args:
+            refs (list[str], optional): Refs to fetch (None for all).
+                Added to those of a waiting sync of the same repo.
+
+        Returns:
+            bool: True if queued, False if merged into a waiting sync.
+        """
+        key = repo['full_name'].lower()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                if pending['refs'] is None or refs is None:
+                    pending['refs'] = None
+                else:
+                    pending['refs'] = sorted(set(pending['refs'])
+                                             | set(refs))
+                return False
+            self._pending[key] = {
+                'collection': collection,
+                'repo': repo,
+                'refs': list(refs) if refs is not None else None,
+                'queued_at': time.time(),
+            }
+        self.queue.add(key, repo_owner(repo), url_host(repo.get('ssh_url')))
+        return True
+
+    def handle_event(self, event, payload):
+        """Act on one webhook delivery.
+
+        Args:
+            event (str): The X-GitHub-Event header, such as "push".
+            payload (dict): The decoded body.
+
+        Returns:
+            tuple(int, dict): HTTP status and JSON response.
+        """
+        with self._lock:
+            self._counts['received'] += 1
+        if event == "ping":
+            return 200, {'ok': True}
+        if event != "push":
+            return self._ignored("event {}".format(repr(event)))
+        repository = payload.get('repository') or {}
+        full_name = repository.get('full_name')
+        if not is_full_name(full_name):
+            return 400, {'message': "Expected repository.full_name such as"
+                                    " owner/name"}
+        found = self.find(full_name)
+        if found is None:
+            return self._ignored("{} is not backed up".format(full_name))
+        collection, repo = found
+        ref = payload.get('ref')
+        after = payload.get('after')
+        if ref and after and not payload.get('deleted') \
+                and collection.index is not None:
+            synced = collection.index.get(repo['full_name'])
+            if synced and synced['ok'] \
+                    and synced['refs'].get(ref) == after:
+                # Such as a redelivery, or a push already fetched by a
+                #   full run.
+                return self._ignored("{} {} is already at {}"
+                                     .format(full_name, ref, after))
+        # A deleted ref is only pruned by fetching everything.
+        refs = [ref] if ref and not payload.get('deleted') else None
+        queued = self.enqueue(collection, repo, refs=refs)
+        if queued:
+            with self._lock:
+                self._counts['queued'] += 1
+        return 202, {'queued': queued, 'full_name': repo['full_name'],
+                     'refs': refs}
+
+    def _ignored(self, reason):
+        with self._lock:
+            self._counts['ignored'] += 1
+        logger.info("Ignored a webhook: {}".format(reason))
+        return 200, {'ignored': reason}
+
+    def _work(self):
+        while True:
+            taken = self.queue.get()
+            if taken is None:
+                return
+            key, owner, host = taken
+            with self._lock:
+                pending = self._pending.pop(key)
+            collection = pending['collection']
+            repo = pending['repo']
+            try:
+                # Forced, since a listing entry's pushed_at is older
+                #   than the push. Recording that older pushed_at also
+                #   means the next full run fetches every ref anyway.
+                summary = collection._sync_if_changed(
+                    repo, quiet=self.jobs > 1, refs=pending['refs'],
+                    force=True)
+            except Exception as ex:
+                logger.exception("Job failed for {}".format(repo))
+                summary = collection.error_summary(repo, ex)
+            finally:
+                self.queue.done(owner, host)
+            self._finished(pending, summary)
+
+    def _finished(self, pending, summary):
+        latency = time.time() - pending['queued_at']
+        entry = {
+            'full_name': summary['full_name'],
+            'refs': pending['refs'],
+            'action': summary.get('action'),
+            'ok': summary['ok'],
+            'errors': summary['errors'],
+            'duration': summary.get('duration'),
+            'latency': latency,
+            'finished_at': time.time(),
+        }
+        with self._lock:
+            self._counts['synced' if summary['ok'] else 'failed'] += 1
+            self._recent.appendleft(entry)
+        print("{} {} ({}) {} {:.1f}s after the webhook".format(
+            summary.get('action') or "sync", summary['full_name'],
+            ", ".join(pending['refs'] or ["all refs"]),
+            "done" if summary['ok'] else "FAILED", latency))
+        for error in summary['errors']:
+            print("  - {}".format(error))
+
+    def reconcile(self):
+        """List and sync every repo (like a run without the daemon)."""
+        with self._lock:
+            self._reconciles['started'] = time.time()
+        print("Reconciling every repo")
+        for collection in self.collections:
+            collection.repos = None  # list again (with ETags)
+        try:
+            sync_collections(self.collections, **self.run_options)
+        except QuotaExhausted as ex:
+            # Retried at the next reconciliation (webhooks still work).
+            logger.warning("Reconciliation stopped: {}".format(ex))
+        except Exception:
+            logger.exception("Reconciliation failed")
+        self._index_repos()
+        if self.maintenance is not None:
+            # Repos being maintained wait for webhook syncs and vice
+            #   versa (see repo_lock).
+            try:
+                index = self.options.get('index') \
+                    or self.collections[0].index
+                maintain_collections(self.collections, index,
+                                     **self.maintenance)
+            except Exception:
+                logger.exception("Maintenance failed")
+        with self._lock:
+            self._reconciles['count'] += 1
+            self._reconciles['ended'] = time.time()
+
+    def _reconcile_loop(self):
+        while not self._stop.is_set():
+            self.reconcile()
+            if not self.reconcile_hours:
+                return
+            self._stop.wait(self.reconcile_hours * 3600)
+
+    def status(self):
+        """Get counts, the queue and recent syncs (for GET /status)."""
+        with self._lock:
+            return {
+                'counts': dict(self._counts),
+                'pending': sorted(self._pending),
+                'repos': len(self._repos),
+                'reconciles': dict(self._reconciles),
+                'reconcile_hours': self.reconcile_hours,
+                'recent': list(self._recent),
+            }
+
+    def start(self):
+        """Serve webhooks and start syncing in background threads.
+
+        Returns:
+            str: Base URL such as "http://127.0.0.1:8765".
+        """
+        configure_options = {key: value for key, value
+                             in self.options.items()
+                             if key in CONFIGURE_OPTIONS}
+        for collection in self.collections:
+            collection.configure(**configure_options)
+        self._server = _ThreadingHTTPServer((self.host, self.port),
+                                            self.handler_class)
+        self._server.sync_daemon = self
+        self.url = "http://{}:{}".format(self.host,
+                                         self._server.server_port)
+        targets = [(self._server.serve_forever, "webhooks")]
+        targets.extend((self._work, "webhook-sync-{}".format(number))
+                       for number in range(self.jobs))
+        targets.append((self._reconcile_loop, "reconcile"))
+        for target, name in targets:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        print("Listening for GitHub webhooks on {}/webhook".format(self.url))
+        return self.url
+
+    def serve_forever(self):
+        """Start (see start) and wait until stop or KeyboardInterrupt."""
+        if self._server is None:
+            self.start()
+        while not self._stop.wait(1.0):
+            pass
+
+    def stop(self):
+        """Stop accepting webhooks and let queued syncs finish.
+
+        A full run in progress is not waited for (each repo it already
+        started finishes unless the process exits).
+        """
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.queue.close_producer()
+        for thread in self._threads:
+            if thread.name.startswith("webhook-sync-"):
+                thread.join()
@@ -0,0 +1,455 @@
+"""Local stand-in for the parts of the GitHub API used here.
+
+Serves repo listings (paginated with Link headers, with ETag and 304
+Not Modified, or from the GraphQL endpoint with branch heads read from
+the local repos) where ssh_url and clone_url point at local repos, so a
+sync can be tested or benchmarked without network access. Set a
+collection's api_url (or "api_url" in settings) to FakeGitHub.url.
+Set rate_limit to send X-RateLimit-* headers (and 403 once the quota
+of a token is used up), and use fail_next to simulate a secondary rate
+limit.
+"""
+from __future__ import print_function
+import gzip
+import hashlib
+import json
+import subprocess
+import sys
+import threading
+import time
+
+if sys.version_info.major >= 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # type:ignore  # noqa: E501
+    from SocketServer import ThreadingMixIn  # type:ignore
+    from urlparse import urlparse, parse_qs  # type:ignore
+
+
+def iso_time(timestamp=None):
+    """Format a time like GitHub does, such as "2024-01-31T12:00:00Z"."""
+    if timestamp is None:
+        timestamp = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark and test output clean.
+
+    def do_GET(self):
+        fake = self.server.fake
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        parts = [part for part in parsed.path.split("/") if part]
+        fake.count_request(self.path, self.headers)
+        self.rate_headers = {}  # the handler is reused for keep-alive
+        failure = fake.take_failure()
+        if failure is not None:
+            status, retry_after = failure
+            headers = {}
+            if retry_after is not None:
+                headers["Retry-After"] = str(retry_after)
+            self.send_json(status, {
+                "message": "You have exceeded a secondary rate limit.",
+            }, headers=headers)
+            return
+        self.rate_headers = fake.use_quota(self.headers.get("Authorization"),
+                                           search=(parts[:1] == ["search"]))
+        if self.rate_headers.get("X-RateLimit-Remaining") == "-1":
+            self.rate_headers["X-RateLimit-Remaining"] = "0"
+            self.send_json(403, {"message": "API rate limit exceeded."})
+            return
+        if len(parts) == 3 and parts[0] == "repos":
+            repo = fake.get_repo("/".join(parts[1:]))
+            if repo is None:
+                self.send_json(404, {"message": "Not Found"})
+            else:
+                self.send_json(200, repo)
+            return
+        search = False
+        owner = None
+        forks = True
+        pushed_after = None
+        if len(parts) == 3 and parts[0] in ("orgs", "users") \
+                and parts[2] == "repos":
+            owner = parts[1]
+        elif parts == ["search", "repositories"]:
+            search = True
+            forks = False  # like GitHub, unless fork:true
+            for term in query.get("q", [""])[0].split():
+                key, _, value = term.partition(":")
+                if key in ("user", "org"):
+                    owner = value
+                elif term == "fork:true":
+                    forks = True
+                elif key == "pushed" and value.startswith(">"):
+                    pushed_after = value[1:]
+        if owner is None:
+            self.send_json(404, {"message": "Not Found"})
+            return
+        repos = fake.list_repos(owner)
+        if search:
+            # ISO 8601 times in UTC ("Z") sort as strings.
+            repos = [repo for repo in repos
+                     if (forks or not repo["fork"])
+                     and (pushed_after is None
+                          or repo["pushed_at"] > pushed_after)]
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        last = max(1, (len(repos) + per_page - 1) // per_page)
+        items = repos[(page - 1) * per_page:page * per_page]
+        if search:
+            data = {
+                "total_count": len(repos),
+                "incomplete_results": False,
+                "items": [dict(item, score=1.0) for item in items],
+            }
+        else:
+            data = items
+        headers = {}
+        if page < last:
+            base = "{}{}".format(fake.url, parsed.path)
+            links = []
+            for rel, number in (("next", page + 1), ("last", last)):
+                params = dict((k, v[0]) for k, v in query.items())
+                params["page"] = str(number)
+                links.append('<{}?{}>; rel="{}"'.format(
+                    base,
+                    "&".join("{}={}".format(k, v) for k, v in params.items()),
+                    rel))
+            headers["Link"] = ", ".join(links)
+        self.send_json(200, data, headers=headers)
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length).decode("utf-8"))
+        fake.count_request(self.path, self.headers)
+        self.rate_headers = {}
+        if urlparse(self.path).path != "/graphql":
+            self.send_json(404, {"message": "Not Found"})
+            return
+        if not self.headers.get("Authorization"):
+            self.send_json(401, {"message": "This endpoint requires you to"
+                                            " be authenticated."})
+            return
+        self.rate_headers = fake.use_quota(self.headers.get("Authorization"),
+                                           resource="graphql")
+        if self.rate_headers.get("X-RateLimit-Remaining") == "-1":
+            self.rate_headers["X-RateLimit-Remaining"] = "0"
+            self.send_json(200, {"errors": [{
+                "type": "RATE_LIMITED",
+                "message": "API rate limit exceeded",
+            }]})
+            return
+        self.send_json(200, {"data": fake.graphql_data(
+            request.get("query") or "", request.get("variables") or {})})
+
+    def send_json(self, code, data, headers=None):
+        fake = self.server.fake
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        rate_headers = getattr(self, 'rate_headers', None) or {}
+        if code == 200 and self.headers.get("If-None-Match") == etag:
+            fake.count_not_modified()
+            rate_headers = fake.refund_quota(
+                self.headers.get("Authorization"), rate_headers)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            for key, value in rate_headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 200:
+            self.send_header("ETag", etag)
+        for key, value in list((headers or {}).items()) \
+                + list(rate_headers.items()):
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGitHub:
+    """Serve repo listings for local repos on 127.0.0.1.
+
+    Example:
+        fake = FakeGitHub()
+        fake.add_repo("some-org", "some-repo", "/tmp/fixtures/x.git")
+        fake.start()
+        collection.api_url = fake.url
+    """
+
+    handler_class = FakeGitHubHandler
+
+    def __init__(self):
+        self.repos = {}  # owner to list of repo dicts (listing order)
+        self.requests = 0
+        self.not_modified = 0
+        self.paths = []
+        self.url = None
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._clock = time.time()
+        self.rate_limit = None  # requests per window per token if set
+        self.search_rate_limit = None  # defaults to rate_limit
+        self.rate_window = 3600  # seconds
+        self._quotas = {}  # (token, resource) to [reset, used]
+        self._failures = []  # (status, retry_after) for fail_next
+        self.parents = {}  # full name of a fork to its parent's
+
+    def add_repo(self, owner, name, path, size_kb=0, fork=False,
+                 default_branch="main", pushed_at=None, parent=None):
+        """Add a repo whose ssh_url and clone_url are path (file URL).
+
+        Args:
+            parent (str, optional): Full name of the repo a fork was
+                forked from (only in the response for the repo itself
+                and in GraphQL listings, like GitHub).
+
+        Returns:
+            dict: The listing entry (may be modified to change it).
+        """
+        url = "file://" + path
+        now = time.time()
+        repo = {
+            "name": name,
+            "full_name": "{}/{}".format(owner, name),
+            "fork": fork,
+            "git_url": url,
+            "ssh_url": url,
+            "clone_url": url,
+            "size": size_kb,
+            "default_branch": default_branch,
+            "pushed_at": pushed_at or iso_time(now),
+            "updated_at": pushed_at or iso_time(now),
+        }
+        with self._lock:
+            self._clock = max(self._clock, now)
+            self.repos.setdefault(owner, []).append(repo)
+            if parent:
+                self.parents[repo["full_name"]] = parent
+        return repo
+
+    def touch(self, full_name, timestamp=None):
+        """Update pushed_at of a repo (call after pushing to it).
+
+        pushed_at only has whole seconds, so each touch is at least one
+        second later than the last touch or added repo (otherwise a
+        quick change could look like no change).
+        """
+        owner = full_name.split("/")[0]
+        with self._lock:
+            if timestamp is None:
+                timestamp = max(time.time(), self._clock + 1)
+            self._clock = timestamp
+            for repo in self.repos.get(owner, []):
+                if repo["full_name"] == full_name:
+                    repo["pushed_at"] = iso_time(timestamp)
+                    repo["updated_at"] = repo["pushed_at"]
+                    return repo
+        raise KeyError(full_name)
+
+    def list_repos(self, owner):
+        with self._lock:
+            return [dict(repo) for repo in self.repos.get(owner, [])]
+
+    def get_repo(self, full_name):
+        """Get a repo as the API returns it alone (with "parent")."""
+        for repo in self.list_repos(full_name.split("/")[0]):
+            if repo["full_name"] == full_name:
+                with self._lock:
+                    parent = self.parents.get(full_name)
+                if parent:
+                    repo["parent"] = {"full_name": parent}
+                return repo
+        return None
+
+    @staticmethod
+    def _ref_nodes(repo):
+        """Get the branches of a listed repo as GraphQL ref nodes."""
+        path = repo["clone_url"][len("file://"):]
+        output = subprocess.check_output(
+            ["git", "-C", path, "for-each-ref",
+             "--format=%(refname:short) %(objectname)", "refs/heads/"])
+        nodes = []
+        for line in output.decode("utf-8").splitlines():
+            name, oid = line.split()
+            nodes.append({"name": name, "target": {"oid": oid}})
+        return nodes
+
+    @staticmethod
+    def _connection(nodes, first, cursor):
+        """Get one page of nodes (the cursor is the index as a str)."""
+        start = int(cursor) if cursor else 0
+        end = start + first
+        return {
+            "pageInfo": {
+                "hasNextPage": end < len(nodes),
+                "endCursor": str(end),
+            },
+            "nodes": nodes[start:end],
+        }
+
+    def graphql_data(self, query, variables):
+        """Answer the queries of list_repos_graphql.
+
+        Only the query shapes used there are supported (which one is
+        chosen by whether query asks for repositoryOwner).
+        """
+        refs_first = variables.get("refsFirst") or 100
+        if "repositoryOwner" not in query:
+            owner = variables.get("owner")
+            for repo in self.list_repos(owner):
+                if repo["name"] == variables.get("name"):
+                    return {"repository": {"refs": self._connection(
+                        self._ref_nodes(repo), refs_first,
+                        variables.get("cursor"))}}
+            return {"repository": None}
+        login = variables.get("login")
+        with self._lock:
+            known = login in self.repos
+        if not known:
+            return {"repositoryOwner": None}
+        nodes = []
+        for repo in self.list_repos(login):
+            url = repo["clone_url"]
+            if url.endswith(".git"):
+                url = url[:-len(".git")]
+            parent = self.parents.get(repo["full_name"])
+            nodes.append({
+                "name": repo["name"],
+                "nameWithOwner": repo["full_name"],
+                "isFork": repo["fork"],
+                "diskUsage": repo["size"],
+                "sshUrl": repo["ssh_url"],
+                "url": url,
+                "pushedAt": repo["pushed_at"],
+                "updatedAt": repo["updated_at"],
+                "defaultBranchRef": {"name": repo["default_branch"]},
+                "parent": ({"nameWithOwner": parent} if parent else None),
+                "refs": self._connection(self._ref_nodes(repo), refs_first,
+                                         None),
+            })
+        return {"repositoryOwner": {"repositories": self._connection(
+            nodes, variables.get("first") or 100, variables.get("cursor"))}}
+
+    def count_request(self, path, headers):
+        with self._lock:
+            self.requests += 1
+            self.paths.append(path)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def fail_next(self, count=1, status=429, retry_after=1):
+        """Answer the next count requests as a secondary rate limit.
+
+        Args:
+            status (int, optional): 429 or 403 (GitHub uses either).
+            retry_after (int, optional): Retry-After header value (None
+                to leave it out).
+        """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def take_failure(self):
+        with self._lock:
+            if self._failures:
+                return self._failures.pop(0)
+        return None
+
+    def use_quota(self, token, search=False, resource="core"):
+        """Count a request against a token's quota.
+
+        Args:
+            search (bool, optional): Count against "search" (which has
+                its own limit, search_rate_limit).
+            resource (str, optional): Such as "graphql" (counted
+                separately but with the rate_limit).
+
+        Returns:
+            dict: X-RateLimit-* headers (empty if rate_limit is None).
+                X-RateLimit-Remaining is "-1" if the quota was already
+                used up (the request should be refused).
+        """
+        limit = self.rate_limit
+        if search:
+            resource = "search"
+            if self.search_rate_limit is not None:
+                limit = self.search_rate_limit
+        if limit is None:
+            return {}
+        now = time.time()
+        with self._lock:
+            quota = self._quotas.get((token, resource))
+            if quota is None or quota[0] <= now:
+                quota = [int(now) + self.rate_window, 0]
+                self._quotas[(token, resource)] = quota
+            refused = quota[1] >= limit
+            if not refused:
+                quota[1] += 1
+            return {
+                "X-RateLimit-Limit": str(limit),
+                "X-RateLimit-Remaining": ("-1" if refused
+                                          else str(limit - quota[1])),
+                "X-RateLimit-Used": str(quota[1]),
+                "X-RateLimit-Reset": str(quota[0]),
+                "X-RateLimit-Resource": resource,
+            }
+
+    def refund_quota(self, token, rate_headers):
+        """Undo use_quota for a 304 response (which doesn't count).
+
+        Returns:
+            dict: Corrected headers.
+        """
+        if not rate_headers:
+            return rate_headers
+        resource = rate_headers["X-RateLimit-Resource"]
+        with self._lock:
+            quota = self._quotas[(token, resource)]
+            quota[1] -= 1
+            limit = int(rate_headers["X-RateLimit-Limit"])
+            return dict(rate_headers, **{
+                "X-RateLimit-Remaining": str(limit - quota[1]),
+                "X-RateLimit-Used": str(quota[1]),
+            })
+
+    def start(self, port=0):
+        """Start serving in a background thread.
+
+        Returns:
+            str: Base URL such as "http://127.0.0.1:54321".
+        """
+        self._server = _ThreadingHTTPServer(("127.0.0.1", port),
+                                            self.handler_class)
+        self._server.fake = self
+        self.url = "http://127.0.0.1:{}".format(self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
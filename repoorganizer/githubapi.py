@@ -0,0 +1,488 @@
+"""Helpers for paginated GitHub REST API listings.
+
+See <https://docs.github.com/en/rest/using-the-rest-api/using-pagination-in-the-rest-api>
+"""  # noqa: E501
+from __future__ import print_function
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from repoorganizer.httpclient import default_client
+from repoorganizer.ratelimit import (
+    default_limiter,
+    token_label,
+    url_resource,
+)
+from repoorganizer.tracing import span
+
+if sys.version_info.major >= 3:
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+else:
+    from urllib2 import HTTPError  # type:ignore
+    from urlparse import urlparse, parse_qs, urlunparse  # type:ignore
+    from urllib import urlencode  # type:ignore
+
+DEFAULT_API_URL = "https://api.github.com"
+PER_PAGE = 100  # maximum allowed by GitHub (default is only 30)
+SEARCH_MAX_RESULTS = 1000  # the search API stops after this many
+# Owner and repo names only have letters, digits, "-", "_" and "." (but
+#   neither is ever "." or "..").
+FULL_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+$")
+
+
+def parse_link_header(value):
+    """Parse an HTTP Link header into a dict.
+
+    Args:
+        value (str): Such as '<https://api.github.com/...&page=2>;
+            rel="next", <https://api.github.com/...&page=5>; rel="last"'
+
+    Returns:
+        dict[str,str]: URL for each rel, such as {"next": ...,
+            "last": ...}. Empty if value is None or blank.
+    """
+    links = {}
+    if not value:
+        return links
+    for part in value.split(","):
+        sections = part.split(";")
+        url = sections[0].strip()
+        if not (url.startswith("<") and url.endswith(">")):
+            continue
+        url = url[1:-1]
+        for param in sections[1:]:
+            key, _, rel = param.strip().partition("=")
+            if key.strip() == "rel":
+                for name in rel.strip().strip('"').split():
+                    links[name] = url
+    return links
+
+
+def is_full_name(full_name):
+    """Check that full_name is exactly "owner/name" as GitHub allows.
+
+    Names that could leave the owner's directory (such as "..") or
+    contain path separators or other characters are refused, so a
+    full name from an untrusted source is safe to use as a path.
+    """
+    if not full_name or not FULL_NAME_PATTERN.match(full_name):
+        return False
+    return all(part not in (".", "..") for part in full_name.split("/"))
+
+
+def set_query(url, **params):
+    """Get url with the given query params added or replaced."""
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query, keep_blank_values=True)
+    for key, value in params.items():
+        query[key] = [str(value)]
+    pairs = []
+    for key, values in query.items():
+        for value in values:
+            pairs.append((key, value))
+    return urlunparse(parsed._replace(query=urlencode(pairs, safe=":/")))
+
+
+def page_number(url):
+    """Get the page query param of url as an int (None if not set)."""
+    values = parse_qs(urlparse(url).query).get("page")
+    if not values:
+        return None
+    try:
+        return int(values[0])
+    except ValueError:
+        return None
+
+
+def _error_text(e):
+    """Get the body of an HTTPError without consuming it."""
+    getvalue = getattr(getattr(e, 'fp', None), 'getvalue', None)
+    if getvalue is None:
+        return ""
+    return getvalue().decode("utf-8", errors="replace")
+
+
+def fetch_json(url, headers=None, limiter=None, body=None):
+    """Download and decode one JSON API response.
+
+    The request waits if needed to stay within the rate limit, and is
+    retried after the time the server asks for if it was rate limited
+    (see RateLimiter).
+
+    Args:
+        url (str): API URL.
+        headers (dict[str,str], optional): Request headers.
+        limiter (RateLimiter, optional): Defaults to default_limiter().
+        body (bytes, optional): Send a POST with this body (otherwise a
+            GET).
+
+    Returns:
+        tuple(object, dict): The decoded JSON and the response headers.
+            HTTPError (other than a rate limit that was retried) or
+            URLError are not handled here.
+
+    Raises:
+        QuotaExhausted: The quota won't reset within limiter.max_wait.
+    """
+    if limiter is None:
+        limiter = default_limiter()
+    key = (token_label(headers), url_resource(url))
+    method = "GET" if body is None else "POST"
+    attempt = 0
+    while True:
+        limiter.wait(key)
+        try:
+            response = default_client().request(method, url,
+                                                headers=headers, body=body)
+        except HTTPError as e:
+            key = limiter.update(key, e.headers, counted=(e.code != 304))
+            delay = limiter.retry_delay(key, e.code, e.headers, attempt,
+                                        text=_error_text(e))
+            if delay is None or delay > limiter.max_wait:
+                raise
+            print("{} {} (rate limited), retrying in {:.0f}s".format(
+                e.code, url, delay))
+            e.close()
+            limiter.sleep(delay)
+            attempt += 1
+            continue
+        limiter.update(key, response.headers)
+        return json.loads(response.body.decode("utf-8")), response.headers
+
+
+def page_items(data):
+    """Get the list of repos from one page of a listing.
+
+    Search results (dict) have the list under "items" while org and
+    user listings are a list already.
+    """
+    if isinstance(data, dict):
+        # Example:
+        # {
+        #   "total_count": 31,
+        #   "incomplete_results": false,
+        #   "items": [
+        items = data.get('items')
+        if items is None:
+            raise ValueError("Expected 'items' field, got only {}"
+                             .format([x for x in data]))
+        return items
+    return data
+
+
+def iso_time(timestamp):
+    """Format a time like GitHub does, such as "2024-01-31T12:00:00Z"."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def search_repos_url(api_url, qualifiers):
+    """Get the URL of a repository search.
+
+    Args:
+        api_url (str): Such as DEFAULT_API_URL.
+        qualifiers (list[str]): Such as ["org:some-org", "fork:true",
+            "pushed:>2024-01-31T12:00:00Z"].
+    """
+    return "{}/search/repositories?{}".format(api_url, urlencode(
+        [("q", " ".join(qualifiers)), ("per_page", PER_PAGE)], safe=":"))
+
+
+def search_repos(url, headers=None):
+    """Get every result of a repository search, following next links.
+
+    Returns:
+        list[dict]: Listing entries (without the search-only "score"),
+            or None if the search can't return every result (more than
+            SEARCH_MAX_RESULTS, or GitHub reported incomplete_results).
+    """
+    items = []
+    while url:
+        with span("GET search page {}".format(page_number(url) or 1),
+                  cat="api", url=url) as trace_args:
+            data, response_headers = fetch_json(url, headers=headers)
+            trace_args['status'] = 200
+        if data.get('incomplete_results') \
+                or (data.get('total_count') or 0) > SEARCH_MAX_RESULTS:
+            return None
+        for item in page_items(data):
+            item.pop('score', None)
+            items.append(item)
+        url = parse_link_header(response_headers.get("Link")).get('next')
+    return items
+
+
+class PageCache:
+    """Validators (ETag, Last-Modified) and items of each listing page.
+
+    Stored as JSON such as {url: {"etag": ..., "last_modified": ...,
+    "links": {...}, "items": [...]}} so that the next run can send a
+    conditional request for each page and reuse the items on a
+    "304 Not Modified" response (which does not count against the
+    rate limit).
+
+    Args:
+        path (str): JSON file such as
+            ~/.config/repo-organizer/cache/github/{name}/pages.json
+        compact (Callable, optional): Reduce each item before storing
+            it (such as listing.compact_item), so the cache stays small
+            when items have many keys.
+    """
+
+    def __init__(self, path, compact=None):
+        self.path = path
+        self.compact = compact
+        self.pages = {}
+        self.changed = False
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as stream:
+                    self.pages = json.load(stream)
+            except ValueError:
+                # Treat a corrupt cache as empty (cost is only a download).
+                self.pages = {}
+
+    def get(self, url):
+        with self._lock:
+            return self.pages.get(url)
+
+    def _compacted(self, entry):
+        if self.compact is None:
+            return entry
+        return dict(entry,
+                    items=[self.compact(item) for item in entry['items']])
+
+    def put(self, url, entry):
+        entry = self._compacted(entry)
+        with self._lock:
+            self.pages[url] = entry
+            self.changed = True
+
+    def save(self):
+        """Write the cache unless no page was put since it was loaded."""
+        with self._lock:
+            if not self.changed:
+                return
+            parent = os.path.dirname(self.path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            with open(self.path, "w") as stream:
+                # Compact again in case the file was written without it.
+                json.dump({url: self._compacted(entry)
+                           for url, entry in self.pages.items()}, stream)
+            self.changed = False
+
+
+def fetch_page(url, headers=None, cache=None, revalidate=True):
+    """Download one page of a listing using a conditional request.
+
+    Args:
+        url (str): API URL of the page.
+        headers (dict[str,str], optional): Request headers.
+        cache (PageCache, optional): Validators and items from the last
+            download of each page. Updated when the page changed.
+        revalidate (bool, optional): Send If-None-Match and
+            If-Modified-Since if the cache has validators for url. Set
+            False to download the page unconditionally.
+
+    Returns:
+        tuple(dict, bool): The cache entry for the page (with "items"
+            and "links") and whether it came from the cache because the
+            server responded 304 Not Modified. Items are only reduced
+            by cache.compact (if set) when they came from the cache.
+    """
+    entry = cache.get(url) if cache is not None else None
+    request_headers = dict(headers or {})
+    if entry and revalidate:
+        if entry.get('etag'):
+            request_headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            request_headers['If-Modified-Since'] = entry['last_modified']
+    with span("GET page {}".format(page_number(url) or 1), cat="api",
+              url=url) as trace_args:
+        try:
+            data, response_headers = fetch_json(url, headers=request_headers)
+        except HTTPError as e:
+            trace_args['status'] = e.code
+            if e.code == 304 and entry:
+                e.close()
+                trace_args['not_modified'] = True
+                return entry, True
+            raise
+        trace_args['status'] = 200
+    entry = {
+        'etag': response_headers.get("ETag"),
+        'last_modified': response_headers.get("Last-Modified"),
+        'links': parse_link_header(response_headers.get("Link")),
+        'items': page_items(data),
+    }
+    if cache is not None:
+        cache.put(url, entry)
+    return entry, False
+
+
+GRAPHQL_REPOS_PER_PAGE = 50
+GRAPHQL_REFS_PER_PAGE = 100
+
+# Branch names and heads are included so that changed repos can be
+#   found without running git (see syncplan.plan_repo).
+GRAPHQL_REPOS_QUERY = """
+query($login: String!, $cursor: String, $first: Int!, $refsFirst: Int!) {
+  repositoryOwner(login: $login) {
+    repositories(first: $first, after: $cursor, ownerAffiliations: OWNER,
+                 orderBy: {field: NAME, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        nameWithOwner
+        isFork
+        diskUsage
+        sshUrl
+        url
+        pushedAt
+        updatedAt
+        defaultBranchRef { name }
+        parent { nameWithOwner }
+        refs(refPrefix: "refs/heads/", first: $refsFirst) {
+          pageInfo { hasNextPage endCursor }
+          nodes { name target { oid } }
+        }
+      }
+    }
+  }
+}
+"""
+
+GRAPHQL_REFS_QUERY = """
+query($owner: String!, $name: String!, $cursor: String, $refsFirst: Int!) {
+  repository(owner: $owner, name: $name) {
+    refs(refPrefix: "refs/heads/", first: $refsFirst, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name target { oid } }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    """The GraphQL API answered with errors instead of data."""
+
+
+def graphql_url(api_url):
+    """Get the GraphQL endpoint for a REST API URL.
+
+    Such as "https://api.github.com/graphql", or for GitHub Enterprise
+    Server, "https://host/api/graphql" for "https://host/api/v3".
+    """
+    api_url = api_url.rstrip("/")
+    if api_url.endswith("/api/v3"):
+        return api_url[:-len("/v3")] + "/graphql"
+    return api_url + "/graphql"
+
+
+def graphql(url, query, variables, headers=None):
+    """Run a GraphQL query.
+
+    Returns:
+        dict: The "data" of the response.
+
+    Raises:
+        GraphQLError: If the response has "errors".
+    """
+    request_headers = dict(headers or {})
+    request_headers["Content-Type"] = "application/json"
+    body = json.dumps({"query": query, "variables": variables})
+    data, _ = fetch_json(url, headers=request_headers,
+                         body=body.encode("utf-8"))
+    errors = data.get("errors")
+    if errors:
+        raise GraphQLError("; ".join(error.get("message") or str(error)
+                                     for error in errors))
+    return data.get("data") or {}
+
+
+def _ref_heads(refs):
+    return {"refs/heads/" + node["name"]: (node.get("target") or {}).get("oid")
+            for node in refs.get("nodes") or []}
+
+
+def graphql_item(node):
+    """Convert a repository node to a REST-style listing entry.
+
+    The entry has the keys used by a sync (with the REST names) plus
+    "heads" ({"refs/heads/main": oid, ...}). Like a single repo from
+    the REST API (but unlike a REST listing), a fork has "parent".
+    """
+    default_branch = (node.get("defaultBranchRef") or {}).get("name")
+    url = node.get("url")
+    parent = node.get("parent")
+    return {
+        "name": node.get("name"),
+        "full_name": node.get("nameWithOwner"),
+        "fork": node.get("isFork"),
+        "ssh_url": node.get("sshUrl"),
+        "clone_url": url + ".git" if url else None,
+        "html_url": url,
+        "size": node.get("diskUsage"),
+        "default_branch": default_branch,
+        "pushed_at": node.get("pushedAt"),
+        "updated_at": node.get("updatedAt"),
+        "heads": _ref_heads(node.get("refs") or {}),
+        "parent": ({"full_name": parent.get("nameWithOwner")}
+                   if parent else None),
+    }
+
+
+def list_repos_graphql(url, login, headers=None):
+    """Yield the repos of an org or user one page at a time.
+
+    Repos with more branches than fit in the first query get the rest
+    from follow-up queries, so "heads" is always complete.
+
+    Args:
+        url (str): GraphQL endpoint (see graphql_url).
+        login (str): Org or user name.
+        headers (dict[str,str], optional): Must include Authorization
+            (the GraphQL API requires a token).
+
+    Yields:
+        list[dict]: Listing entries (see graphql_item) of one page.
+    """
+    cursor = None
+    while True:
+        data = graphql(url, GRAPHQL_REPOS_QUERY, {
+            "login": login,
+            "cursor": cursor,
+            "first": GRAPHQL_REPOS_PER_PAGE,
+            "refsFirst": GRAPHQL_REFS_PER_PAGE,
+        }, headers=headers)
+        owner = data.get("repositoryOwner")
+        if owner is None:
+            raise GraphQLError("No org or user named {}".format(repr(login)))
+        repos = owner["repositories"]
+        items = []
+        for node in repos.get("nodes") or []:
+            item = graphql_item(node)
+            refs = node.get("refs") or {}
+            info = refs.get("pageInfo") or {}
+            while info.get("hasNextPage"):
+                more = graphql(url, GRAPHQL_REFS_QUERY, {
+                    "owner": item["full_name"].split("/")[0],
+                    "name": item["name"],
+                    "cursor": info.get("endCursor"),
+                    "refsFirst": GRAPHQL_REFS_PER_PAGE,
+                }, headers=headers)
+                refs = (more.get("repository") or {}).get("refs") or {}
+                item["heads"].update(_ref_heads(refs))
+                info = refs.get("pageInfo") or {}
+            items.append(item)
+        yield items
+        info = repos.get("pageInfo") or {}
+        if not info.get("hasNextPage"):
+            return
+        cursor = info.get("endCursor")
@@ -0,0 +1,166 @@
+"""Record the progress of each repo in a run, so it can be resumed.
+
+The journal is a JSON lines file that is only ever appended to, so an
+interrupted run (Ctrl-C, reboot, network drop) leaves every line
+written before the interruption. Each line is an event such as:
+
+    {"event": "start", "run": "20240131-120000-1234", "time": ...}
+    {"repo": "some-org/some-repo", "phase": "started", "action": "clone"}
+    {"repo": "some-org/some-repo", "phase": "cloned"}
+    {"repo": "some-org/some-repo", "phase": "done"}
+    {"event": "end", "run": ...}
+
+A run without an "end" event was interrupted. A run started with
+resume=True continues the journal of an interrupted run instead of
+starting a new one (see RunJournal).
+"""
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+
+# Phases of a repo, in order ("failed" may replace any after "started").
+PHASES = ("listed", "started", "cloned", "fetched", "done", "failed")
+FSYNC_INTERVAL = 1.0  # seconds between forced writes to the disk
+
+
+def load_unfinished(path):
+    """Get the state of each repo in the last run, if it was interrupted.
+
+    Args:
+        path (str): Journal file.
+
+    Returns:
+        tuple(str, dict): The run id and {full_name: {'phase': ...,
+            'action': ...}} with the latest phase of each repo, or
+            (None, {}) if there is no journal or its last run ended.
+    """
+    if not os.path.isfile(path):
+        return None, {}
+    run_id = None
+    repos = {}
+    with open(path, "r") as stream:
+        for line in stream:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # cut off by the interruption
+            event = entry.get('event')
+            if event == "start":
+                run_id = entry.get('run')
+                repos = {}
+            elif event == "end":
+                run_id = None
+                repos = {}
+            elif entry.get('repo') and run_id is not None:
+                state = repos.setdefault(entry['repo'], {})
+                state['phase'] = entry.get('phase')
+                if entry.get('action'):
+                    state['action'] = entry['action']
+    if run_id is None:
+        return None, {}
+    return run_id, repos
+
+
+class RunJournal:
+    """Append-only record of the phase of each repo in one run.
+
+    Args:
+        path (str): Journal file, such as
+            ~/.config/repo-organizer/cache/github/run-journal.jsonl
+        resume (bool, optional): Continue the last run if it was
+            interrupted (see is_done and was_cloning). Otherwise (or if
+            it ended) the journal is started over.
+
+    Attributes:
+        previous (dict): The state of each repo in the interrupted run
+            (see load_unfinished), empty unless resuming one.
+        interrupted (int): Repos the last run finished before it was
+            interrupted (0 if it ended), whether resuming or not.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        run_id, repos = load_unfinished(path)
+        self.interrupted = len([state for state in repos.values()
+                                if state.get('phase') == "done"])
+        if run_id is None:
+            self.interrupted = 0
+        self.previous = repos if resume else {}
+        self._lock = threading.Lock()
+        self._synced_at = time.time()
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        if resume and run_id is not None:
+            self.run_id = run_id
+            self._stream = open(path, "a")
+            self._write({'event': "resume", 'run': run_id})
+        else:
+            self.run_id = "{}-{}".format(
+                time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+            self._stream = open(path, "w")
+            self._write({'event': "start", 'run': self.run_id})
+
+    def _write(self, entry, sync=False):
+        entry['time'] = time.time()
+        with self._lock:
+            if self._stream is None:
+                return
+            self._stream.write(json.dumps(entry, sort_keys=True) + "\n")
+            self._stream.flush()
+            # Syncing every line would slow down a run of many small
+            #   repos, so a crash may lose up to FSYNC_INTERVAL.
+            if sync or entry['time'] - self._synced_at >= FSYNC_INTERVAL:
+                os.fsync(self._stream.fileno())
+                self._synced_at = entry['time']
+
+    def mark(self, full_name, phase, **fields):
+        """Record that a repo reached a phase (see PHASES).
+
+        Args:
+            fields: More to record, such as action="clone".
+        """
+        if phase not in PHASES:
+            raise ValueError("Expected one of {} for phase, got {}"
+                             .format(PHASES, repr(phase)))
+        entry = dict(fields, repo=full_name, phase=phase)
+        self._write(entry)
+
+    def mark_listed(self, full_names):
+        """Record that repos were listed (in one write).
+
+        Repos the interrupted run finished are left out, so their "done"
+        stays the latest phase in case this run is interrupted too.
+        """
+        now = time.time()
+        lines = "".join(
+            json.dumps({'repo': full_name, 'phase': "listed", 'time': now},
+                       sort_keys=True) + "\n"
+            for full_name in full_names if not self.is_done(full_name))
+        with self._lock:
+            if self._stream is None:
+                return
+            self._stream.write(lines)
+            self._stream.flush()
+
+    def is_done(self, full_name):
+        """Check whether the interrupted run finished syncing a repo."""
+        return (self.previous.get(full_name) or {}).get('phase') == "done"
+
+    def was_cloning(self, full_name):
+        """Check whether the interrupted run stopped during a clone.
+
+        If so, the repo's directory may only have part of a clone.
+        """
+        state = self.previous.get(full_name) or {}
+        return state.get('phase') == "started" \
+            and state.get('action') == "clone"
+
+    def finish(self):
+        """Record that the run ended (so it won't be resumed) and close."""
+        self._write({'event': "end", 'run': self.run_id}, sync=True)
+        with self._lock:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,303 @@
+"""Keep repo listings small in memory and stream them to disk.
+
+GitHub returns about 100 keys per repo, but a sync only needs a few, so
+each page is reduced to RepoRecord objects as soon as it is downloaded
+and the full page is written to its own file (see ListingStore). That
+way only one page per download thread is ever fully decoded, no matter
+how many repos an org has.
+"""
+from __future__ import print_function
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+# mkstemp only lets the owner read, so new files get the usual mode.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class RepoRecord(object):
+    """The fields of one listing entry that a sync uses.
+
+    Supports read-only dict-style access (record['ssh_url'],
+    record.get('size')) so code written for listing dicts works as-is.
+
+    Attributes:
+        page (int): Page of the listing the repo came from (so the full
+            entry can be found with ListingStore.find), or None.
+    """
+    FIELDS = (
+        "name",
+        "full_name",
+        "fork",
+        "ssh_url",
+        "clone_url",
+        "size",
+        "default_branch",
+        "pushed_at",
+        "updated_at",
+        "heads",  # only from a GraphQL listing (see list_repos_graphql)
+        "parent",  # {"full_name": ...} of a fork, if the listing has it
+    )
+    __slots__ = FIELDS + ("page",)
+
+    def __init__(self, page=None, **fields):
+        self.page = page
+        for key in RepoRecord.FIELDS:
+            setattr(self, key, fields.get(key))
+
+    @classmethod
+    def from_item(cls, item, page=None):
+        """Create from a listing entry (dict), dropping other keys."""
+        return cls(page=page, **{key: item.get(key) for key in cls.FIELDS})
+
+    def __getitem__(self, key):
+        if key not in RepoRecord.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in RepoRecord.FIELDS
+
+    def get(self, key, default=None):
+        if key not in RepoRecord.FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def keys(self):
+        return RepoRecord.FIELDS
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in RepoRecord.FIELDS}
+
+    def __repr__(self):
+        return "RepoRecord({})".format(repr(self.full_name))
+
+
+def compact_item(item):
+    """Reduce a listing entry (dict) to RepoRecord.FIELDS (dict)."""
+    return {key: item.get(key) for key in RepoRecord.FIELDS}
+
+
+def file_hash(path):
+    """Get the SHA-256 (hex) of a file's content, reading it in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_if_changed(path, chunks):
+    """Write text to path unless the file already has the same content.
+
+    The new text is hashed first and compared with the existing file,
+    so an unchanged file is only read (and its mtime is untouched).
+    Otherwise the text goes to a uniquely named temporary file beside
+    path, which then replaces path in one step (os.replace), so a reader
+    never sees a partial file.
+
+    Args:
+        path (str): Destination file.
+        chunks (Union[list[str], Callable]): Text to write, or a
+            function that returns an iterable of it (such as a generator
+            function). A function is called again to write, so the whole
+            text never has to be in memory.
+
+    Returns:
+        bool: True if path was written.
+    """
+    make_chunks = chunks if callable(chunks) else (lambda: chunks)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in make_chunks():
+        data = chunk.encode("utf-8")
+        digest.update(data)
+        size += len(data)
+    if os.path.isfile(path) and os.path.getsize(path) == size \
+            and file_hash(path) == digest.hexdigest():
+        return False
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".", suffix=".tmp")
+    replaced = False
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            for chunk in make_chunks():
+                stream.write(chunk.encode("utf-8"))
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+        replaced = True
+    finally:
+        if not replaced and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def _item_chunks(items):
+    yield "["
+    for number, item in enumerate(items):
+        yield ",\n" if number else "\n"
+        yield json.dumps(item, sort_keys=True)
+    yield "\n]\n"
+
+
+def _write_items(path, items):
+    """Write a JSON list with one entry per line (if changed).
+
+    Unlike indent=2 this adds almost no size, and the file can still be
+    read back a line at a time (see read_items).
+
+    Args:
+        items (Union[list[dict], Callable]): Entries, or a function
+            that returns an iterable of them (see write_if_changed).
+
+    Returns:
+        bool: True if path was written (see write_if_changed).
+    """
+    if callable(items):
+        return write_if_changed(path, lambda: _item_chunks(items()))
+    return write_if_changed(path, lambda: _item_chunks(items))
+
+
+def read_items(path):
+    """Yield each entry of a JSON list written by _write_items.
+
+    Falls back to decoding the whole file at once if it was written
+    some other way (such as by an older version with indent=2).
+    """
+    count = 0
+    with open(path, "r") as stream:
+        if stream.readline().strip() == "[":
+            for line in stream:
+                line = line.strip().rstrip(",")
+                if line == "]":
+                    return
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    if count:
+                        raise
+                    break  # not one entry per line
+                count += 1
+                yield item
+            else:
+                return
+    with open(path, "r") as stream:
+        for item in json.load(stream):
+            yield item
+
+
+class ListingStore:
+    """Full listing pages of one collection, one file per page.
+
+    Args:
+        path (str): Directory such as
+            ~/.config/repo-organizer/cache/github/{name}/pages
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def page_path(self, page):
+        return os.path.join(self.path, "{}.json".format(page))
+
+    def has_page(self, page):
+        return os.path.isfile(self.page_path(page))
+
+    def pages(self):
+        """Get the numbers of the saved pages, in order."""
+        if not os.path.isdir(self.path):
+            return []
+        numbers = []
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext == ".json" and stem.isdigit():
+                numbers.append(int(stem))
+        return sorted(numbers)
+
+    def merge(self, items):
+        """Replace or add entries (by full_name) in the saved pages.
+
+        Entries not already on a page are added to a new page after the
+        last one (which a later full listing overwrites or prunes).
+
+        Args:
+            items (list[dict]): Full listing entries.
+
+        Returns:
+            tuple(list[RepoRecord], list[int]): Every repo on the pages
+                (in page order) and the page numbers.
+        """
+        changed = OrderedDict((item.get('full_name'), item)
+                              for item in items)
+        records = []
+        numbers = self.pages()
+        for page in numbers:
+            page_items = []
+            replaced = False
+            for item in read_items(self.page_path(page)):
+                new_item = changed.pop(item.get('full_name'), None)
+                if new_item is not None:
+                    item = new_item
+                    replaced = True
+                page_items.append(item)
+            if replaced:
+                self.save_page(page, page_items)
+            records.extend(RepoRecord.from_item(item, page=page)
+                           for item in page_items)
+        if changed:
+            page = (numbers[-1] + 1) if numbers else 1
+            added = list(changed.values())
+            self.save_page(page, added)
+            records.extend(RepoRecord.from_item(item, page=page)
+                           for item in added)
+            numbers.append(page)
+        return records, numbers
+
+    def save_page(self, page, items):
+        with self._lock:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+        return _write_items(self.page_path(page), items)
+
+    def find(self, full_name, page):
+        """Get the full listing entry of a repo (None if not found)."""
+        path = self.page_path(page)
+        if not os.path.isfile(path):
+            return None
+        for item in read_items(path):
+            if item.get('full_name') == full_name:
+                return item
+        return None
+
+    def write_listing(self, path, pages):
+        """Join pages (in the order given) into one JSON list at path.
+
+        Only one page at a time is decoded. Page files not in pages
+        (left over from when the listing was longer) are deleted.
+
+        Returns:
+            bool: True if path was written (see write_if_changed).
+        """
+        written = _write_items(path, lambda: self.iter_items(pages))
+        keep = set("{}.json".format(page) for page in pages)
+        for name in os.listdir(self.path):
+            if name.endswith(".json") and name not in keep:
+                os.remove(os.path.join(self.path, name))
+        return written
+
+    def iter_items(self, pages):
+        """Yield the full entry of each repo on pages, in order."""
+        for page in pages:
+            path = self.page_path(page)
+            if not os.path.isfile(path):
+                continue
+            for item in read_items(path):
+                yield item
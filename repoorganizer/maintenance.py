@@ -0,0 +1,371 @@
+"""Keep the object stores of backed up repos fast to fetch into.
+
+Every fetch adds loose objects or a small pack, so after months of
+syncs each repo has thousands of loose objects and dozens of packs,
+and every fetch and status has to look through all of them. This
+stage checks each repo (git count-objects) and only runs what it needs:
+
+- "gc" once there are LOOSE_OBJECTS_LIMIT loose objects (git's own
+  gc.auto), which packs them and writes the commit-graph, or once
+  there are garbage files that weren't there at the last check (those
+  gc can't remove are only logged).
+- "repack" once there are PACKS_LIMIT packs (gc.autoPackLimit), into
+  one pack.
+- "commit-graph" (written incrementally with --split) if a pack is
+  newer than it, so walking history doesn't have to parse commits.
+- "multi-pack-index" if there are several packs and one is newer than
+  the index, so an object is found with one lookup instead of one per
+  pack.
+
+Each repo's result is recorded in the index (see
+RepoIndex.record_maintenance), and a repo not synced since its last
+maintenance is not even checked. Repos needing the most work go first,
+and no task is started once the time budget is used up, so the rest
+wait for the next run.
+
+Objects of a repo that forks borrow from (see
+RepoCollection.reference_dir) are never pruned: gc runs with
+--prune=never and repack keeps unreachable objects, since a fork may
+still need them.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+
+from repoorganizer.moregitcli import (
+    count_objects,
+    is_shallow_repo,
+    objects_dir,
+    protect_shared_objects,
+    read_alternates,
+    run_git,
+    run_sync,
+)
+from repoorganizer.repocollection import repo_lock
+from repoorganizer.syncpool import run_pool
+from repoorganizer.tracing import span
+
+MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(MODULE_DIR)
+REPOS_DIR = os.path.dirname(REPO_DIR)
+if os.path.isfile(os.path.join(REPOS_DIR, "hierosoft", "hierosoft",
+                               "__init__.py")):
+    sys.path.insert(0, os.path.join(REPOS_DIR, "hierosoft"))
+
+from hierosoft.logging2 import getLogger  # noqa: E402  #type:ignore
+
+logger = getLogger(__name__)
+
+TASKS = ("gc", "repack", "commit-graph", "multi-pack-index")
+LOOSE_OBJECTS_LIMIT = 6700  # same as git's gc.auto
+PACKS_LIMIT = 50  # same as git's gc.autoPackLimit
+RECHECK_DAYS = 30  # check a repo this often even if it wasn't synced
+# gc keeps unreachable loose objects this long (git's gc.pruneExpire).
+PRUNE_EXPIRE_DAYS = 14
+DEFAULT_BUDGET_MINUTES = 30
+DEFAULT_JOBS = 2
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def newest_pack_time(repo_path):
+    """Get the modification time of the newest pack (None if none)."""
+    pack_dir = os.path.join(objects_dir(repo_path), "pack")
+    if not os.path.isdir(pack_dir):
+        return None
+    times = [_mtime(os.path.join(pack_dir, name))
+             for name in os.listdir(pack_dir) if name.endswith(".pack")]
+    times = [mtime for mtime in times if mtime is not None]
+    return max(times) if times else None
+
+
+def commit_graph_time(repo_path):
+    """Get when the commit-graph was last written (None if never)."""
+    info_dir = os.path.join(objects_dir(repo_path), "info")
+    times = [_mtime(os.path.join(info_dir, "commit-graph")),
+             _mtime(os.path.join(info_dir, "commit-graphs",
+                                 "commit-graph-chain"))]
+    times = [mtime for mtime in times if mtime is not None]
+    return max(times) if times else None
+
+
+def plan_tasks(repo_path, stats, last=None, now=None):
+    """Decide which maintenance tasks a repo needs.
+
+    Args:
+        repo_path (str): The repo's directory.
+        stats (dict): Its count_objects.
+        last (dict, optional): Its latest maintenance (see
+            RepoIndex.last_maintenance). Loose objects a recent gc left
+            (unreachable ones it may not prune yet) don't count, so gc
+            isn't run again for the same ones. Neither do garbage files
+            (see count_objects) that were there at the last check, since
+            gc doesn't remove every kind (such as stray files in
+            objects/pack).
+
+    Returns:
+        list[str]: Tasks (see TASKS) in the order to run them.
+    """
+    if now is None:
+        now = time.time()
+    loose = stats.get('count', 0)
+    if last and last['loose_after'] and \
+            now - last['started_at'] < PRUNE_EXPIRE_DAYS * 86400:
+        loose -= last['loose_after']
+    garbage = stats.get('garbage', 0)
+    if last and last.get('garbage_after'):
+        garbage -= last['garbage_after']
+    packs = stats.get('packs', 0)
+    if loose >= LOOSE_OBJECTS_LIMIT or garbage > 0:
+        return ["gc"]  # writes the commit-graph too (gc.writeCommitGraph)
+    tasks = []
+    if packs >= PACKS_LIMIT:
+        tasks.append("repack")
+    newest = newest_pack_time(repo_path)
+    if newest is None:
+        return tasks
+    graph_time = commit_graph_time(repo_path)
+    if (tasks or graph_time is None or graph_time < newest) \
+            and not is_shallow_repo(repo_path):
+        tasks.append("commit-graph")
+    midx_time = _mtime(os.path.join(objects_dir(repo_path), "pack",
+                                    "multi-pack-index"))
+    if "repack" not in tasks and packs > 1 \
+            and (midx_time is None or midx_time < newest):
+        tasks.append("multi-pack-index")
+    return tasks
+
+
+def priority(stats):
+    """Get how badly a repo needs maintenance (higher goes first)."""
+    return (stats.get('count', 0) / float(LOOSE_OBJECTS_LIMIT)
+            + stats.get('packs', 0) / float(PACKS_LIMIT))
+
+
+def task_command(repo_path, task, keep_unreachable=False):
+    """Get the git command for a task (see TASKS).
+
+    Args:
+        keep_unreachable (bool, optional): Never drop unreachable
+            objects (for a repo that other repos borrow objects from).
+    """
+    cmd_parts = ["git", "-C", repo_path]
+    if task == "gc":
+        cmd_parts.extend(["gc", "--quiet"])
+        if keep_unreachable:
+            cmd_parts.append("--prune=never")
+    elif task == "repack":
+        # -l leaves objects a fork borrows where they are.
+        if keep_unreachable:
+            cmd_parts.extend(["repack", "-a", "-d", "-l",
+                              "--keep-unreachable"])
+        else:
+            # Unreachable objects become loose, for gc to prune later.
+            cmd_parts.extend(["repack", "-A", "-d", "-l"])
+    elif task == "commit-graph":
+        cmd_parts.extend(["commit-graph", "write", "--reachable", "--split"])
+    elif task == "multi-pack-index":
+        cmd_parts.extend(["multi-pack-index", "write"])
+    else:
+        raise ValueError("Expected one of {} for task, got {}"
+                         .format(TASKS, repr(task)))
+    return cmd_parts
+
+
+def is_due(last, now=None):
+    """Check whether a repo should be checked (see last_maintenance).
+
+    Args:
+        last (dict): The repo's entry from RepoIndex.last_maintenance,
+            or None if it was never checked.
+    """
+    if last is None or not last['ok']:
+        return True
+    if now is None:
+        now = time.time()
+    if now - last['started_at'] >= RECHECK_DAYS * 86400:
+        return True
+    return last['synced_at'] is not None \
+        and last['synced_at'] > last['started_at']
+
+
+def maintain_repo(repo, deadline, keep_unreachable=False):
+    """Run the tasks planned for one repo, unless out of time.
+
+    Args:
+        repo (dict): From maintain_collections, with 'full_name',
+            'path', 'stats' and 'tasks'.
+        deadline (float): Don't start a task after this time.
+        keep_unreachable (bool, optional): See task_command.
+
+    Returns:
+        dict: Summary with 'full_name', 'tasks' (run), 'skipped' (not
+            run for lack of time), 'ok', 'errors', 'duration', 'before'
+            and 'after' (count_objects).
+    """
+    summary = {
+        'full_name': repo['full_name'],
+        'tasks': [],
+        'skipped': [],
+        'ok': True,
+        'errors': [],
+        'duration': 0.0,
+        'before': repo['stats'],
+        'after': repo['stats'],
+    }
+    start = time.time()
+    with repo_lock(repo['path']):
+        for task in repo['tasks']:
+            if time.time() >= deadline:
+                summary['skipped'].append(task)
+                continue
+            cmd_parts = task_command(repo['path'], task,
+                                     keep_unreachable=keep_unreachable)
+            result = run_sync(run_git(cmd_parts, check=False))
+            summary['tasks'].append(task)
+            if result.returncode != 0:
+                msg = "`{}` failed: {}".format(" ".join(cmd_parts[3:]),
+                                               result.stderr.strip())
+                logger.error("{} in {}".format(msg, repo['path']))
+                summary['ok'] = False
+                summary['errors'].append(msg)
+                break
+        if summary['tasks']:
+            summary['after'] = count_objects(repo['path']) or {}
+        if "gc" in summary['tasks'] and summary['after'].get('garbage'):
+            # Not retried (see plan_tasks), so someone has to look.
+            logger.warning(
+                "gc left {} garbage file(s) in {} (see git count-objects"
+                " -v)".format(summary['after']['garbage'], repo['path']))
+    summary['duration'] = time.time() - start
+    return summary
+
+
+def maintain_collections(collections, index, budget_minutes=None,
+                         jobs=DEFAULT_JOBS):
+    """Check every synced repo and run the maintenance each one needs.
+
+    Args:
+        collections (list[RepoCollection]): Collections whose repos
+            were synced (or at least listed).
+        index (RepoIndex): Where to look up and record maintenance.
+        budget_minutes (float, optional): Don't start checking or
+            maintaining a repo after this long. Defaults to
+            DEFAULT_BUDGET_MINUTES. 0 for no limit.
+        jobs (int, optional): Repos to check or maintain at once.
+
+    Returns:
+        list[dict]: Summaries (see maintain_repo) of the repos that
+            needed any task, most in need first.
+    """
+    if budget_minutes is None:
+        budget_minutes = DEFAULT_BUDGET_MINUTES
+    start = time.time()
+    deadline = float("inf")
+    if budget_minutes:
+        deadline = start + budget_minutes * 60
+    last = index.last_maintenance()
+    repos = []
+    borrowed = set()
+    for collection in collections:
+        for repo in collection.repos or []:
+            path = collection.repo_dir(repo)
+            if not os.path.isdir(path):
+                continue
+            for objects in read_alternates(path):
+                borrowed.add(os.path.realpath(objects))
+            if is_due(last.get(repo['full_name']), now=start):
+                repos.append({'full_name': repo['full_name'],
+                              'path': path,
+                              'last': last.get(repo['full_name'])})
+
+    def _check(repo):
+        if time.time() >= deadline:
+            return "late"
+        stats = count_objects(repo['path'])
+        if stats is None:
+            return None
+        tasks = plan_tasks(repo['path'], stats, last=repo['last'],
+                           now=start)
+        if not tasks:
+            index.record_maintenance(repo['full_name'], [], True,
+                                     duration=0.0, before=stats,
+                                     after=stats)
+            return None
+        return dict(repo, stats=stats, tasks=tasks)
+
+    with span("maintenance", cat="phase", repos=len(repos)):
+        checked = run_pool(repos, _check, jobs=jobs)
+        planned = [repo for repo in checked if isinstance(repo, dict)]
+        planned.sort(key=lambda repo: -priority(repo['stats']))
+        for repo in planned:
+            repo['shared'] = os.path.realpath(
+                objects_dir(repo['path'])) in borrowed
+            if repo['shared']:
+                protect_shared_objects(repo['path'])
+
+        def _maintain(repo):
+            summary = maintain_repo(repo, deadline,
+                                    keep_unreachable=repo['shared'])
+            if summary['tasks']:
+                errors = summary['errors']
+                index.record_maintenance(
+                    repo['full_name'], summary['tasks'], summary['ok'],
+                    duration=summary['duration'], before=summary['before'],
+                    after=summary['after'],
+                    error=errors[0] if errors else None)
+            return summary
+
+        summaries = run_pool(
+            planned, _maintain, jobs=jobs,
+            on_error=lambda repo, ex: {
+                'full_name': repo['full_name'], 'tasks': [],
+                'skipped': [], 'ok': False,
+                'errors': ["{}: {}".format(type(ex).__name__, ex)],
+                'duration': 0.0, 'before': repo['stats'],
+                'after': repo['stats']})
+    echo_maintenance(summaries, due=len(repos),
+                     not_checked=checked.count("late"))
+    return summaries
+
+
+def echo_maintenance(summaries, due=0, not_checked=0):
+    """Show what maintenance did (see maintain_collections).
+
+    Args:
+        due (int, optional): Repos that were due for a check.
+        not_checked (int, optional): Repos not checked before the
+            budget ran out.
+    """
+    counts = {task: 0 for task in TASKS}
+    skipped = 0
+    before = {'count': 0, 'packs': 0}
+    after = {'count': 0, 'packs': 0}
+    for summary in summaries:
+        for task in summary['tasks']:
+            counts[task] += 1
+        if summary['skipped']:
+            skipped += 1
+        for key in before:
+            before[key] += summary['before'].get(key, 0)
+            after[key] += summary['after'].get(key, 0)
+    print()
+    print("Maintenance: {} repo(s) due, {} needed work ({})".format(
+        due, len(summaries),
+        ", ".join("{} {}".format(counts[task], task) for task in TASKS)))
+    if summaries:
+        print("Loose objects {} -> {}, packs {} -> {}".format(
+            before['count'], after['count'], before['packs'],
+            after['packs']))
+    if skipped or not_checked:
+        print("Out of time for {} repo(s) (left for the next run)"
+              .format(skipped + not_checked))
+    for summary in summaries:
+        for error in summary['errors']:
+            print("- {}: {}".format(summary['full_name'], error))
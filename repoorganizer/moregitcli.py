@@ -1,12 +1,114 @@
+"""Run git commands and parse their output.
+
+Each function has an async version (named *_async) built on
+asyncio.create_subprocess_exec, which parses output line by line as git
+writes it, so one event loop can drive hundreds of git processes at
+once (see gather_limited). The original functions are thin wrappers
+that run the async version to completion.
+"""
+import asyncio
+import os
 import shlex
 import subprocess
 import sys
+import threading
 
 from repoorganizer import emit_cast
+from repoorganizer.tracing import git_subcommand, span
 
 # from typing import List
 
 
+class _ThreadLoop(object):
+    """An event loop that is closed when the thread owning it ends."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+
+    def __del__(self):
+        self.loop.close()
+
+
+_thread_loops = threading.local()
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from synchronous code.
+
+    Each thread (such as a syncpool worker) keeps one event loop for
+    all of its calls instead of creating one per git command.
+    """
+    holder = getattr(_thread_loops, "holder", None)
+    if holder is None:
+        holder = _ThreadLoop()
+        _thread_loops.holder = holder
+    return holder.loop.run_until_complete(coro)
+
+
+async def gather_limited(coros, limit=16):
+    """Await coroutines with at most limit of them running at once.
+
+    Returns:
+        list: Results in the same order as coros.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _limited(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[_limited(coro) for coro in coros])
+
+
+async def run_git(cmd_parts, on_line=None, check=True, cwd=None):
+    """Run a git command, reading its output line by line.
+
+    Args:
+        cmd_parts (list[str]): Such as ["git", "-C", path, "branch"].
+        on_line (Callable, optional): Called with each line of stdout
+            (without the newline) as soon as it is read, in which case
+            the lines are not also kept in memory.
+        check (bool, optional): Raise subprocess.CalledProcessError
+            (with stderr) if git fails, like subprocess.run.
+        cwd (str, optional): Working directory for the process.
+
+    Returns:
+        subprocess.CompletedProcess: With text stdout (empty if on_line
+            was used) and stderr.
+    """
+    with span("git " + git_subcommand(cmd_parts), cat="git",
+              cmd=shlex.join(cmd_parts)) as trace_args:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd_parts,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+        )
+        lines = []
+
+        async def _read_stdout():
+            while True:
+                raw = await proc.stdout.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+                if on_line is not None:
+                    on_line(line)
+                else:
+                    lines.append(line)
+
+        _, err = await asyncio.gather(_read_stdout(), proc.stderr.read())
+        code = await proc.wait()
+        trace_args['exit_code'] = code
+    stdout = "\n".join(lines)
+    stderr = err.decode("utf-8", errors="replace")
+    if check and code != 0:
+        raise subprocess.CalledProcessError(code, cmd_parts, output=stdout,
+                                            stderr=stderr)
+    return subprocess.CompletedProcess(cmd_parts, code, stdout=stdout,
+                                       stderr=stderr)
+
+
 # def list_remote_branches(repo_path: str, name_only: bool) -> List[str]:
 def list_remote_branches(repo_path, name_only=True, trunks=["origin"]):
     """List all remote branches in a local Git repository,
@@ -34,52 +136,52 @@ def list_remote_branches(repo_path, name_only=True, trunks=["origin"]):
         List[str]: A list of remote branch names.
             Example where there is no local copy of "test" branch yet:
     """
+    return run_sync(list_remote_branches_async(repo_path,
+                                               name_only=name_only,
+                                               trunks=trunks))
+
+
+async def list_remote_branches_async(repo_path, name_only=True,
+                                     trunks=["origin"]):
+    """See list_remote_branches."""
     if not repo_path:
         raise ValueError(
             "Expected str got {} for repo_path"
             .format(emit_cast(repo_path)))
+    branches = []
+    names = set()
+
+    def _parse(line):
+        branch = line.strip()
+        if not branch:
+            return
+        branches.append(branch)
+        sides = branch.split()
+        parts = sides[0].split("/")
+        if len(parts) != 2:
+            print("Warning: expected trunk/branch got {} in {}"
+                  .format(repr(sides[0]), repr(branch)))
+            return
+        trunk, branch = parts  # such as ["origin", "main"]
+        #   (usually lists both origin and upstream copies of main)
+        if trunks and trunk not in trunks:
+            print("Skipped unknown trunk {} in {}"
+                  .format(repr(trunk), repr(repo_path)))
+            return
+        print("Using trunk {} in {}"
+              .format(repr(trunk), repr(repo_path)))
+        if branch.upper() == "HEAD":
+            # Not a visible branch, just represents what is checked out.
+            return
+        names.add(branch)  # such as "main"
+
     try:
         # Fetch all updates from the remote repository
-        subprocess.run(
-            ["git", "-C", repo_path, "fetch", "--all"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        await run_git(["git", "-C", repo_path, "fetch", "--all"])
 
         # List remote branches
-        result = subprocess.run(
-            ["git", "-C", repo_path, "branch", "-r"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-
-        # Clean and return branch names
-        branches = [
-            branch.strip() for branch in result.stdout.splitlines()
-            if branch.strip()
-        ]
-        names = set()
-        for branch in branches:
-            sides = branch.split()
-            parts = sides[0].split("/")
-            if len(parts) != 2:
-                print("Warning: expected trunk/branch got {} in {}"
-                      .format(repr(sides[0]), repr(branch)))
-                continue
-            trunk, branch = parts  # such as ["origin", "main"]
-            #   (usually lists both origin and upstream copies of main)
-            if trunks and trunk not in trunks:
-                print("Skipped unknown trunk {} in {}"
-                      .format(repr(trunk), repr(repo_path)))
-                continue
-            print("Using trunk {} in {}"
-                  .format(repr(trunk), repr(repo_path)))
-            if branch.upper() == "HEAD":
-                # Not a visible branch, just represents what is checked out.
-                continue
-            names.add(branch)  # such as "main"
+        await run_git(["git", "-C", repo_path, "branch", "-r"],
+                      on_line=_parse)
         if name_only:
             return list(names)
         return branches
@@ -91,27 +193,27 @@ def list_remote_branches(repo_path, name_only=True, trunks=["origin"]):
 
 def current_branch(repo_path):
     """Find out which branch is checked out at the given path."""
+    return run_sync(current_branch_async(repo_path))
+
+
+async def current_branch_async(repo_path):
+    """See current_branch."""
     if not repo_path:
         raise ValueError(
             "Expected str got {} for repo_path"
             .format(emit_cast(repo_path)))
-    try:
-        result = subprocess.run(
-            ["git", "-C", repo_path, "branch"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+    found = []
 
-        # Clean and return branch names
-        branches = [
-            branch.strip() for branch in result.stdout.splitlines()
-            if branch.strip()
-        ]
-        for branch in branches:
-            if branch.startswith("*"):
-                # such as "* main"
-                return branch[1:].strip()
+    def _parse(line):
+        branch = line.strip()
+        if branch.startswith("*"):
+            # such as "* main"
+            found.append(branch[1:].strip())
+
+    try:
+        await run_git(["git", "-C", repo_path, "branch"], on_line=_parse)
+        if found:
+            return found[0]
         return None
 
     except subprocess.CalledProcessError as e:
@@ -119,6 +221,47 @@ def current_branch(repo_path):
         return None
 
 
+def is_bare_repo(repo_path):
+    """Check whether repo_path is a bare repository (such as a mirror).
+
+    Returns:
+        bool: True if bare, False if it has a working tree or is not a
+            repository.
+    """
+    return run_sync(is_bare_repo_async(repo_path))
+
+
+async def is_bare_repo_async(repo_path):
+    """See is_bare_repo."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    result = await run_git(
+        ["git", "-C", repo_path, "rev-parse", "--is-bare-repository"],
+        check=False,
+    )
+    return result.returncode == 0 and result.stdout.strip() == "true"
+
+
+def is_shallow_repo(repo_path):
+    """Check whether repo_path is a shallow clone (has limited depth)."""
+    return run_sync(is_shallow_repo_async(repo_path))
+
+
+async def is_shallow_repo_async(repo_path):
+    """See is_shallow_repo."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    result = await run_git(
+        ["git", "-C", repo_path, "rev-parse", "--is-shallow-repository"],
+        check=False,
+    )
+    return result.returncode == 0 and result.stdout.strip() == "true"
+
+
 def switch_branch(repo_path, set_branch):
     """Find out which branch is checked out at the given path.
 
@@ -129,6 +272,11 @@ def switch_branch(repo_path, set_branch):
             - 'trunk_and_branch': such as "origin/main"
             - 'name': such as "main"
     """
+    return run_sync(switch_branch_async(repo_path, set_branch))
+
+
+async def switch_branch_async(repo_path, set_branch):
+    """See switch_branch."""
     if not repo_path:
         raise ValueError(
             "Expected str got {} for repo_path"
@@ -141,12 +289,7 @@ def switch_branch(repo_path, set_branch):
             .format(emit_cast(set_branch)))
     try:
         cmd_parts = ["git", "-C", repo_path, "switch", set_branch]
-        result = subprocess.run(
-            cmd_parts,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        result = await run_git(cmd_parts)
         # Example (doesn't raise exception in Windows, somehow...):
         # fatal: cannot change to ''C:\Users\redacted\git\depot-launcher'': Invalid argument  # noqa:E501
         # C:\Users\redacted\git\Depot>echo %ERRORLEVEL%
@@ -223,14 +366,14 @@ def switch_branch(repo_path, set_branch):
 
 
 def pull_repo(repo_path):
+    return run_sync(pull_repo_async(repo_path))
+
+
+async def pull_repo_async(repo_path):
+    """See pull_repo."""
     try:
         cmd_parts = ["git", "-C", repo_path, "pull"]
-        result = subprocess.run(
-            cmd_parts,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        result = await run_git(cmd_parts)
         print("Stderr: {}".format(result.stderr))
         print(shlex.join(cmd_parts).replace("'", '"'))
         # ^ Only double quote (") allowed for Command Prompt on Windows
@@ -254,3 +397,486 @@ def pull_repo(repo_path):
     except subprocess.CalledProcessError as e:
         print("CalledProcessError: {}".format(e.stderr.strip()))
         return None
+
+
+def is_ancestor(repo_path, ancestor, descendant):
+    """Check whether ancestor is reachable from descendant."""
+    return run_sync(is_ancestor_async(repo_path, ancestor, descendant))
+
+
+async def is_ancestor_async(repo_path, ancestor, descendant):
+    """See is_ancestor."""
+    result = await run_git(
+        ["git", "-C", repo_path, "merge-base", "--is-ancestor",
+         ancestor, descendant],
+        check=False,
+    )
+    return result.returncode == 0
+
+
+class RepoState:
+    """Snapshot of HEAD, branches, and tracking info of a repository.
+
+    Read by read_repo_state using a single `git for-each-ref` call.
+
+    Attributes:
+        path (str): Path to the repository.
+        head (str): Checked-out branch such as "main", or None if HEAD
+            is detached (or not a branch).
+        local (dict[str,str]): Local branch name to object id.
+        remote (dict[str,str]): Remote branch such as "origin/main" to
+            object id (excluding symbolic refs such as origin/HEAD).
+        upstream (dict[str,str]): Local branch name to its upstream such
+            as "origin/main" (only branches that track one).
+        ahead (dict[str,int]): Local branch name to the number of
+            commits not on its upstream.
+        behind (dict[str,int]): Local branch name to the number of
+            upstream commits not on the local branch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.head = None
+        self.local = {}
+        self.remote = {}
+        self.upstream = {}
+        self.ahead = {}
+        self.behind = {}
+
+    def remote_branches(self, remote="origin"):
+        """Get branches of one remote such as {"main": object id}."""
+        prefix = remote + "/"
+        return {name[len(prefix):]: objectname
+                for name, objectname in self.remote.items()
+                if name.startswith(prefix)}
+
+    def heads(self):
+        """Get local branches by full ref name such as "refs/heads/main"."""
+        return {"refs/heads/" + name: objectname
+                for name, objectname in self.local.items()}
+
+
+REPO_STATE_FORMAT = "%00".join([
+    "%(HEAD)",
+    "%(refname)",
+    "%(objectname)",
+    "%(symref)",
+    "%(upstream:short)",
+    "%(upstream:track,nobracket)",
+])
+
+_repo_states = {}
+_repo_states_lock = threading.Lock()
+
+
+def read_repo_state(repo_path, cached=True):
+    """Get a RepoState for a repository.
+
+    Args:
+        repo_path (str): Path to the local Git repository.
+        cached (bool, optional): Reuse the snapshot from earlier in the
+            run if there is one. Call forget_repo_state after anything
+            that changes refs (such as a fetch).
+
+    Returns:
+        RepoState: The snapshot, or None if git failed.
+    """
+    return run_sync(read_repo_state_async(repo_path, cached=cached))
+
+
+def forget_repo_state(repo_path):
+    """Discard the cached RepoState so the next read is fresh."""
+    with _repo_states_lock:
+        _repo_states.pop(os.path.realpath(repo_path), None)
+
+
+async def read_repo_state_async(repo_path, cached=True):
+    """See read_repo_state."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    key = os.path.realpath(repo_path)
+    if cached:
+        with _repo_states_lock:
+            state = _repo_states.get(key)
+        if state is not None:
+            return state
+    state = RepoState(repo_path)
+
+    def _parse(line):
+        fields = line.split("\0")
+        if len(fields) != 6:
+            return
+        head, refname, objectname, symref, upstream, track = fields
+        if symref:
+            return  # such as refs/remotes/origin/HEAD
+        if refname.startswith("refs/heads/"):
+            name = refname[len("refs/heads/"):]
+            state.local[name] = objectname
+            if head == "*":
+                state.head = name
+            if upstream:
+                state.upstream[name] = upstream
+                state.ahead[name] = 0
+                state.behind[name] = 0
+            # track is such as "ahead 1, behind 2", "gone" or ""
+            for part in track.split(","):
+                words = part.split()
+                if len(words) == 2 and words[0] in ("ahead", "behind"):
+                    getattr(state, words[0])[name] = int(words[1])
+        elif refname.startswith("refs/remotes/"):
+            state.remote[refname[len("refs/remotes/"):]] = objectname
+
+    try:
+        await run_git(
+            ["git", "-C", repo_path, "for-each-ref",
+             "--format=" + REPO_STATE_FORMAT, "refs/heads", "refs/remotes"],
+            on_line=_parse,
+        )
+    except subprocess.CalledProcessError as e:
+        print("CalledProcessError: {}".format(e.stderr.strip()))
+        return None
+    with _repo_states_lock:
+        _repo_states[key] = state
+    return state
+
+
+def update_branches(repo_path, remote="origin", current=None, state=None):
+    """Fast-forward every local tracking branch without checking it out.
+
+    Local branches that don't exist yet are created from the remote
+    branch (tracking it). Branches other than the current one are
+    updated by moving the ref directly (git update-ref), so only the
+    checked-out branch touches the working tree (git merge --ff-only).
+    Fetch first (RepoCollection.sync_repo runs git fetch, then passes
+    the state read afterward).
+
+    Args:
+        repo_path (str): Path to the local Git repository.
+        remote (str, optional): Remote to mirror. Defaults to "origin".
+        current (str, optional): Checked-out branch (from
+            current_branch). Defaults to the head of state.
+        state (RepoState, optional): Snapshot taken after fetching.
+            Read (uncached) if None. Ahead/behind counts in it decide
+            whether a branch can be fast-forwarded, so git merge-base
+            only runs for branches without upstream tracking info.
+
+    Returns:
+        dict[str,list[str]]: Branch names by outcome:
+            - 'created': New local branch tracking the remote one.
+            - 'updated': Fast-forwarded.
+            - 'ahead': Local has commits not on the remote (not forced).
+            - 'diverged': Both have new commits (not forced).
+            - 'local_only': No such branch on the remote.
+            - 'errors': Messages for branches git failed to update.
+    """
+    return run_sync(update_branches_async(repo_path, remote=remote,
+                                          current=current, state=state))
+
+
+async def update_branches_async(repo_path, remote="origin", current=None,
+                                state=None):
+    """See update_branches."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    results = {
+        'created': [],
+        'updated': [],
+        'ahead': [],
+        'diverged': [],
+        'local_only': [],
+        'errors': [],
+    }
+    if state is None:
+        state = await read_repo_state_async(repo_path, cached=False)
+    if state is None:
+        results['errors'].append("Could not list refs in {}"
+                                 .format(repo_path))
+        return results
+    if current is None:
+        current = state.head
+    local = state.local
+    remote_heads = state.remote_branches(remote)
+    for name in sorted(local):
+        if name not in remote_heads:
+            results['local_only'].append(name)
+    changed = False
+    for name in sorted(remote_heads):
+        new = remote_heads[name]
+        old = local.get(name)
+        trunk_and_branch = "{}/{}".format(remote, name)
+        if old == new:
+            continue
+        if old is None:
+            fast_forward = None
+        elif state.upstream.get(name) == trunk_and_branch:
+            # Counts are from the same for-each-ref call as the ids.
+            ahead = state.ahead.get(name, 0)
+            behind = state.behind.get(name, 0)
+            fast_forward = not ahead
+            if ahead and not behind:
+                results['ahead'].append(name)
+                continue
+            if ahead:
+                results['diverged'].append(name)
+                continue
+        elif await is_ancestor_async(repo_path, old, new):
+            fast_forward = True
+        elif await is_ancestor_async(repo_path, new, old):
+            results['ahead'].append(name)
+            continue
+        else:
+            results['diverged'].append(name)
+            continue
+        if fast_forward is None:
+            cmd_parts = ["git", "-C", repo_path, "branch", "--track",
+                         name, trunk_and_branch]
+            key = 'created'
+        elif name == current:
+            cmd_parts = ["git", "-C", repo_path, "merge", "--ff-only",
+                         trunk_and_branch]
+            key = 'updated'
+        else:
+            cmd_parts = ["git", "-C", repo_path, "update-ref",
+                         "refs/heads/" + name, new, old]
+            key = 'updated'
+        try:
+            await run_git(cmd_parts)
+            results[key].append(name)
+            changed = True
+        except subprocess.CalledProcessError as e:
+            results['errors'].append("`{}` failed: {}".format(
+                shlex.join(cmd_parts), e.stderr.strip()))
+    if changed:
+        forget_repo_state(repo_path)
+    for key in ('ahead', 'diverged', 'local_only'):
+        if results[key]:
+            print("Warning: {} branch(es) in {} not updated: {}"
+                  .format(key, repr(repo_path), results[key]))
+    return results
+
+
+def ls_remote(url, heads_only=True):
+    """Get the refs of a remote repository without fetching.
+
+    Args:
+        url (str): Remote URL (or path) as used by git clone.
+        heads_only (bool, optional): List branches only (default),
+            otherwise also tags, pull request refs, etc.
+
+    Returns:
+        dict[str,str]: Full ref name (such as "refs/heads/main") to
+            object id. None if git failed (error is shown).
+    """
+    return run_sync(ls_remote_async(url, heads_only=heads_only))
+
+
+async def ls_remote_async(url, heads_only=True):
+    """See ls_remote."""
+    cmd_parts = ["git", "ls-remote"]
+    if heads_only:
+        cmd_parts.append("--heads")
+    cmd_parts.append(url)
+    refs = {}
+
+    def _parse(line):
+        parts = line.split()
+        if len(parts) != 2:
+            return
+        objectname, refname = parts
+        if refname.endswith("^{}"):
+            return  # peeled tag
+        refs[refname] = objectname
+
+    try:
+        await run_git(cmd_parts, on_line=_parse)
+    except subprocess.CalledProcessError as e:
+        print("CalledProcessError: {}".format(e.stderr.strip()))
+        return None
+    return refs
+
+
+def count_objects(repo_path):
+    """Get object store statistics (git count-objects -v).
+
+    Returns:
+        dict[str,int]: Such as {'count': 12, 'size': 48, 'in-pack': 900,
+            'packs': 2, 'size-pack': 1024, 'prune-packable': 0,
+            'garbage': 0, 'size-garbage': 0} where sizes are in KiB.
+            None if git failed (such as if not a repository).
+    """
+    return run_sync(count_objects_async(repo_path))
+
+
+async def count_objects_async(repo_path):
+    """See count_objects."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    stats = {}
+
+    def _parse(line):
+        key, _, value = line.partition(":")
+        try:
+            stats[key.strip()] = int(value.strip())
+        except ValueError:
+            pass
+
+    result = await run_git(["git", "-C", repo_path, "count-objects", "-v"],
+                           on_line=_parse, check=False)
+    if result.returncode != 0:
+        return None
+    return stats
+
+
+def object_store_bytes(repo_path):
+    """Get the size of the object store (loose plus packed) in bytes.
+
+    Returns:
+        int: Size in bytes, or 0 if not a repository (yet).
+    """
+    if not os.path.isdir(repo_path):
+        return 0
+    stats = count_objects(repo_path)
+    if not stats:
+        return 0
+    return (stats.get('size', 0) + stats.get('size-pack', 0)) * 1024
+
+
+def objects_dir(repo_path):
+    """Get a repo's object directory (.git/objects, or objects if bare)."""
+    git_dir = os.path.join(repo_path, ".git")
+    if not os.path.isdir(git_dir):
+        git_dir = repo_path  # bare
+    return os.path.join(git_dir, "objects")
+
+
+def alternates_path(repo_path):
+    """Get the path of a repo's objects/info/alternates file.
+
+    The file lists other object directories the repo borrows objects
+    from (see `git clone --reference`). It may not exist.
+    """
+    return os.path.join(objects_dir(repo_path), "info", "alternates")
+
+
+def read_alternates(repo_path):
+    """Get the object directories a repo borrows objects from.
+
+    Returns:
+        list[str]: Absolute paths (empty if none).
+    """
+    path = alternates_path(repo_path)
+    if not os.path.isfile(path):
+        return []
+    objects_dir = os.path.dirname(os.path.dirname(path))
+    dirs = []
+    with open(path, "r") as stream:
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            dirs.append(os.path.normpath(os.path.join(objects_dir, line)))
+    return dirs
+
+
+def is_partial_repo(repo_path):
+    """Check whether repo_path is a partial clone (such as blobless)."""
+    return run_sync(is_partial_repo_async(repo_path))
+
+
+async def is_partial_repo_async(repo_path):
+    """See is_partial_repo."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    # Older git sets extensions.partialClone, but newer git (2.27+) only
+    # marks the remote with remote.<name>.promisor (and a filter).
+    result = await run_git(
+        ["git", "-C", repo_path, "config", "--get-regexp",
+         r"^(extensions\.partialclone"
+         r"|remote\..*\.(promisor|partialclonefilter))$"],
+        check=False,
+    )
+    if result.returncode != 0:
+        return False
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2 and parts[1].strip().lower() != "false":
+            return True
+    return False
+
+
+def protect_shared_objects(repo_path):
+    """Keep git gc from deleting objects that other repos may borrow.
+
+    Objects that become unreachable in repo_path (such as after a
+    force push upstream) may still be used by a repo cloned with
+    --reference to it, so gc.pruneExpire is set to "never".
+
+    Returns:
+        bool: True if ok, otherwise None (error is shown).
+    """
+    return run_sync(protect_shared_objects_async(repo_path))
+
+
+async def protect_shared_objects_async(repo_path):
+    """See protect_shared_objects."""
+    try:
+        await run_git(["git", "-C", repo_path, "config", "gc.pruneExpire",
+                       "never"])
+        return True
+    except subprocess.CalledProcessError as e:
+        print("CalledProcessError: {}".format(e.stderr.strip()))
+        return None
+
+
+def dissociate_repo(repo_path):
+    """Copy borrowed objects into a repo so it no longer needs them.
+
+    Does what `git clone --dissociate` does after cloning: repacks
+    every object the repo uses (including ones from the repos listed
+    in its alternates file) into its own object store, then removes
+    the alternates file. If the repo is not complete without it
+    (according to git fsck), the file is put back.
+
+    Returns:
+        bool: True if ok (or nothing was borrowed), otherwise None
+            (error is shown).
+    """
+    return run_sync(dissociate_repo_async(repo_path))
+
+
+async def dissociate_repo_async(repo_path):
+    """See dissociate_repo."""
+    if not repo_path:
+        raise ValueError(
+            "Expected str got {} for repo_path"
+            .format(emit_cast(repo_path)))
+    path = alternates_path(repo_path)
+    if not os.path.isfile(path):
+        return True
+    missing = [objects_dir for objects_dir in read_alternates(repo_path)
+               if not os.path.isdir(objects_dir)]
+    if missing:
+        print("Error: {} borrows objects from missing {}"
+              .format(repr(repo_path), missing))
+        return None
+    backup_path = path + ".dissociating"
+    try:
+        await run_git(["git", "-C", repo_path, "repack", "-a", "-d"])
+        os.replace(path, backup_path)
+        await run_git(["git", "-C", repo_path, "fsck", "--connectivity-only",
+                       "--no-dangling"])
+    except subprocess.CalledProcessError as e:
+        print("CalledProcessError: {}".format(e.stderr.strip()))
+        if os.path.isfile(backup_path):
+            os.replace(backup_path, path)
+        return None
+    os.remove(backup_path)
+    return True
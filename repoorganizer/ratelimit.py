@@ -0,0 +1,290 @@
+"""Pace API requests to stay within GitHub's rate limits.
+
+Each response reports the quota of the token it was sent with
+(X-RateLimit-Limit, -Remaining, -Used, -Reset and -Resource). The
+RateLimiter keeps the latest values for each token and resource (such
+as "core" or "search"). Once less than PACE_FRACTION of the quota is
+left, requests are spread out evenly until the reset time instead of
+using it up early. When it is used up, requests wait for the reset.
+See <https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api>
+"""  # noqa: E501
+from __future__ import print_function
+import hashlib
+import threading
+import time
+
+PACE_FRACTION = 0.2  # start pacing when less than this much is left
+BACKOFF_SECONDS = 60  # first wait for a secondary limit without hints
+MAX_RETRIES = 5
+MAX_WAIT = 3700  # seconds (the primary limit resets every hour)
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def _int_header(headers, name):
+    if headers is None:
+        return None
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def token_label(headers):
+    """Identify the token in request headers without revealing it.
+
+    Returns:
+        str: Such as "token 1a2b3c4d" (start of its SHA-256), or
+            "anonymous".
+    """
+    auth = (headers or {}).get("Authorization")
+    if not auth:
+        return "anonymous"
+    return "token {}".format(
+        hashlib.sha256(auth.encode("utf-8")).hexdigest()[:8])
+
+
+def url_resource(url):
+    """Guess which rate limit resource a request URL counts against."""
+    if "/search/" in url:
+        return "search"
+    if url.rstrip("/").endswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+class QuotaExhausted(RuntimeError):
+    """The API quota is used up for longer than a RateLimiter may wait.
+
+    Args:
+        key (tuple(str, str)): Token label and resource.
+        delay (float): Seconds until the quota resets.
+    """
+
+    def __init__(self, key, delay):
+        RuntimeError.__init__(
+            self, "API quota for {} {} is used up for {:.0f}s"
+            .format(key[0], key[1], delay))
+        self.key = key
+        self.delay = delay
+
+
+class _Quota(object):
+    """Rate limit state of one token and resource."""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.next_at = 0.0  # earliest time for the next request
+        self.requests = 0
+        self.waited = 0.0
+        self.retries = 0
+        self.used = 0  # counted against the quota during this run
+        self._window = None  # reset time of the window being counted
+        self._window_used = None
+
+
+class RateLimiter(object):
+    """Track remaining quota per token and pace or delay requests.
+
+    Args:
+        clock (Callable, optional): Get the time (seconds since the
+            epoch), like time.time (the X-RateLimit-Reset format).
+        sleep (Callable, optional): Wait some seconds, like time.sleep.
+        backoff (float, optional): First wait for a secondary limit
+            with no Retry-After header (doubled each retry).
+        max_retries (int, optional): Retries for a rate limited request.
+        max_wait (float, optional): Longest wait before a request or a
+            retry. A longer one raises QuotaExhausted (or the error of
+            the request) instead.
+    """
+
+    def __init__(self, clock=time.time, sleep=time.sleep,
+                 backoff=BACKOFF_SECONDS, max_retries=MAX_RETRIES,
+                 max_wait=MAX_WAIT):
+        self.clock = clock
+        self.sleep = sleep
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._quotas = {}  # (token label, resource) to _Quota
+
+    def _quota(self, key):
+        quota = self._quotas.get(key)
+        if quota is None:
+            quota = _Quota()
+            self._quotas[key] = quota
+        return quota
+
+    def delay_for(self, key):
+        """Reserve the next request for key and get how long to wait.
+
+        Args:
+            key (tuple(str, str)): Token label and resource.
+
+        Returns:
+            float: Seconds to wait before sending the request.
+        """
+        with self._lock:
+            quota = self._quota(key)
+            quota.requests += 1
+            now = self.clock()
+            if quota.remaining is None or quota.reset is None \
+                    or quota.reset <= now:
+                return 0.0
+            left = quota.reset - now
+            if quota.remaining <= 0:
+                delay = left + 1
+                quota.next_at = now + delay
+            elif quota.limit and quota.remaining < quota.limit * PACE_FRACTION:
+                # Spread the rest of the quota over the rest of the window.
+                start = max(now, quota.next_at)
+                quota.next_at = start + left / quota.remaining
+                delay = start - now
+            else:
+                delay = 0.0
+            # Count the request now so that concurrent requests pace too.
+            quota.remaining -= 1
+            quota.waited += delay
+            return delay
+
+    def wait(self, key):
+        delay = self.delay_for(key)
+        if delay > 0:
+            if delay > self.max_wait:
+                raise QuotaExhausted(key, delay)
+            print("Waiting {:.1f}s for API quota ({} {})"
+                  .format(delay, key[0], key[1]))
+            self.sleep(delay)
+
+    def update(self, key, headers, counted=True):
+        """Store the quota reported by a response.
+
+        Args:
+            key (tuple(str, str)): Token label and the resource guessed
+                from the URL (X-RateLimit-Resource replaces it).
+            headers: Response headers (any object with get).
+            counted (bool, optional): False for "304 Not Modified" (which
+                does not count against the quota).
+
+        Returns:
+            tuple(str, str): The key the quota was stored under.
+        """
+        limit = _int_header(headers, "X-RateLimit-Limit")
+        remaining = _int_header(headers, "X-RateLimit-Remaining")
+        reset = _int_header(headers, "X-RateLimit-Reset")
+        used = _int_header(headers, "X-RateLimit-Used")
+        resource = headers.get("X-RateLimit-Resource") if headers else None
+        if resource and resource != key[1]:
+            with self._lock:
+                guessed = self._quota(key)
+                guessed.requests -= 1
+                key = (key[0], resource)
+                self._quota(key).requests += 1
+        if remaining is None:
+            return key
+        if used is None and limit is not None:
+            used = limit - remaining
+        with self._lock:
+            quota = self._quota(key)
+            quota.limit = limit
+            quota.remaining = remaining
+            quota.reset = reset
+            if used is not None:
+                if quota._window != reset:
+                    # First response of a window (or of the run).
+                    quota._window = reset
+                    quota._window_used = used - (1 if counted else 0)
+                if used > quota._window_used:
+                    quota.used += used - quota._window_used
+                    quota._window_used = used
+        return key
+
+    def retry_delay(self, key, status, headers, attempt, text=""):
+        """Get how long to wait before retrying a failed request.
+
+        Handles the primary limit (403 or 429 with no quota left) and
+        secondary limits (429, or 403 with Retry-After or a message
+        about a secondary rate limit).
+
+        Returns:
+            float: Seconds to wait, or None if the request should not
+                be retried (not rate limited, or too many retries).
+        """
+        if status not in (403, 429) or attempt >= self.max_retries:
+            return None
+        retry_after = _int_header(headers, "Retry-After")
+        remaining = _int_header(headers, "X-RateLimit-Remaining")
+        reset = _int_header(headers, "X-RateLimit-Reset")
+        if retry_after is not None:
+            delay = retry_after
+        elif remaining == 0 and reset is not None:
+            delay = max(0, reset - self.clock()) + 1
+        elif status == 429 or "rate limit" in (text or "").lower():
+            delay = self.backoff * (2 ** attempt)
+        else:
+            return None  # such as a token without permission
+        with self._lock:
+            quota = self._quota(key)
+            quota.retries += 1
+            quota.waited += delay
+        return delay
+
+    def report(self):
+        """Get the quota of each token and resource used in this run.
+
+        Returns:
+            list[dict]: Sorted by token and resource, with 'token',
+                'resource', 'requests', 'used' (counted against the
+                quota), 'limit', 'remaining', 'reset' (epoch seconds),
+                'waited' (seconds) and 'retries'.
+        """
+        with self._lock:
+            return [
+                {
+                    'token': key[0],
+                    'resource': key[1],
+                    'requests': quota.requests,
+                    'used': quota.used,
+                    'limit': quota.limit,
+                    'remaining': quota.remaining,
+                    'reset': quota.reset,
+                    'waited': quota.waited,
+                    'retries': quota.retries,
+                }
+                for key, quota in sorted(self._quotas.items())
+                if quota.requests
+            ]
+
+    def echo_report(self):
+        rows = self.report()
+        if not rows:
+            return
+        print("API quota used:")
+        for row in rows:
+            line = "- {} {}: {} request(s), {} counted".format(
+                row['token'], row['resource'], row['requests'], row['used'])
+            if row['remaining'] is not None:
+                line += ", {}/{} left".format(row['remaining'], row['limit'])
+            if row['reset']:
+                line += " until {}".format(time.strftime(
+                    "%H:%M:%S", time.localtime(row['reset'])))
+            if row['retries'] or row['waited']:
+                line += ", {} retries, waited {:.0f}s".format(
+                    row['retries'], row['waited'])
+            print(line)
+
+
+def default_limiter():
+    """Get the RateLimiter shared by every collection in this process."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
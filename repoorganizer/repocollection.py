@@ -1,15 +1,75 @@
 from __future__ import print_function
 import os
 import shlex
+import shutil
 import subprocess
 import sys
 import json
+import threading
+import time
 
 from repoorganizer.moregitcli import (
-    current_branch,
+    dissociate_repo,
+    forget_repo_state,
+    is_bare_repo,
+    is_partial_repo,
+    is_shallow_repo,
     list_remote_branches,
+    object_store_bytes,
+    protect_shared_objects,
     switch_branch,
     pull_repo,
+    read_alternates,
+    read_repo_state,
+    update_branches,
+)
+from repoorganizer.clonepolicy import (
+    ClonePolicies,
+    clone_args,
+    fetch_args,
+)
+from repoorganizer.githubapi import (
+    DEFAULT_API_URL,
+    GraphQLError,
+    PER_PAGE,
+    PageCache,
+    fetch_json,
+    fetch_page,
+    graphql_url,
+    is_full_name,
+    iso_time,
+    list_repos_graphql,
+    page_number,
+    search_repos,
+    search_repos_url,
+    set_query,
+)
+from repoorganizer.listing import (
+    ListingStore,
+    RepoRecord,
+    compact_item,
+    read_items,
+    write_if_changed,
+)
+from repoorganizer.ratelimit import QuotaExhausted
+from repoorganizer.repoindex import RepoIndex
+from repoorganizer.syncplan import (
+    echo_plan,
+    plan_repos,
+)
+from repoorganizer.syncpool import (
+    run_pool,
+    url_host,
+)
+from repoorganizer.tracing import (
+    git_subcommand,
+    repo_span,
+    span,
+)
+from repoorganizer.workorder import (
+    echo_critical_path,
+    estimate_seconds,
+    longest_first,
 )
 
 
@@ -48,12 +108,70 @@ from repoorganizer import (  # noqa: E402
 
 logger = getLogger(__name__)
 
+BRANCH_MODES = ("refs", "switch")
+METADATA_MODES = ("repo", "owner")
+LISTING_BACKENDS = ("rest", "graphql")
+DISCOVERY_MODES = ("full", "incremental")
+FULL_LISTING_DAYS = 7  # how often incremental discovery lists everything
+# Search from this long before the last listing, since GitHub's search
+#   index may lag behind pushes (and clocks may differ).
+DISCOVERY_OVERLAP = 3600
+
+_repo_locks = {}  # repo directory to threading.Lock (see repo_lock)
+_repo_locks_lock = threading.Lock()
+
+
+def repo_lock(path):
+    """Get the lock held while a repo directory is being synced.
+
+    A webhook can sync a repo while a full run is also syncing it (see
+    daemon.SyncDaemon), so two git commands could otherwise update the
+    same repo at once.
+    """
+    path = os.path.realpath(path)
+    with _repo_locks_lock:
+        lock = _repo_locks.get(path)
+        if lock is None:
+            lock = threading.Lock()
+            _repo_locks[path] = lock
+        return lock
+
+
+def fetch_refspecs(refs, bare=False):
+    """Get the refspecs that fetch only some refs from origin.
+
+    Args:
+        refs (Iterable[str]): Full ref names, such as "refs/heads/main"
+            or "refs/tags/v1.0".
+        bare (bool, optional): Whether the repo is a mirror, where
+            branches are fetched to refs/heads/ instead of
+            refs/remotes/origin/.
+
+    Returns:
+        list[str]: Forced refspecs (a push may rewrite a branch, and
+            update_branches still refuses to lose local commits), or
+            None if a ref isn't a branch or tag (so fetch everything).
+    """
+    refspecs = []
+    for ref in refs:
+        if ref.startswith("refs/heads/") and not bare:
+            dst = "refs/remotes/origin/" + ref[len("refs/heads/"):]
+        elif ref.startswith("refs/heads/") or ref.startswith("refs/tags/"):
+            dst = ref
+        else:
+            return None
+        refspecs.append("+{}:{}".format(ref, dst))
+    return refspecs
+
 
 class RepoCollection:
     """Handles operations related to GitHub repositories."""
 
     site = "github"
     user = None  # cannot use self.name for this if is_org!
+    api_url = DEFAULT_API_URL  # set to a local stand-in server to test
+    api_jobs = 4  # pages of a listing to download at once
+    cache_root = None  # None for config_dir/cache
 
     def __init__(self):
         self.repos = None
@@ -64,6 +182,22 @@ class RepoCollection:
         self.expected_res_type = list
         self.full_response = None
         self.sites_dir = None
+        self.branch_mode = "refs"
+        self.force = False
+        self.mirror = False
+        self.clone_policies = ClonePolicies()
+        self.index = None
+        self.plans = {}
+        self.listing_store = None  # full listing pages (see _load_repos)
+        self.listing_path = None  # repos.json (see _load_repos)
+        self.metadata = "repo"
+        self.listing = "rest"  # see LISTING_BACKENDS
+        self.discovery = "full"  # see DISCOVERY_MODES
+        self.full_listing_days = FULL_LISTING_DAYS
+        self.forks = True
+        self.share_forks = True
+        self.estimates = {}  # position in repos to seconds (sync_batches)
+        self.journal = None  # RunJournal (see prepare_sync)
 
     def set_name(self, name, is_org, token=None):
         """Set the name and type of the collection."""
@@ -76,11 +210,16 @@ class RepoCollection:
 
     @classmethod
     def cache_dir(cls):
-        return os.path.join(config_dir, "cache", cls.site)
+        cache_root = cls.cache_root or os.path.join(config_dir, "cache")
+        return os.path.join(cache_root, cls.site)
+
+    @classmethod
+    def index_path(cls):
+        return os.path.join(cls.cache_dir(), "index.sqlite3")
 
     def backup_dir(self):
         if self.sites_dir:
-            os.path.join(self.sites_dir, self.site)
+            return os.path.join(self.sites_dir, self.site)
         return os.path.join(backup_dir, self.site)
 
     def _get_headers(self):
@@ -107,17 +246,192 @@ class RepoCollection:
         if not self.token:
             logger.error(
                 "User not set, so auth token is not tested in this case!")
-            url = "https://api.github.com/{}/{}/repos".format(
-                "orgs" if self.is_org else "users", self.name
+            url = "{}/{}/{}/repos?per_page={}".format(
+                self.api_url, "orgs" if self.is_org else "users", self.name,
+                PER_PAGE,
             )
             return url
 
         if self.is_org:  # and not RepoCollection.user:
-            return "https://api.github.com/orgs/{}/repos".format(self.name)
+            return "{}/orgs/{}/repos?per_page={}".format(
+                self.api_url, self.name, PER_PAGE)
         self.expected_res_type = dict
-        return "https://api.github.com/search/repositories?q=user:{}".format(
-            RepoCollection.user
-        )
+        # NOTE: The search API only returns the first 1000 results.
+        # Forks are left out unless fork:true (as in _download_changes,
+        #   so both list the same repos).
+        return search_repos_url(self.api_url,
+                                ["user:" + self.name, "fork:true"])
+
+    def _download_pages(self, url, cache=None, revalidate=True, store=None):
+        """Download every page of the listing at url.
+
+        The first page is downloaded alone, since its Link header is the
+        only way to know how many pages there are. Then the remaining
+        pages are downloaded at once (up to self.api_jobs at a time).
+        Each page is reduced to RepoRecord objects as soon as it
+        arrives, so the full items of all pages are never in memory at
+        once.
+
+        Args:
+            url (str): URL of the first page.
+            cache (PageCache, optional): Send conditional requests and
+                reuse each page that was not modified.
+            revalidate (bool, optional): False to download every page
+                even if cached (new validators are still stored).
+            store (ListingStore, optional): Where to save the full items
+                of each page (a page that was not modified is only saved
+                if its file is missing).
+
+        Returns:
+            tuple(list[RepoRecord], list[int]): The repos from all pages
+                in page order, and the page numbers.
+        """
+        headers = self._get_headers()
+
+        def _fetch(page_url):
+            entry, cached = fetch_page(page_url, headers=headers,
+                                       cache=cache, revalidate=revalidate)
+            page = page_number(page_url) or 1
+            if store is not None and (not cached or not store.has_page(page)):
+                store.save_page(page, entry['items'])
+            records = [RepoRecord.from_item(item, page=page)
+                       for item in entry['items']]
+            return records, entry.get('links') or {}, cached
+
+        records, links, cached = _fetch(url)
+        not_modified = 1 if cached else 0
+        repos = records
+        numbers = [1]
+        last = None
+        if links.get('last'):
+            last = page_number(links['last'])
+        if last:
+            page_urls = [set_query(url, page=page)
+                         for page in range(2, last + 1)]
+            print("Listing {} more page(s) of {}"
+                  .format(len(page_urls), url))
+            pages = run_pool(page_urls, _fetch, jobs=self.api_jobs)
+            for page_url, page in zip(page_urls, pages):
+                if isinstance(page, Exception):
+                    logger.error("Failed to fetch {}".format(page_url))
+                    raise page
+                records, _, cached = page
+                if cached:
+                    not_modified += 1
+                repos.extend(records)
+            numbers.extend(range(2, last + 1))
+        else:
+            while links.get('next'):
+                # No "last" link, so only sequential paging is possible.
+                numbers.append(page_number(links['next']))
+                records, links, cached = _fetch(links['next'])
+                if cached:
+                    not_modified += 1
+                repos.extend(records)
+        page = numbers[-1]
+        while not_modified and len(records) >= PER_PAGE:
+            # The cached Link header of an unmodified page may predate
+            #   new pages being added at the end (even a first page that
+            #   had no links since it was the only one).
+            page += 1
+            records, _, cached = _fetch(set_query(url, page=page))
+            if not records:
+                break
+            if cached:
+                not_modified += 1
+            repos.extend(records)
+            numbers.append(page)
+        if not_modified:
+            logger.info("{} page(s) of {} not modified since last run"
+                        .format(not_modified, url))
+        return repos, numbers
+
+    def _download_graphql(self, url, store=None):
+        """Download the listing, with every branch head of each repo,
+        using the GraphQL API (see list_repos_graphql).
+
+        With the heads, repos whose branches did not move can be skipped
+        without running git ls-remote or fetch (see prepare_sync).
+
+        Args:
+            url (str): GraphQL endpoint.
+            store (ListingStore, optional): Where to save each page.
+
+        Returns:
+            tuple(list[RepoRecord], list[int]): Same as _download_pages.
+        """
+        headers = self._get_headers()
+        repos = []
+        numbers = []
+        pages = list_repos_graphql(url, self.name, headers=headers)
+        for page, items in enumerate(pages, 1):
+            if store is not None:
+                store.save_page(page, items)
+            repos.extend(RepoRecord.from_item(item, page=page)
+                         for item in items)
+            numbers.append(page)
+        return repos, numbers
+
+    def _download_changes(self, since, store):
+        """Update the saved listing with repos pushed since a time.
+
+        Only repos found by a search for pushed:>since are downloaded,
+        then merged into the pages in store (see ListingStore.merge).
+        Deleted or renamed repos are only noticed by a full listing.
+
+        Args:
+            since (float): Time (seconds since the epoch).
+            store (ListingStore): Pages of the last full listing.
+
+        Returns:
+            tuple(list[RepoRecord], list[int]): Same as _download_pages,
+                or None if the search couldn't return every changed repo
+                (so a full listing is needed).
+        """
+        qualifiers = [
+            "{}:{}".format("org" if self.is_org else "user", self.name),
+            "fork:true",  # otherwise forks are left out
+            "pushed:>{}".format(iso_time(since)),
+        ]
+        url = search_repos_url(self.api_url, qualifiers)
+        if url not in self.json_urls:
+            self.json_urls.append(url)
+        print("Listing repos pushed since {} using {}"
+              .format(iso_time(since), url))
+        items = search_repos(url, headers=self._get_headers())
+        if items is None:
+            logger.warning("Too many repos of {} were pushed since {} to"
+                           " search for, so all will be listed."
+                           .format(self.name, iso_time(since)))
+            return None
+        logger.info("{} repo(s) of {} pushed since {}"
+                    .format(len(items), self.name, iso_time(since)))
+        return store.merge(items)
+
+    def _discovery_since(self, state, store, repos_cache_path):
+        """Get the time to search for changes since (see
+        _download_changes), or None if a full listing is due.
+
+        Args:
+            state (dict): Loaded discovery.json (see _load_repos), from
+                a listing with the same backend as store.
+            store (ListingStore): Pages of the last listing.
+            repos_cache_path (str): repos.json of the last listing.
+        """
+        if self.discovery != "incremental":
+            return None
+        listed_at = state.get('listed_at')
+        full_at = state.get('full_at')
+        if not listed_at or not full_at:
+            return None
+        if time.time() - full_at >= self.full_listing_days * 86400:
+            print("Listing all repos of {} since the last full listing was"
+                  " {:.1f} day(s) ago".format(
+                      self.name, (time.time() - full_at) / 86400.0))
+            return None
+        if not store.pages() or not os.path.isfile(repos_cache_path):
+            return None
+        return listed_at - DISCOVERY_OVERLAP
 
     def get_token_msg(self):
         token_msg = self.token
@@ -126,57 +440,99 @@ class RepoCollection:
         return token_msg
 
     def _load_repos(self, refresh=False):
-        """Load the repositories for the given GitHub organization or user."""
-        repos_cache_path = os.path.join(
-            RepoCollection.cache_dir(), self.name, "repos.json"
-        )
-        downloaded = False
-        url = self._get_url()
-        if url not in self.json_urls:
-            self.json_urls.append(url)
-        print("Listing repos using {}".format(url))
-
-        if not refresh:
-            if os.path.exists(repos_cache_path):
-                with open(repos_cache_path, "r") as stream:
-                    self.repos = json.load(stream)
-                logger.info("Loaded repos from cache: %s", repos_cache_path)
-                if not self.repos:
-                    logger.warning(
-                        "Got {} from {}".format(self.repos, repos_cache_path))
-                    self.repos = None  # fall through to download
-                    os.remove(repos_cache_path)
-                else:
-                    return
+        """Load the repositories for the given GitHub organization or user.
+
+        Each page of the listing is requested conditionally (using the
+        ETag or Last-Modified from the last run), so unchanged pages are
+        reused from the cache without counting against the rate limit.
+        The previous repos.json is only used as-is if the API can't be
+        reached or its quota won't reset soon enough (QuotaExhausted).
 
-            logger.warning(
-                "No %s, so downloading from %s"
-                % (repos_cache_path, url))
+        If self.listing is "graphql" (and there is a token), the GraphQL
+        API is used instead (see _download_graphql), falling back to the
+        REST API if the query fails (GraphQLError).
+
+        If self.discovery is "incremental", only repos pushed since the
+        last listing are downloaded and merged into it (see
+        _download_changes), except every self.full_listing_days days
+        (to notice deleted and renamed repos). The time of each listing
+        is saved in discovery.json.
+
+        Args:
+            refresh (bool, optional): Download every page even if the
+                server reports it as not modified.
+        """
+        collection_cache_dir = os.path.join(RepoCollection.cache_dir(),
+                                            self.name)
+        repos_cache_path = os.path.join(collection_cache_dir, "repos.json")
+        downloaded = False
+        use_graphql = self.listing == "graphql"
+        if use_graphql and not self.token:
+            logger.warning("The GraphQL API requires a token, so {} will be"
+                           " listed using the REST API.".format(self.name))
+            use_graphql = False
+        if use_graphql:
+            url = graphql_url(self.api_url)
+            pages_dir = os.path.join(collection_cache_dir, "graphql-pages")
+        else:
+            url = self._get_url()
+            pages_dir = os.path.join(collection_cache_dir, "pages")
+        cache = PageCache(os.path.join(collection_cache_dir, "pages.json"),
+                          compact=compact_item)
+        store = ListingStore(pages_dir)
+        self.listing_store = store
+        self.listing_path = repos_cache_path
+        state_path = os.path.join(collection_cache_dir, "discovery.json")
+        state = {}
+        if os.path.isfile(state_path):
+            with open(state_path, "r") as stream:
+                state = json.load(stream)
+        backend = "graphql" if use_graphql else "rest"
+        since = None
+        if not refresh and state.get('listing') == backend:
+            since = self._discovery_since(state, store, repos_cache_path)
+        started = time.time()
 
         try:
-            # response = request.urlopen(url)
-            # self.repos = json.loads(response.read())
-            request_obj = request.Request(url, headers=self._get_headers())
-            response = request.urlopen(request_obj)
-            self.full_response = json.loads(response.read().decode())
-            if isinstance(self.full_response, dict):
-                # Example:
-                # {
-                #   "total_count": 31,
-                #   "incomplete_results": false,
-                #   "items": [
-                self.repos = self.full_response.get('items')
-                if self.repos is None:
-                    raise ValueError("Expected 'items' field, got only {}"
-                                     .format([x for x in self.full_response]))
-            else:
-                self.repos = self.full_response  # must be a list already
-                if self.expected_res_type is dict:
-                    logger.warning(
-                        "Got {} but expected dict"
-                        .format(type(self.full_response)))
-            # with request.urlopen(req) as response:
-            #     self.repos = json.loads(response.read().decode())
+            with span("list " + self.name, cat="phase", url=url) as args:
+                result = None
+                if since is not None:
+                    try:
+                        result = self._download_changes(since, store)
+                    except HTTPError as e:
+                        logger.warning(
+                            "Searching for changed repos failed ({}: {}),"
+                            " so all will be listed."
+                            .format(e.code, e.reason))
+                        e.close()
+                if result is not None:
+                    self.repos, pages = result
+                    args['since'] = iso_time(since)
+                else:
+                    if url not in self.json_urls:
+                        self.json_urls.append(url)
+                    print("Listing repos using {}".format(url))
+                    if use_graphql:
+                        try:
+                            self.repos, pages = self._download_graphql(
+                                url, store=store)
+                        except GraphQLError as e:
+                            logger.warning(
+                                "The GraphQL API could not list {} ({}),"
+                                " so the REST API will be used."
+                                .format(self.name, e))
+                            use_graphql = False
+                            backend = "rest"
+                            url = self._get_url()
+                            store = ListingStore(os.path.join(
+                                collection_cache_dir, "pages"))
+                            self.listing_store = store
+                            args['fallback'] = backend
+                    if not use_graphql:
+                        self.repos, pages = self._download_pages(
+                            url, cache=cache, revalidate=not refresh,
+                            store=store)
+                args['repos'] = len(self.repos or [])
             downloaded = True
         except HTTPError as e:
             logger.error("Failed to fetch repositories from %s" % url)
@@ -184,19 +540,36 @@ class RepoCollection:
             print("HTTPError: {} - {}".format(e.code, error_message))
             logger.error("self.token = {}".format(self.get_token_msg()))
             raise
-        except URLError as e:
+        except (URLError, QuotaExhausted) as e:
+            # Waiting for the quota to reset would hold up the run, so
+            #   it is handled like an unreachable API.
             logger.error("Failed to fetch repositories from %s" % url)
-            print("URLError: {}".format(e.reason))
+            if isinstance(e, QuotaExhausted):
+                print("QuotaExhausted: {}".format(e))
+            else:
+                print("URLError: {}".format(e.reason))
             # logger.error("Failed to fetch repositories: %s" % e)
             logger.error("self.token = {}".format(self.get_token_msg()))
-            raise
+            if refresh or not os.path.exists(repos_cache_path):
+                raise
+            self.repos = [RepoRecord.from_item(item)
+                          for item in read_items(repos_cache_path)]
+            logger.warning("Using possibly outdated repos from cache: %s"
+                           % repos_cache_path)
         # Cache the results if downloaded
         if downloaded:
             if self.repos:
-                os.makedirs(os.path.dirname(repos_cache_path), exist_ok=True)
-                with open(repos_cache_path, "w") as stream:
-                    json.dump(self.repos, stream, indent=2)
-                logger.info("Cached repos to %s" % repos_cache_path)
+                os.makedirs(collection_cache_dir, exist_ok=True)
+                if store.write_listing(repos_cache_path, pages):
+                    logger.info("Cached repos to %s" % repos_cache_path)
+                cache.save()
+                state = {
+                    'listed_at': started,
+                    'full_at': (state.get('full_at') if result is not None
+                                else started),
+                    'listing': backend,
+                }
+                write_if_changed(state_path, [json.dumps(state)])
             else:
                 logger.warning("Got {} from {}".format(self.repos, url))
         if self.repos is None:
@@ -205,81 +578,733 @@ class RepoCollection:
                 " downloaded, or raised a more exception first.")
         return
 
-    def clone_repos(self, refresh=False, forks=True, destination=None):
+    def clone_repos(self, refresh=False, forks=True, destination=None,
+                    jobs=1, jobs_per_host=None, branch_mode="refs",
+                    force=False, precheck=False, mirror=False,
+                    clone_policies=None, index=None, metadata="repo",
+                    listing="rest", discovery="full",
+                    full_listing_days=FULL_LISTING_DAYS, share_forks=True,
+                    journal=None):
         """Clone all repos in the collection.
 
         Args:
-            refresh (bool, optional): Download metadata again. Advisable
-                if token was changed or added since last run, or if new
-                repos were added! Defaults to False.
+            refresh (bool, optional): Download metadata again even if
+                the server reports it as not modified since the last
+                run. Defaults to False.
             forks (bool, optional): Include repos which are forks.
                 Defaults to True.
             destination (str, optional): Parent for site dir
                 (RepoCollection.site) which will be added under it.
                 Defaults to backup_dir or last used destination
                 (sets self.sites_dir).
+            jobs (int, optional): Number of repos to sync at once.
+                Defaults to 1 (one at a time, output shown live).
+            jobs_per_host (int, optional): Maximum number of repos to
+                sync at once from the same host. None for no limit
+                other than jobs.
+            branch_mode (str, optional): How to update branches other
+                than the one checked out:
+                - "refs" (default): Fetch once then fast-forward each
+                  local branch by moving its ref (no checkout). Diverged
+                  or local-only branches are reported, not forced.
+                - "switch": Switch to each branch and pull it, then
+                  switch back (slow, rewrites the working tree).
+            force (bool, optional): Sync every repo, even if its
+                pushed_at in the listing is the same as it was at the
+                last successful sync (see RepoIndex).
+            precheck (bool, optional): Before syncing, compare each
+                remote's branch heads (git ls-remote) with the ones last
+                fetched, and only sync repos where a branch was changed,
+                added or deleted. The plan is shown first. Only repos
+                not already skipped by pushed_at are checked (none if
+                force).
+            mirror (bool, optional): Store each repo as a bare mirror
+                ({name}.git, cloned with --mirror) and update it with
+                one `git remote update --prune` instead of keeping a
+                working tree (branch_mode does not apply).
+            clone_policies (ClonePolicies, optional): Which repos to
+                clone as blobless, treeless or shallow (see
+                ClonePolicies). Defaults to full clones.
+            index (RepoIndex, optional): Where to look up and record the
+                result of each sync (may be shared by collections).
+                Defaults to self.index, or else to index_path().
+            metadata (str, optional): Where to save each repo's listing
+                entry:
+                - "repo" (default): {owner}/{name}.json beside each
+                  synced repo.
+                - "owner": One {owner}.json beside each owner's
+                  directory with every repo in the listing (keyed by
+                  full name), instead of a file per repo.
+                Either way a file is only replaced if its content
+                changed.
+            listing (str, optional): How to list repos:
+                - "rest" (default): Paginated REST API listing.
+                - "graphql": GraphQL API, which also gets the head of
+                  every branch, so only repos where a branch moved are
+                  synced (as if precheck, but without ls-remote).
+                  Requires a token (otherwise "rest" is used).
+            discovery (str, optional): Which repos to list:
+                - "full" (default): Every repo, every run.
+                - "incremental": Only repos pushed since the last run
+                  (using the search API), merged into the last listing.
+                  Deleted or renamed repos are only noticed by a full
+                  listing, which is still done if the last one was
+                  full_listing_days ago (or if refresh).
+            full_listing_days (float, optional): See discovery.
+            share_forks (bool, optional): Clone a fork with --reference
+                to its parent's local copy (if the parent is already
+                backed up, and isn't shallow or partial), so objects
+                they have in common are stored once and not downloaded
+                again. The parent is then set to never prune
+                unreachable objects (see protect_shared_objects). If
+                False, forks are cloned in full, and forks cloned with
+                --reference before are made independent of the parent
+                (see dissociate_repo) so the parent can be removed.
+            journal (RunJournal, optional): Where to record the phase of
+                each repo as it goes. If it resumes an interrupted run,
+                repos that run finished are skipped (even if force),
+                and a clone it left unfinished is removed and retried.
+
+        Returns:
+            list[dict]: Summary of each repo (see sync_repo) in listing
+                order.
+        """
+        self.prepare_sync(
+            refresh=refresh, forks=forks, destination=destination,
+            jobs=jobs, jobs_per_host=jobs_per_host, branch_mode=branch_mode,
+            force=force, precheck=precheck, mirror=mirror,
+            clone_policies=clone_policies, index=index, metadata=metadata,
+            listing=listing, discovery=discovery,
+            full_listing_days=full_listing_days, share_forks=share_forks,
+            journal=journal)
+        quiet = bool(jobs and jobs > 1)
+        summaries = [None] * len(self.repos)
+        with span("sync " + self.name, cat="phase", repos=len(self.repos)):
+            for batch in self.sync_batches():
+                results = run_pool(
+                    [self.repos[position] for position in batch],
+                    lambda repo: self._sync_if_changed(repo, quiet=quiet),
+                    jobs=jobs,
+                    per_host=jobs_per_host,
+                    host_of=lambda repo: url_host(repo.get('ssh_url')),
+                    on_error=self.error_summary,
+                )
+                for position, summary in zip(batch, results):
+                    summaries[position] = summary
+        if quiet:
+            echo_critical_path(summaries, jobs)
+        self.finish_sync(summaries)
+        return summaries
+
+    def configure(self, forks=True, destination=None, branch_mode="refs",
+                  force=False, mirror=False, clone_policies=None,
+                  index=None, metadata="repo", listing="rest",
+                  discovery="full", full_listing_days=FULL_LISTING_DAYS,
+                  share_forks=True, journal=None):
+        """Set the options of later syncs (see clone_repos for arguments).
+
+        Nothing is listed or synced, so this is enough before syncing a
+        single repo with _sync_if_changed (see daemon.SyncDaemon).
         """
         if destination:
-            self.sites_dir = backup_dir  # affect result of self.backup_dir
+            self.sites_dir = destination  # affect result of self.backup_dir
+        if branch_mode not in BRANCH_MODES:
+            raise ValueError("Expected one of {} for branch_mode, got {}"
+                             .format(BRANCH_MODES, repr(branch_mode)))
+        if metadata not in METADATA_MODES:
+            raise ValueError("Expected one of {} for metadata, got {}"
+                             .format(METADATA_MODES, repr(metadata)))
+        if listing not in LISTING_BACKENDS:
+            raise ValueError("Expected one of {} for listing, got {}"
+                             .format(LISTING_BACKENDS, repr(listing)))
+        if discovery not in DISCOVERY_MODES:
+            raise ValueError("Expected one of {} for discovery, got {}"
+                             .format(DISCOVERY_MODES, repr(discovery)))
+        self.listing = listing
+        self.discovery = discovery
+        self.full_listing_days = full_listing_days
+        self.forks = forks
+        self.share_forks = share_forks
+        self.journal = journal
+        self.branch_mode = branch_mode
+        self.mirror = mirror
+        self.metadata = metadata
+        if clone_policies is not None:
+            self.clone_policies = clone_policies
+        self.force = force
+        if index is not None:
+            self.index = index
+        elif self.index is None:
+            self.index = RepoIndex(RepoCollection.index_path())
+
+    def prepare_sync(self, refresh=False, forks=True, destination=None,
+                     jobs=1, jobs_per_host=None, branch_mode="refs",
+                     force=False, precheck=False, mirror=False,
+                     clone_policies=None, index=None, metadata="repo",
+                     listing="rest", discovery="full",
+                     full_listing_days=FULL_LISTING_DAYS, share_forks=True,
+                     journal=None):
+        """Set options, load the listing, and precheck if requested.
+
+        This is everything clone_repos does before syncing each repo
+        (see clone_repos for arguments), so that a scheduler can sync
+        the repos of several collections from one queue (see
+        scheduler.sync_collections) then call finish_sync for each.
+        """
+        self.configure(
+            forks=forks, destination=destination, branch_mode=branch_mode,
+            force=force, mirror=mirror, clone_policies=clone_policies,
+            index=index, metadata=metadata, listing=listing,
+            discovery=discovery, full_listing_days=full_listing_days,
+            share_forks=share_forks, journal=journal)
         if self.repos is None or refresh:
             self._load_repos(refresh=refresh)
-        for repo in self.repos:
-            print()
-            default_branch = repo.get("default_branch")
-            # example entries:
-            # "name": "{repo_name}",
-            # "full_name": "{self.name}/{repo_name}",
-            # "fork": true,
-            # "git_url": "git://github.com/{self.name}/{repo_name}.git",
-            # "ssh_url": "git@github.com:{self.name}/{repo_name}.git",
-            # "clone_url": "https://github.com/{self.name}/{repo_name}.git",
-            url = repo['ssh_url']  # necessary for using ssh credentials on CLI
-            dst_dir = os.path.join(self.backup_dir(),
-                                   *repo['full_name'].split("/"))
-            dst_parent = os.path.dirname(dst_dir)
-            popen_kwargs = {}
-            if not os.path.isdir(dst_dir):
-                os.makedirs(dst_dir)
-                cmd_parts = ["git", "clone", url, dst_dir]
+        self.index.update_listing(self.name, self.repos)
+        if not forks:
+            self.repos = [repo for repo in self.repos
+                          if not repo.get('fork')]
+        if self.journal is not None:
+            self.journal.mark_listed(repo['full_name'] for repo in self.repos)
+        self.plans = {}
+        # A GraphQL listing has every branch head, so planning is cheap.
+        have_heads = any(repo.get('heads') is not None
+                         for repo in self.repos)
+        if (precheck or have_heads) and not force:
+            candidates = [
+                repo for repo in self.repos
+                if not self.index.is_unchanged(repo, self.repo_dir(repo))
+            ]
+            with span("precheck " + self.name, cat="phase",
+                      repos=len(candidates)):
+                plans = plan_repos(candidates, self.repo_dir, jobs=jobs,
+                                   per_host=jobs_per_host)
+            echo_plan(plans)
+            self.plans = {plan['full_name']: plan for plan in plans}
+
+    def sync_batches(self):
+        """Split self.repos into batches to sync one after the other.
+
+        Forks that will be cloned (if share_forks) go in the second
+        batch, so that a parent being cloned in the same run is done
+        before its forks can borrow objects from it.
+
+        Each batch is sorted longest first (see estimate_seconds), so
+        huge repos don't start last and hold up the end of the run.
+        Repos that will be skipped count as 0 seconds.
+
+        Returns:
+            tuple(list[int], list[int]): Positions in self.repos.
+        """
+        first = []
+        last = []
+        self.estimates = {}
+        durations = (self.index.recent_durations(self.name)
+                     if self.index else {})
+        for position, repo in enumerate(self.repos):
+            dst_dir = self.repo_dir(repo)
+            cloned = os.path.isdir(dst_dir)
+            plan = self.plans.get(repo['full_name'])
+            resumed = (self.journal is not None
+                       and self.journal.is_done(repo['full_name']))
+            if resumed or not self.force and (
+                    (self.index and self.index.is_unchanged(repo, dst_dir))
+                    or (plan and not plan['needs_sync'])):
+                self.estimates[position] = 0.0
+            else:
+                self.estimates[position] = estimate_seconds(
+                    repo, durations.get(repo['full_name']), cloned=cloned)
+            if self.share_forks and repo.get('fork') and not cloned:
+                last.append(position)
+            else:
+                first.append(position)
+        return (longest_first(first, self.estimates),
+                longest_first(last, self.estimates))
+
+    def finish_sync(self, summaries):
+        """Save owner metadata (if enabled) and show the summaries.
+
+        Args:
+            summaries (list[dict]): Result of each repo in listing order
+                (see sync_repo).
+        """
+        if self.metadata == "owner":
+            self.write_owner_metadata()
+        self.echo_summaries(summaries)
+
+    @staticmethod
+    def error_summary(repo, ex):
+        """Get the summary for a repo whose sync raised ex."""
+        return {
+            'full_name': repo.get('full_name'),
+            'action': None,
+            'ok': False,
+            'errors': ["{}: {}".format(type(ex).__name__, ex)],
+        }
+
+    def write_owner_metadata(self):
+        """Save the listing entries of each owner to {owner}.json.
+
+        Entries are read back from repos.json one at a time (see
+        _load_repos), so the full listing is never in memory. The file
+        is only replaced if its content changed.
+
+        Returns:
+            list[str]: Paths that were written.
+        """
+        written = []
+        if not self.listing_path or not os.path.isfile(self.listing_path):
+            return written
+        owners = sorted(set(repo['full_name'].split("/")[0]
+                            for repo in self.repos))
+        for owner in owners:
+            path = os.path.join(self.backup_dir(), "{}.json".format(owner))
+
+            def _chunks():
+                yield "{"
+                count = 0
+                for item in read_items(self.listing_path):
+                    full_name = item.get('full_name') or ""
+                    if full_name.split("/")[0] != owner:
+                        continue
+                    yield ",\n" if count else "\n"
+                    yield "{}: {}".format(json.dumps(full_name),
+                                          json.dumps(item, sort_keys=True))
+                    count += 1
+                yield "\n}\n"
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if write_if_changed(path, _chunks):
+                print("Saved {}".format(repr(path)))
+                written.append(path)
+        return written
+
+    def repo_dir(self, repo):
+        """Get the local path of a repo from the listing.
+
+        If self.mirror, the path ends with ".git" like other bare repos
+        (so a mirror and a clone with a working tree can't collide).
+        """
+        path = os.path.join(self.backup_dir(), *repo['full_name'].split("/"))
+        if self.mirror:
+            path += ".git"
+        return path
+
+    def lookup_repo(self, full_name):
+        """Get the listing entry of one repo from the API, such as one
+        created since the collection was listed.
+
+        Returns:
+            RepoRecord: Or None if full_name is not a valid name of a
+                repo of this collection, or the request failed.
+        """
+        if not is_full_name(full_name) \
+                or full_name.split("/")[0].lower() != self.name.lower():
+            return None
+        url = "{}/repos/{}".format(self.api_url, full_name)
+        try:
+            data, _ = fetch_json(url, headers=self._get_headers())
+        except (HTTPError, URLError, QuotaExhausted) as ex:
+            logger.warning("Could not get {}: {}".format(full_name, ex))
+            if isinstance(ex, HTTPError):
+                ex.close()
+            return None
+        found = data.get('full_name') if isinstance(data, dict) else None
+        # A renamed or transferred repo redirects to its new name.
+        if not is_full_name(found) \
+                or found.split("/")[0].lower() != self.name.lower():
+            return None
+        return RepoRecord.from_item(data)
+
+    def fork_parent(self, repo):
+        """Get the full name of the repo a fork was forked from.
+
+        A REST listing doesn't say, so the repo itself is requested
+        from the API (only done before cloning a fork).
+
+        Returns:
+            str: Such as "some-org/some-repo", or None if repo is not a
+                fork or the API request failed.
+        """
+        if not repo.get('fork'):
+            return None
+        parent = repo.get('parent')
+        if parent is None:
+            url = "{}/repos/{}".format(self.api_url, repo['full_name'])
+            try:
+                data, _ = fetch_json(url, headers=self._get_headers())
+            except (HTTPError, URLError, QuotaExhausted) as ex:
+                logger.warning("Could not get the parent of {}: {}"
+                               .format(repo['full_name'], ex))
+                return None
+            parent = data.get('parent')
+        return (parent or {}).get('full_name')
+
+    def reference_dir(self, repo):
+        """Get the local copy of a fork's parent to borrow objects from.
+
+        Returns:
+            tuple(str, str): The parent's full name and path, or
+                (None, None) if repo is not a fork or its parent is not
+                backed up in full (shallow or partial clones could be
+                missing objects the fork needs).
+        """
+        parent = self.fork_parent(repo)
+        if not parent:
+            return None, None
+        path = os.path.join(self.backup_dir(), *parent.split("/"))
+        for candidate in (path + ".git", path):  # mirror or clone
+            if not os.path.isdir(candidate):
+                continue
+            if is_shallow_repo(candidate) or is_partial_repo(candidate):
+                logger.info("Not sharing objects of {} with {} (shallow or"
+                            " partial)".format(repo['full_name'], parent))
+                return None, None
+            return parent, candidate
+        return None, None
+
+    def listing_entry(self, repo):
+        """Get the full listing entry (dict) for a RepoRecord.
+
+        The record only has the fields used by a sync, so the rest are
+        read from the page it came from (see ListingStore).
+        """
+        page = getattr(repo, 'page', None)
+        if page is not None and self.listing_store is not None:
+            item = self.listing_store.find(repo['full_name'], page)
+            if item is not None:
+                return item
+        return dict(repo)
+
+    def _sync_if_changed(self, repo, quiet=False, refs=None, force=None):
+        """Sync repo unless self.index or self.plans show it is
+        unchanged.
+
+        Records the result in self.index as soon as it finishes. Only
+        one thread at a time syncs the same directory (see repo_lock).
+
+        Args:
+            refs (list[str], optional): Only fetch these refs (see
+                sync_repo).
+            force (bool, optional): Sync even if unchanged. Defaults to
+                self.force.
+        """
+        if force is None:
+            force = self.force
+        dst_dir = self.repo_dir(repo)
+        with repo_lock(dst_dir):
+            skip = {
+                'full_name': repo['full_name'],
+                'action': "skip",
+                'ok': True,
+                'errors': [],
+            }
+            if not self.share_forks and read_alternates(dst_dir):
+                print("Copying objects borrowed by {} into it"
+                      .format(repr(dst_dir)))
+                if not dissociate_repo(dst_dir):
+                    msg = "Could not dissociate {} from {}".format(
+                        dst_dir, read_alternates(dst_dir))
+                    logger.error(msg)
+                    return dict(skip, action="dissociate", ok=False,
+                                errors=[msg])
+            if self.journal is not None and \
+                    self.journal.is_done(repo['full_name']):
+                return dict(skip, resumed=True)
+            if not force and self.index.is_unchanged(repo, dst_dir):
+                self._journal_mark(repo, "done", action="skip")
+                return skip
+            plan = None if force else self.plans.get(repo['full_name'])
+            if plan and not plan['needs_sync']:
+                self.index.confirm(repo)
+                self._journal_mark(repo, "done", action="skip")
+                return skip
+            with repo_span(repo['full_name']) as trace_args:
+                size_before = object_store_bytes(dst_dir)
+                start = time.time()
+                worker = threading.current_thread().name
+                try:
+                    summary = self.sync_repo(repo, quiet=quiet, refs=refs)
+                except Exception as ex:
+                    self.index.record(
+                        repo, False, duration=time.time() - start,
+                        collection=self.name,
+                        error="{}: {}".format(type(ex).__name__, ex))
+                    self._journal_mark(repo, "failed")
+                    trace_args['ok'] = False
+                    raise
+                summary['duration'] = time.time() - start
+                summary['started'] = start
+                summary['worker'] = worker
+                summary['bytes'] = max(0, object_store_bytes(dst_dir)
+                                       - size_before)
+                heads = None
+                if summary['ok']:
+                    state = read_repo_state(dst_dir)
+                    if state is not None:
+                        heads = state.heads()
+                trace_args['action'] = summary['action']
+                trace_args['ok'] = summary['ok']
+                trace_args['bytes'] = summary['bytes']
+            errors = summary['errors']
+            self.index.record(repo, summary['ok'], refs=heads,
+                              duration=summary['duration'],
+                              collection=self.name,
+                              action=summary['action'],
+                              bytes_fetched=summary['bytes'],
+                              error=errors[0] if errors else None)
+            self._journal_mark(repo, "done" if summary['ok'] else "failed")
+            return summary
+
+    def _journal_mark(self, repo, phase, **fields):
+        if self.journal is not None:
+            self.journal.mark(repo['full_name'], phase, **fields)
+
+    def _remove_partial_clone(self, repo, dst_dir):
+        """Remove what an unfinished clone left in dst_dir.
+
+        An empty dst_dir is always removed (git clone empties the
+        directory when it fails, but it was created beforehand). One
+        with content is only removed if the journal shows that the
+        interrupted run was cloning it.
+
+        Returns:
+            bool: True if dst_dir was removed.
+        """
+        if not os.path.isdir(dst_dir):
+            return False
+        if os.listdir(dst_dir):
+            if self.journal is None or \
+                    not self.journal.was_cloning(repo['full_name']):
+                return False
+            print("Removing unfinished clone {}".format(repr(dst_dir)))
+            shutil.rmtree(dst_dir)
+            return True
+        os.rmdir(dst_dir)
+        return True
+
+    def sync_repo(self, repo, quiet=False, refs=None):
+        """Clone or pull one repo then update each of its branches.
+
+        Branches are updated according to self.branch_mode (see
+        clone_repos).
+
+        Args:
+            repo (dict): One entry from the repo listing.
+            quiet (bool, optional): Capture git clone/pull output into
+                the summary instead of letting it go to the console
+                (avoids interleaved output when running concurrently).
+            refs (list[str], optional): Fetch only these refs (such as
+                ["refs/heads/main"] from a push webhook) instead of
+                every ref of an existing clone (see fetch_refspecs). Not
+                used for a new clone or with branch_mode "switch".
+
+        Returns:
+            dict: Summary with 'full_name', 'action' ("clone", "fetch",
+                "pull", or "update" for a bare mirror), 'policy' (see
+                ClonePolicies), 'ok', 'errors' (list of str), 'branches' (see
+                update_branches, only if self.branch_mode is "refs"),
+                'reference' (full name of the parent a new fork clone
+                borrows objects from, if any), and 'output' if quiet.
+        """
+        print()
+        # example entries:
+        # "name": "{repo_name}",
+        # "full_name": "{self.name}/{repo_name}",
+        # "fork": true,
+        # "git_url": "git://github.com/{self.name}/{repo_name}.git",
+        # "ssh_url": "git@github.com:{self.name}/{repo_name}.git",
+        # "clone_url": "https://github.com/{self.name}/{repo_name}.git",
+        url = repo['ssh_url']  # necessary for using ssh credentials on CLI
+        dst_dir = self.repo_dir(repo)
+        dst_parent = os.path.dirname(dst_dir)
+        summary = {
+            'full_name': repo['full_name'],
+            'action': None,
+            'ok': True,
+            'errors': [],
+        }
+        popen_kwargs = {}
+        if quiet:
+            popen_kwargs['stdout'] = subprocess.PIPE
+            popen_kwargs['stderr'] = subprocess.STDOUT
+        policy = self.clone_policies.policy_for(repo, self.name)
+        summary['policy'] = policy
+        bare = False
+        self._remove_partial_clone(repo, dst_dir)
+        if not os.path.isdir(dst_dir):
+            parent, reference = None, None
+            if self.share_forks:
+                parent, reference = self.reference_dir(repo)
+            os.makedirs(dst_dir)
+            cmd_parts = ["git", "clone"]
+            if self.mirror:
+                cmd_parts.append("--mirror")
+                bare = True
+            if reference:
+                # Only objects the parent doesn't have are downloaded.
+                cmd_parts.extend(["--reference", reference])
+                summary['reference'] = parent
+                protect_shared_objects(reference)
+            cmd_parts.extend(clone_args(policy))
+            cmd_parts.extend([url, dst_dir])
+            summary['action'] = "clone"
+        else:
+            missing = [objects_dir for objects_dir in read_alternates(dst_dir)
+                       if not os.path.isdir(objects_dir)]
+            if missing:
+                msg = ("{} borrows objects from {} which no longer exist."
+                       " Restore them, or remove the repo so it is cloned"
+                       " again.".format(dst_dir, missing))
+                logger.error(msg)
+                summary['ok'] = False
+                summary['errors'].append(msg)
+                return summary
+            popen_kwargs['cwd'] = dst_dir
+            more_args = fetch_args(policy)
+            bare = is_bare_repo(dst_dir)
+            refspecs = None
+            if refs and (bare or self.branch_mode == "refs"):
+                refspecs = fetch_refspecs(refs, bare=bare)
+            if refspecs:
+                # Deleted branches are left for the next full fetch.
+                cmd_parts = ["git", "fetch", "origin"] + refspecs
+                summary['action'] = "update" if bare else "fetch"
+            elif bare:
+                # Mirror (all refs, no working tree), so one command
+                #   updates every branch.
+                cmd_parts = ["git", "remote", "update", "--prune"]
+                summary['action'] = "update"
+            elif self.branch_mode == "refs":
+                # Fetch once, then update_branches fast-forwards each one.
+                cmd_parts = ["git", "fetch", "origin", "--prune"]
+                summary['action'] = "fetch"
             else:
-                popen_kwargs['cwd'] = dst_dir
-                print("git pull  # in {}".format(repr(dst_dir)))
                 cmd_parts = ["git", "pull"]
-            meta_dst = os.path.join(dst_parent, "{}.json".format(repo['name']))
-            with open(meta_dst, "w") as outs:
-                json.dump(repo, outs, indent=2)
+                summary['action'] = "pull"
+            cmd_parts.extend(more_args)
+            print("{}  # in {}".format(shlex.join(cmd_parts), repr(dst_dir)))
+        if self.metadata == "repo":
+            meta_dst = os.path.join(dst_parent,
+                                    "{}.json".format(repo['name']))
+            meta_text = json.dumps(self.listing_entry(repo), indent=2)
+            if write_if_changed(meta_dst, [meta_text]):
                 print("Saved {}".format(repr(meta_dst)))
+        self._journal_mark(repo, "started", action=summary['action'])
+        with span("git " + git_subcommand(cmd_parts), cat="git",
+                  cmd=shlex.join(cmd_parts)) as trace_args:
             result = subprocess.Popen(cmd_parts, **popen_kwargs)
-            # stdout=subprocess.PIPE
-            # stderr=subprocess.PIPE
             text, errors = result.communicate()
             code = result.returncode
-            if code != 0:
-                logger.error(
-                    "`{}` failed"  # in {}
-                    .format(shlex.join(cmd_parts)))  # dst_dir
-                logger.error()
-            previous_branch = current_branch(dst_dir)
-            if not previous_branch:
-                print("Skipping {} (bare repo assumed--no branch selected)"
-                      .format(repr(dst_dir)))
+            trace_args['exit_code'] = code
+        if text is not None:
+            summary['output'] = text.decode("utf-8", errors="replace")
+        if code != 0:
+            msg = "`{}` failed in {}".format(shlex.join(cmd_parts), dst_dir)
+            logger.error(msg)
+            summary['ok'] = False
+            summary['errors'].append(msg)
+        else:
+            self._journal_mark(repo, "cloned" if summary['action'] == "clone"
+                               else "fetched")
+        forget_repo_state(dst_dir)  # refs changed
+        if bare:
+            return summary
+        state = read_repo_state(dst_dir)
+        previous_branch = state.head if state else None
+        if not previous_branch:
+            print("Skipping {} (no branch selected)"
+                  .format(repr(dst_dir)))
+            return summary
+        if self.branch_mode == "refs":
+            branch_results = update_branches(dst_dir, state=state)
+            summary['branches'] = branch_results
+            if branch_results['errors']:
+                summary['ok'] = False
+                summary['errors'].extend(branch_results['errors'])
+            return summary
+        branches = list_remote_branches(dst_dir)
+        if branches:
+            for branch in branches:
+                switch_branch(dst_dir, branch)
+                pull_repo(dst_dir)
+            switch_branch(dst_dir, previous_branch)
+            forget_repo_state(dst_dir)
+        return summary
+
+    @staticmethod
+    def echo_summaries(summaries):
+        """Show one line per repo, in the order given."""
+        print()
+        print("Summary:")
+        skipped = 0
+        resumed = 0
+        for summary in summaries:
+            if summary.get('resumed'):
+                resumed += 1
+                continue
+            if summary.get('action') == "skip":
+                skipped += 1
                 continue
-            branches = list_remote_branches(dst_dir)
-            if branches:
-                for branch in branches:
-                    switch_branch(dst_dir, branch)
-                    pull_repo(dst_dir)
-                switch_branch(dst_dir, previous_branch)
+            print("- {} {}: {}".format(
+                summary.get('action') or "sync",
+                summary.get('full_name'),
+                "OK" if summary.get('ok') else "FAILED",
+            ))
+            for error in summary.get('errors') or []:
+                print("  - {}".format(error))
+            if summary.get('reference'):
+                print("  - sharing objects with {}"
+                      .format(summary['reference']))
+            branch_results = summary.get('branches') or {}
+            for key in ('diverged', 'ahead', 'local_only'):
+                if branch_results.get(key):
+                    print("  - {} (not updated): {}".format(
+                        key.replace("_", "-"),
+                        ", ".join(branch_results[key])))
+            if not summary.get('ok') and summary.get('output'):
+                for line in summary['output'].splitlines():
+                    print("    {}".format(line))
+        if skipped:
+            print("- Skipped {} repo(s) unchanged since the last sync"
+                  " (use --force to sync them anyway)".format(skipped))
+        if resumed:
+            print("- Skipped {} repo(s) already synced by the interrupted"
+                  " run".format(resumed))
 
 
-def gather_repos(org_name, is_org, token=None, refresh=False, dry_run=False,
-                 forks=False, destination=None):
-    """Handles repository operations for the given organization or user."""
+def new_collection(org_name, is_org, token=None, api_url=None):
+    """Create a RepoCollection for an organization or user.
+
+    Args:
+        api_url (str, optional): API server (default DEFAULT_API_URL).
+    """
     org = RepoCollection()
     org.set_name(org_name, is_org, token=token)
+    if api_url:
+        org.api_url = api_url.rstrip("/")
+    return org
+
+
+def gather_repos(org_name, is_org, token=None, refresh=False, dry_run=False,
+                 forks=False, destination=None, jobs=1, jobs_per_host=None,
+                 api_url=None, branch_mode="refs", force=False,
+                 precheck=False, mirror=False, clone_policies=None,
+                 index=None, metadata="repo", listing="rest",
+                 discovery="full", full_listing_days=FULL_LISTING_DAYS,
+                 share_forks=True, journal=None):
+    """Handles repository operations for the given organization or user."""
+    org = new_collection(org_name, is_org, token=token, api_url=api_url)
     logger.info(
         "Collecting {} {} repo(s)"
         .format(org_name, "org" if is_org else "user"))
     if not dry_run:
-        org.clone_repos(refresh=refresh, forks=forks, destination=destination)
+        org.clone_repos(refresh=refresh, forks=forks, destination=destination,
+                        jobs=jobs, jobs_per_host=jobs_per_host,
+                        branch_mode=branch_mode, force=force,
+                        precheck=precheck, mirror=mirror,
+                        clone_policies=clone_policies, index=index,
+                        metadata=metadata, listing=listing,
+                        discovery=discovery,
+                        full_listing_days=full_listing_days,
+                        share_forks=share_forks, journal=journal)
     return org
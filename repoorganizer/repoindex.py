@@ -0,0 +1,373 @@
+"""SQLite index of repos, their refs, and the history of each sync.
+
+One index is shared by every collection in a run, so questions such as
+"which repos are stale?" are answered with an indexed query rather than
+by walking thousands of directories and JSON files.
+"""
+from __future__ import print_function
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    full_name TEXT PRIMARY KEY,
+    collection TEXT,
+    ssh_url TEXT,
+    fork INTEGER,
+    size_kb INTEGER,
+    default_branch TEXT,
+    pushed_at TEXT,
+    updated_at TEXT,
+    listed_at REAL,
+    synced_pushed_at TEXT,
+    synced_updated_at TEXT,
+    last_ok INTEGER,
+    last_synced_at REAL,
+    last_duration REAL,
+    last_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS repos_collection ON repos (collection);
+CREATE TABLE IF NOT EXISTS refs (
+    full_name TEXT NOT NULL,
+    refname TEXT NOT NULL,
+    objectname TEXT NOT NULL,
+    PRIMARY KEY (full_name, refname)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    full_name TEXT NOT NULL,
+    collection TEXT,
+    started_at REAL,
+    duration REAL,
+    ok INTEGER,
+    action TEXT,
+    bytes_fetched INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS syncs_full_name ON syncs (full_name, started_at);
+CREATE TABLE IF NOT EXISTS maintenance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    full_name TEXT NOT NULL,
+    started_at REAL,
+    duration REAL,
+    ok INTEGER,
+    tasks TEXT,
+    loose_before INTEGER,
+    packs_before INTEGER,
+    loose_after INTEGER,
+    packs_after INTEGER,
+    garbage_after INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS maintenance_full_name
+    ON maintenance (full_name, started_at);
+"""
+
+
+class RepoIndex:
+    """Repo metadata, ref tips, and sync results in one SQLite file.
+
+    - repos: One row per repo with fields from the latest listing
+      (pushed_at, updated_at, size_kb...) and the result of its last
+      sync (synced_pushed_at is pushed_at as of the last successful
+      sync, last_ok, last_duration, last_bytes).
+    - refs: Local branch tips as of the last successful sync.
+    - syncs: History (one row per sync attempt).
+    - maintenance: History of git maintenance (see maintenance.py),
+      one row per repo checked, even if nothing had to be done.
+
+    Each method is one transaction, so it is safe to record each repo
+    as soon as it finishes (from any worker thread) and an interrupted
+    run keeps everything recorded so far.
+
+    Args:
+        path (str): SQLite file such as
+            ~/.config/repo-organizer/cache/github/index.sqlite3
+    """
+
+    def __init__(self, path):
+        self.path = path
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def update_listing(self, collection, repos):
+        """Store metadata of every repo in a listing.
+
+        Rows are only rewritten when an entry changed (listed_at is when
+        that last happened), so a listing with nothing new leaves the
+        database file untouched.
+
+        Args:
+            collection (str): Org or user name.
+            repos (list[dict]): Entries from the listing.
+        """
+        now = time.time()
+        rows = [
+            (repo['full_name'], collection, repo.get('ssh_url'),
+             int(bool(repo.get('fork'))), repo.get('size'),
+             repo.get('default_branch'), repo.get('pushed_at'),
+             repo.get('updated_at'), now)
+            for repo in repos
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO repos (full_name, collection, ssh_url, fork,"
+                " size_kb, default_branch, pushed_at, updated_at, listed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(full_name) DO UPDATE SET"
+                " collection=excluded.collection, ssh_url=excluded.ssh_url,"
+                " fork=excluded.fork, size_kb=excluded.size_kb,"
+                " default_branch=excluded.default_branch,"
+                " pushed_at=excluded.pushed_at,"
+                " updated_at=excluded.updated_at,"
+                " listed_at=excluded.listed_at"
+                " WHERE collection IS NOT excluded.collection"
+                " OR ssh_url IS NOT excluded.ssh_url"
+                " OR fork IS NOT excluded.fork"
+                " OR size_kb IS NOT excluded.size_kb"
+                " OR default_branch IS NOT excluded.default_branch"
+                " OR pushed_at IS NOT excluded.pushed_at"
+                " OR updated_at IS NOT excluded.updated_at",
+                rows,
+            )
+
+    def get(self, full_name):
+        """Get the result of the last sync of a repo.
+
+        Returns:
+            dict: With 'pushed_at' (as of the last successful sync),
+                'updated_at', 'refs' (dict), 'duration', 'bytes',
+                'synced_at' and 'ok'. None if never synced.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM repos WHERE full_name = ?",
+                (full_name,)).fetchone()
+            if row is None or row['last_synced_at'] is None:
+                return None
+            refs = dict(self.conn.execute(
+                "SELECT refname, objectname FROM refs WHERE full_name = ?",
+                (full_name,)).fetchall())
+        return {
+            'pushed_at': row['synced_pushed_at'],
+            'updated_at': row['synced_updated_at'],
+            'refs': refs,
+            'duration': row['last_duration'],
+            'bytes': row['last_bytes'],
+            'synced_at': row['last_synced_at'],
+            'ok': bool(row['last_ok']),
+        }
+
+    def is_unchanged(self, repo, path):
+        """Check whether repo was pushed to since its last good sync.
+
+        Args:
+            repo (dict): Entry from the listing (with "pushed_at").
+            path (str): Where the repo should be cloned.
+
+        Returns:
+            bool: True if the last sync succeeded, the clone is still
+                there, and the listing's pushed_at is the same as it
+                was then. False if unknown (such as no pushed_at).
+        """
+        if not repo.get('pushed_at'):
+            return False
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT last_ok, synced_pushed_at FROM repos"
+                " WHERE full_name = ?",
+                (repo['full_name'],)).fetchone()
+        if row is None or not row['last_ok']:
+            return False
+        if row['synced_pushed_at'] != repo['pushed_at']:
+            return False
+        return os.path.isdir(path)
+
+    def record(self, repo, ok, refs=None, duration=None, collection=None,
+               action=None, bytes_fetched=None, error=None):
+        """Store the result of syncing repo (committed immediately).
+
+        Args:
+            repo (dict): Entry from the listing.
+            ok (bool): Whether the sync succeeded.
+            refs (dict[str,str], optional): Local branch tips after the
+                sync (replaces the stored ones unless None).
+            duration (float, optional): Seconds the sync took.
+            collection (str, optional): Org or user name.
+            action (str, optional): Such as "clone" or "fetch".
+            bytes_fetched (int, optional): Growth of the object store.
+            error (str, optional): First error message if not ok.
+        """
+        now = time.time()
+        started_at = now - duration if duration is not None else now
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO repos (full_name, collection)"
+                " VALUES (?, ?)",
+                (repo['full_name'], collection))
+            self.conn.execute(
+                "UPDATE repos SET last_ok = ?, last_synced_at = ?,"
+                " last_duration = ?, last_bytes = ? WHERE full_name = ?",
+                (int(bool(ok)), now, duration, bytes_fetched,
+                 repo['full_name']))
+            if ok:
+                self.conn.execute(
+                    "UPDATE repos SET synced_pushed_at = ?,"
+                    " synced_updated_at = ? WHERE full_name = ?",
+                    (repo.get('pushed_at'), repo.get('updated_at'),
+                     repo['full_name']))
+            if refs is not None:
+                self.conn.execute("DELETE FROM refs WHERE full_name = ?",
+                                  (repo['full_name'],))
+                self.conn.executemany(
+                    "INSERT INTO refs (full_name, refname, objectname)"
+                    " VALUES (?, ?, ?)",
+                    [(repo['full_name'], refname, objectname)
+                     for refname, objectname in refs.items()])
+            self.conn.execute(
+                "INSERT INTO syncs (full_name, collection, started_at,"
+                " duration, ok, action, bytes_fetched, error)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (repo['full_name'], collection, started_at, duration,
+                 int(bool(ok)), action, bytes_fetched, error))
+
+    def confirm(self, repo):
+        """Mark repo as still in sync with its listing entry.
+
+        Use this when a cheaper check (such as git ls-remote) showed no
+        ref changed even though pushed_at did (such as after a tag was
+        pushed), so the next run can skip it by pushed_at alone.
+        """
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE repos SET synced_pushed_at = ?,"
+                " synced_updated_at = ? WHERE full_name = ? AND last_ok = 1",
+                (repo.get('pushed_at'), repo.get('updated_at'),
+                 repo['full_name']))
+
+    def recent_durations(self, collection=None):
+        """Get how long the latest successful sync of each kind took.
+
+        Returns:
+            dict[str,dict[str,float]]: Full name to {action: seconds}
+                (such as {"clone": 80.0, "fetch": 2.5}).
+        """
+        query = (
+            "SELECT syncs.full_name, syncs.action, syncs.duration"
+            " FROM syncs JOIN ("
+            "SELECT full_name, action, MAX(started_at) AS started_at"
+            " FROM syncs WHERE ok = 1 AND duration IS NOT NULL"
+            " AND action IS NOT NULL{} GROUP BY full_name, action"
+            ") AS latest ON syncs.full_name = latest.full_name"
+            " AND syncs.action = latest.action"
+            " AND syncs.started_at = latest.started_at")
+        params = ()
+        if collection is not None:
+            query = query.format(" AND collection = ?")
+            params = (collection,)
+        else:
+            query = query.format("")
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        durations = {}
+        for row in rows:
+            durations.setdefault(row['full_name'], {})[row['action']] = \
+                row['duration']
+        return durations
+
+    def record_maintenance(self, full_name, tasks, ok, started_at=None,
+                           duration=None, before=None, after=None,
+                           error=None):
+        """Store the result of maintaining a repo (committed immediately).
+
+        Args:
+            full_name (str): Such as "some-org/some-repo".
+            tasks (list[str]): Tasks run (empty if none were needed).
+            ok (bool): Whether every task succeeded.
+            started_at (float, optional): Seconds since the epoch.
+                Defaults to now minus duration.
+            duration (float, optional): Seconds the tasks took.
+            before (dict, optional): count_objects before the tasks.
+            after (dict, optional): count_objects after the tasks.
+            error (str, optional): First error message if not ok.
+        """
+        if started_at is None:
+            started_at = time.time() - (duration or 0)
+        before = before or {}
+        after = after or {}
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO maintenance (full_name, started_at, duration,"
+                " ok, tasks, loose_before, packs_before, loose_after,"
+                " packs_after, garbage_after, error)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (full_name, started_at, duration, int(bool(ok)),
+                 ",".join(tasks), before.get('count'), before.get('packs'),
+                 after.get('count'), after.get('packs'),
+                 after.get('garbage'), error))
+
+    def last_maintenance(self):
+        """Get the latest maintenance of each repo.
+
+        Returns:
+            dict[str,dict]: Full name to {'started_at', 'tasks' (list),
+                'ok', 'loose_after', 'garbage_after', 'synced_at'} where
+                synced_at is the time of the repo's last sync (None if
+                unknown), so a repo not synced since can be left alone.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT maintenance.full_name, maintenance.started_at,"
+                " maintenance.tasks, maintenance.ok,"
+                " maintenance.loose_after, maintenance.garbage_after,"
+                " repos.last_synced_at FROM maintenance JOIN ("
+                "SELECT full_name, MAX(started_at) AS started_at"
+                " FROM maintenance GROUP BY full_name"
+                ") AS latest ON maintenance.full_name = latest.full_name"
+                " AND maintenance.started_at = latest.started_at"
+                " LEFT JOIN repos"
+                " ON repos.full_name = maintenance.full_name").fetchall()
+        return {
+            row['full_name']: {
+                'started_at': row['started_at'],
+                'tasks': [task for task in (row['tasks'] or "").split(",")
+                          if task],
+                'ok': bool(row['ok']),
+                'loose_after': row['loose_after'],
+                'garbage_after': row['garbage_after'],
+                'synced_at': row['last_synced_at'],
+            }
+            for row in rows
+        }
+
+    def stale(self, collection=None):
+        """List repos that need a sync according to the latest listing.
+
+        Returns:
+            list[str]: Full names of repos never synced, whose last sync
+                failed, or pushed to since their last successful sync.
+        """
+        query = (
+            "SELECT full_name FROM repos WHERE (last_ok IS NULL"
+            " OR last_ok = 0 OR synced_pushed_at IS NULL"
+            " OR pushed_at IS NULL OR synced_pushed_at != pushed_at)")
+        params = ()
+        if collection is not None:
+            query += " AND collection = ?"
+            params = (collection,)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY full_name",
+                                     params).fetchall()
+        return [row['full_name'] for row in rows]
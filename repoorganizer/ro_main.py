@@ -10,9 +10,35 @@ from repoorganizer import (
     backup_dir,
 )
 
+from repoorganizer.clonepolicy import ClonePolicies
+from repoorganizer.daemon import (
+    DEFAULT_LISTEN,
+    DEFAULT_RECONCILE_HOURS,
+    SyncDaemon,
+    parse_listen,
+)
 from repoorganizer.repocollection import (
-    gather_repos,
+    DISCOVERY_MODES,
+    FULL_LISTING_DAYS,
+    LISTING_BACKENDS,
+    RepoCollection,
+    new_collection,
+)
+from repoorganizer.httpclient import close_default_client
+from repoorganizer.journal import RunJournal
+from repoorganizer.maintenance import (
+    DEFAULT_BUDGET_MINUTES,
+    DEFAULT_JOBS as DEFAULT_MAINTENANCE_JOBS,
+    maintain_collections,
+)
+from repoorganizer.ratelimit import default_limiter
+from repoorganizer.repoindex import RepoIndex
+from repoorganizer.scheduler import (
+    DEFAULT_LIST_JOBS,
+    FAIRNESS_POLICIES,
+    sync_collections,
 )
+from repoorganizer import tracing
 
 MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
 REPO_DIR = os.path.dirname(MODULE_DIR)
@@ -84,7 +110,8 @@ def parse_arguments():
     parser.add_argument(
         "--refresh",
         action="store_true",
-        help="Store true when this option is passed."
+        help=("Download repo listings again even if the server reports"
+              " them as not modified since the last run.")
     )
     parser.add_argument(
         "--no-forks",
@@ -98,6 +125,188 @@ def parse_arguments():
         help=("Specify the destination. Default is: {}"
               .format(settings_path))
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=("Sync every repo even if it was not pushed to since the"
+              " last successful sync.")
+    )
+    parser.add_argument(
+        "--precheck",
+        action="store_true",
+        help=("Use git ls-remote to find which repos have branches that"
+              " changed since they were last fetched, and only sync"
+              " those.")
+    )
+    parser.add_argument(
+        "--mirror",
+        action="store_true",
+        help=("Store each repo as a bare mirror ({name}.git, no working"
+              " tree) updated with git remote update --prune.")
+    )
+    parser.add_argument(
+        "--branch-mode",
+        choices=["refs", "switch"],
+        default="refs",
+        help=("How to update branches other than the checked-out one:"
+              " refs (default) fetches once then fast-forwards each local"
+              " branch without checking it out; switch checks out and"
+              " pulls each branch in turn.")
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        help=("Number of repos to sync at once"
+              ' (default: "jobs" in settings, otherwise 1).')
+    )
+    parser.add_argument(
+        "--jobs-per-host",
+        type=int,
+        default=None,
+        help=("Maximum number of repos to sync at once from the same host"
+              ' (default: "jobs_per_host" in settings, otherwise no limit'
+              " other than --jobs).")
+    )
+    parser.add_argument(
+        "--jobs-per-owner",
+        type=int,
+        default=None,
+        help=("Maximum number of repos of the same org or user to sync at"
+              ' once (default: "jobs_per_owner" in settings, otherwise no'
+              " limit other than --jobs).")
+    )
+    parser.add_argument(
+        "--fairness",
+        choices=FAIRNESS_POLICIES,
+        default=None,
+        help=("Order in which repos of different orgs and users are"
+              " synced: round-robin (one from each in turn), fifo (one"
+              " org or user after another) or longest-first (the longest"
+              " expected sync of any org or user next, to finish"
+              " soonest). Each org's or user's own repos are always"
+              ' synced longest first. Default: "fairness" in settings,'
+              " otherwise round-robin.")
+    )
+    parser.add_argument(
+        "--metadata",
+        choices=["repo", "owner"],
+        default=None,
+        help=("Save listing metadata as {owner}/{name}.json for each"
+              " repo (repo) or as one {owner}.json per owner (owner)."
+              ' Default: "metadata" in settings, otherwise repo.')
+    )
+    parser.add_argument(
+        "--listing",
+        choices=LISTING_BACKENDS,
+        default=None,
+        help=("List repos with the REST API (rest) or with the GraphQL"
+              " API (graphql), which also gets every branch head so only"
+              " repos where a branch moved are synced. graphql requires a"
+              ' token. Default: "listing" in settings, otherwise rest.')
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=("Continue the last run if it was interrupted: skip repos"
+              " it finished, and remove and retry any clone it left"
+              " unfinished.")
+    )
+    parser.add_argument(
+        "--no-share-forks",
+        action="store_true",
+        help=("Clone forks in full instead of borrowing objects from the"
+              " backed up parent (git clone --reference), and copy"
+              " borrowed objects into forks cloned that way before, so"
+              ' parents can be removed safely. Same as "share_forks":'
+              " false in settings.")
+    )
+    parser.add_argument(
+        "--discovery",
+        choices=DISCOVERY_MODES,
+        default=None,
+        help=("List every repo each run (full) or only repos pushed since"
+              " the last run (incremental, using the search API), merged"
+              ' into the last listing. Default: "discovery" in settings,'
+              " otherwise full.")
+    )
+    parser.add_argument(
+        "--full-listing-days",
+        type=float,
+        default=None,
+        help=("With --discovery incremental, still list every repo (to"
+              " notice deleted and renamed repos) if the last full"
+              ' listing was this many days ago. Default:'
+              ' "full_listing_days" in settings, otherwise {}.'
+              .format(FULL_LISTING_DAYS))
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help=("Keep running: sync a repo as soon as a GitHub push webhook"
+              " is posted to --listen (only the pushed ref), and sync"
+              " every repo every --reconcile-hours. Requires"
+              ' "webhook_secret" in settings (the webhook\'s secret),'
+              " since unsigned payloads are refused.")
+    )
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default=None,
+        help=("HOST:PORT for --daemon to receive webhooks on (at"
+              ' /webhook). Default: "listen" in settings, otherwise {}.'
+              .format(DEFAULT_LISTEN))
+    )
+    parser.add_argument(
+        "--reconcile-hours",
+        type=float,
+        default=None,
+        help=("With --daemon, hours between syncs of every repo (to"
+              " catch missed webhooks), or 0 for none after the first."
+              ' Default: "reconcile_hours" in settings, otherwise {}.'
+              .format(DEFAULT_RECONCILE_HOURS))
+    )
+    parser.add_argument(
+        "--maintenance",
+        action="store_true",
+        help=("After syncing, run git gc, repack, commit-graph write or"
+              " multi-pack-index write in each repo that needs it"
+              " (according to its loose object and pack counts), and"
+              " record it so repos not synced since are left alone."
+              ' Same as "maintenance": true in settings. With --daemon,'
+              " runs after each sync of every repo.")
+    )
+    parser.add_argument(
+        "--maintenance-minutes",
+        type=float,
+        default=None,
+        help=("Don't start maintaining a repo after this many minutes"
+              " (the rest wait for the next run), or 0 for no limit."
+              ' Default: "maintenance_minutes" in settings, otherwise'
+              " {}.".format(DEFAULT_BUDGET_MINUTES))
+    )
+    parser.add_argument(
+        "--maintenance-jobs",
+        type=int,
+        default=None,
+        help=("Number of repos to maintain at once. Default:"
+              ' "maintenance_jobs" in settings, otherwise {}.'
+              .format(DEFAULT_MAINTENANCE_JOBS))
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=("Time each phase, repo, API request and git command, and"
+              " show totals and the slowest repos at the end.")
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help=("Save the --profile spans (implies --profile) to this path"
+              " in Chrome trace format (open in chrome://tracing or"
+              " ui.perfetto.dev).")
+    )
 
     return parser.parse_args()
 
@@ -124,6 +333,9 @@ def main():
         return 1
 
     args = parse_arguments()
+    tracer = None
+    if args.profile or args.trace:
+        tracer = tracing.enable()
 
     github = settings["sources"]["github"]
     orgs = github.get("orgs")
@@ -147,6 +359,99 @@ def main():
         github = {}
     if not tokens:
         tokens = {}
+    jobs = args.jobs
+    if jobs is None:
+        jobs = github.get('jobs', 1)
+    jobs_per_host = args.jobs_per_host
+    if jobs_per_host is None:
+        jobs_per_host = github.get('jobs_per_host')
+    jobs_per_owner = args.jobs_per_owner
+    if jobs_per_owner is None:
+        jobs_per_owner = github.get('jobs_per_owner')
+    fairness = args.fairness
+    if fairness is None:
+        fairness = github.get('fairness', "round-robin")
+    if fairness not in FAIRNESS_POLICIES:
+        logger.error("Expected one of {} for fairness, got {} (check {})"
+                     .format(FAIRNESS_POLICIES, repr(fairness),
+                             repr(settings_path)))
+        return 1
+    metadata = args.metadata
+    if metadata is None:
+        metadata = github.get('metadata', "repo")
+    listing = args.listing
+    if listing is None:
+        listing = github.get('listing', "rest")
+    if listing not in LISTING_BACKENDS:
+        logger.error("Expected one of {} for listing, got {} (check {})"
+                     .format(LISTING_BACKENDS, repr(listing),
+                             repr(settings_path)))
+        return 1
+    discovery = args.discovery
+    if discovery is None:
+        discovery = github.get('discovery', "full")
+    if discovery not in DISCOVERY_MODES:
+        logger.error("Expected one of {} for discovery, got {} (check {})"
+                     .format(DISCOVERY_MODES, repr(discovery),
+                             repr(settings_path)))
+        return 1
+    full_listing_days = args.full_listing_days
+    if full_listing_days is None:
+        full_listing_days = github.get('full_listing_days',
+                                       FULL_LISTING_DAYS)
+    share_forks = github.get('share_forks', True)
+    if args.no_share_forks:
+        share_forks = False
+    listen = args.listen
+    if listen is None:
+        listen = github.get('listen', DEFAULT_LISTEN)
+    try:
+        parse_listen(listen)
+    except ValueError as ex:
+        logger.error("{} (check {})".format(ex, repr(settings_path)))
+        return 1
+    if args.daemon and not github.get('webhook_secret'):
+        logger.error('--daemon requires "webhook_secret" (the secret set'
+                     " for the webhook on GitHub) in {}"
+                     .format(repr(settings_path)))
+        return 1
+    reconcile_hours = args.reconcile_hours
+    if reconcile_hours is None:
+        reconcile_hours = github.get('reconcile_hours',
+                                     DEFAULT_RECONCILE_HOURS)
+    maintenance = None
+    if args.maintenance or github.get('maintenance'):
+        maintenance = {
+            'budget_minutes': args.maintenance_minutes,
+            'jobs': args.maintenance_jobs,
+        }
+        if maintenance['budget_minutes'] is None:
+            maintenance['budget_minutes'] = github.get(
+                'maintenance_minutes', DEFAULT_BUDGET_MINUTES)
+        if maintenance['jobs'] is None:
+            maintenance['jobs'] = github.get('maintenance_jobs',
+                                             DEFAULT_MAINTENANCE_JOBS)
+    try:
+        clone_policies = ClonePolicies.from_settings(github)
+    except ValueError as ex:
+        logger.error("{} (check clone policies in {})"
+                     .format(ex, repr(settings_path)))
+        return 1
+    index = RepoIndex(RepoCollection.index_path())
+    journal = None
+    if not args.daemon:
+        # A daemon's runs never end, so there is nothing to resume.
+        journal = RunJournal(
+            os.path.join(RepoCollection.cache_dir(), "run-journal.jsonl"),
+            resume=args.resume)
+    if journal is not None and journal.interrupted:
+        if args.resume:
+            print("Resuming the interrupted run, which finished {} repo(s)"
+                  .format(journal.interrupted))
+        else:
+            print("The last run was interrupted after finishing {} repo(s)."
+                  " Starting over since --resume was not used."
+                  .format(journal.interrupted))
     counts = {}
     collections = []
     no_token = {}
@@ -164,14 +469,11 @@ def main():
                 if not token:
                     no_token[cat_name].append(name)
                     no_token_total += 1
-                collection = gather_repos(
+                collection = new_collection(
                     name,
                     is_org=(cat_name == "orgs"),
                     token=token,
-                    refresh=args.refresh,
-                    dry_run=False,  # True is debug only!
-                    forks=not args.no_forks,
-                    destination=args.destination,
+                    api_url=github.get('api_url'),
                 )
                 collections.append(collection)
                 counts[cat_name] += 1
@@ -182,6 +484,47 @@ def main():
                         repr(settings_path)))
     # else the URL is used which lists all repos user can access
     #   (full name covers directory structure)
+    options = dict(
+        jobs=jobs,
+        jobs_per_host=jobs_per_host,
+        jobs_per_owner=jobs_per_owner,
+        fairness=fairness,
+        list_jobs=github.get('list_jobs', DEFAULT_LIST_JOBS),
+        refresh=args.refresh,
+        forks=not args.no_forks,
+        destination=args.destination,
+        branch_mode=args.branch_mode,
+        force=args.force,
+        precheck=args.precheck,
+        mirror=args.mirror,
+        clone_policies=clone_policies,
+        index=index,
+        metadata=metadata,
+        listing=listing,
+        discovery=discovery,
+        full_listing_days=full_listing_days,
+        share_forks=share_forks,
+    )
+    if args.daemon:
+        daemon = SyncDaemon(
+            collections,
+            listen=listen,
+            secret=github.get('webhook_secret'),
+            reconcile_hours=reconcile_hours,
+            maintenance=maintenance,
+            **options
+        )
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            print("Stopping (waiting for webhook syncs in progress)")
+        finally:
+            daemon.stop()
+    else:
+        sync_collections(collections, journal=journal, **options)
+        journal.finish()
+        if maintenance is not None:
+            maintain_collections(collections, index, **maintenance)
 
     logger.info(
         "Processed {} orgs {} users".format(counts['orgs'], counts['users']))
@@ -196,10 +539,26 @@ def main():
               " (must have separate token owned by organization)"
               " and are not expired."
               " Tokens were used for all list URLs during this run.")
+    stale = index.stale()
+    if stale:
+        print("{} repo(s) still need a sync (see {}):"
+              .format(len(stale), index.path))
+        for full_name in stale[:10]:
+            print("- {}".format(full_name))
+        if len(stale) > 10:
+            print("- ...")
+    index.close()
+    close_default_client()
     print("JSON URLs used:")
     for collection in collections:
         for json_url in collection.json_urls:
             print("- {}".format(json_url))
+    default_limiter().echo_report()
+    if tracer:
+        tracer.echo_summary()
+        if args.trace:
+            tracer.save(args.trace)
+            print("Saved trace to {}".format(repr(args.trace)))
     return 0
 
 
@@ -0,0 +1,252 @@
+"""Sync the repos of every collection (org or user) from one queue.
+
+Collections are listed concurrently, and each repo is queued as soon as
+its collection's listing is ready, so one slow org no longer holds up
+every user after it. Worker threads take repos from the shared queue
+according to the fairness policy and the per-owner and per-host limits.
+New fork clones wait in a second queue until the first is done, and
+each collection's repos are queued longest first (see
+RepoCollection.sync_batches).
+"""
+from __future__ import print_function
+import os
+import sys
+import threading
+
+from collections import OrderedDict, deque
+
+from repoorganizer.syncpool import (
+    run_pool,
+    url_host,
+)
+from repoorganizer.tracing import span
+from repoorganizer.workorder import echo_critical_path
+
+MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(MODULE_DIR)
+REPOS_DIR = os.path.dirname(REPO_DIR)
+if os.path.isfile(os.path.join(REPOS_DIR, "hierosoft", "hierosoft",
+                               "__init__.py")):
+    sys.path.insert(0, os.path.join(REPOS_DIR, "hierosoft"))
+
+from hierosoft.logging2 import getLogger  # noqa: E402  #type:ignore
+
+logger = getLogger(__name__)
+
+FAIRNESS_POLICIES = ("round-robin", "fifo", "longest-first")
+DEFAULT_LIST_JOBS = 4
+
+
+def repo_owner(repo):
+    """Get the owner (org or user) part of a repo's full name."""
+    return (repo.get('full_name') or "").split("/")[0]
+
+
+class WorkQueue:
+    """Repos waiting to be synced, grouped by owner.
+
+    Args:
+        producers (int): Number of collections that will add repos.
+            get() only returns None after close_producer was called
+            this many times and every repo was taken.
+        fairness (str, optional): Which owner's repo to take next:
+            - "round-robin" (default): Each owner in turn, so every
+              owner makes progress no matter how many repos the others
+              have.
+            - "fifo": In the order queued (all of the first owner's
+              repos, then the next owner's), except where a limit
+              would be exceeded.
+            - "longest-first": The task with the highest cost among
+              the next task of each owner (so each owner's tasks
+              should be added longest first), which minimizes the
+              total time when costs are durations.
+        per_owner (int, optional): Maximum repos of one owner being
+            synced at once (None for no limit).
+        per_host (int, optional): Maximum repos from one host being
+            synced at once (None for no limit).
+    """
+
+    def __init__(self, producers, fairness="round-robin", per_owner=None,
+                 per_host=None):
+        if fairness not in FAIRNESS_POLICIES:
+            raise ValueError("Expected one of {} for fairness, got {}"
+                             .format(FAIRNESS_POLICIES, repr(fairness)))
+        self.fairness = fairness
+        self.per_owner = per_owner
+        self.per_host = per_host
+        self.producers = producers
+        self._pending = OrderedDict()  # owner to deque of tasks
+        self._owner_busy = {}
+        self._host_busy = {}
+        self._cond = threading.Condition()
+
+    def add(self, task, owner, host, cost=0.0):
+        """Queue task (any object) for owner on host.
+
+        Args:
+            cost (float, optional): Such as estimated seconds (only used
+                by the "longest-first" policy).
+        """
+        with self._cond:
+            self._pending.setdefault(owner, deque()).append(
+                (task, host, cost))
+            self._cond.notify()
+
+    def close_producer(self):
+        """Call once for each producer when it has added all its tasks."""
+        with self._cond:
+            self.producers -= 1
+            self._cond.notify_all()
+
+    def _allowed(self, owner, host):
+        if self.per_owner and \
+                self._owner_busy.get(owner, 0) >= self.per_owner:
+            return False
+        if self.per_host and host and \
+                self._host_busy.get(host, 0) >= self.per_host:
+            return False
+        return True
+
+    def _take(self):
+        owners = list(self._pending)
+        if self.fairness == "longest-first":
+            owners.sort(key=lambda owner: -self._pending[owner][0][2])
+        for owner in owners:
+            tasks = self._pending[owner]
+            task, host, _ = tasks[0]
+            if not self._allowed(owner, host):
+                continue
+            tasks.popleft()
+            if not tasks:
+                del self._pending[owner]
+            elif self.fairness == "round-robin":
+                self._pending.move_to_end(owner)
+            self._owner_busy[owner] = self._owner_busy.get(owner, 0) + 1
+            if host:
+                self._host_busy[host] = self._host_busy.get(host, 0) + 1
+            return task, owner, host
+        return None
+
+    def get(self):
+        """Wait for a task that the limits allow.
+
+        Returns:
+            tuple: (task, owner, host) to pass to done() when finished,
+                or None if every task was taken and no more will come.
+        """
+        with self._cond:
+            while True:
+                taken = self._take()
+                if taken is not None:
+                    return taken
+                if not self._pending and self.producers <= 0:
+                    return None
+                self._cond.wait()
+
+    def done(self, owner, host):
+        """Free the limits held by a task from get()."""
+        with self._cond:
+            self._owner_busy[owner] -= 1
+            if host:
+                self._host_busy[host] -= 1
+            self._cond.notify_all()
+
+
+def sync_collections(collections, jobs=1, jobs_per_host=None,
+                     jobs_per_owner=None, fairness="round-robin",
+                     list_jobs=DEFAULT_LIST_JOBS, **options):
+    """List and sync several collections with one shared pool.
+
+    The summary of each collection is shown in the same order as the
+    collections, after every repo is done.
+
+    Args:
+        collections (list[RepoCollection]): Collections with names set.
+        jobs (int, optional): Number of repos to sync at once in total.
+        jobs_per_host (int, optional): See WorkQueue per_host.
+        jobs_per_owner (int, optional): See WorkQueue per_owner.
+        fairness (str, optional): See WorkQueue.
+        list_jobs (int, optional): Collections to list at once.
+        options: Passed to RepoCollection.prepare_sync (such as
+            refresh, destination, branch_mode, force, precheck, mirror,
+            clone_policies, index, metadata, listing, discovery,
+            full_listing_days, share_forks, journal).
+
+    Returns:
+        list[list[dict]]: Summaries of each collection's repos (see
+            sync_repo) in listing order, or None for a collection that
+            could not be listed.
+    """
+    queues = [
+        WorkQueue(len(collections), fairness=fairness,
+                  per_owner=jobs_per_owner, per_host=jobs_per_host)
+        for _ in range(2)  # see RepoCollection.sync_batches
+    ]
+    results = [None] * len(collections)
+    quiet = bool(jobs and jobs > 1)
+
+    def _list(number):
+        collection = collections[number]
+        try:
+            collection.prepare_sync(jobs=jobs, jobs_per_host=jobs_per_host,
+                                    **options)
+            results[number] = [None] * len(collection.repos)
+            for queue, batch in zip(queues, collection.sync_batches()):
+                for position in batch:
+                    repo = collection.repos[position]
+                    queue.add((number, position), repo_owner(repo),
+                              url_host(repo.get('ssh_url')),
+                              cost=collection.estimates.get(position, 0.0))
+        finally:
+            for queue in queues:
+                queue.close_producer()
+
+    def _work(queue):
+        while True:
+            taken = queue.get()
+            if taken is None:
+                return
+            (number, position), owner, host = taken
+            collection = collections[number]
+            repo = collection.repos[position]
+            try:
+                summary = collection._sync_if_changed(repo, quiet=quiet)
+            except Exception as ex:
+                logger.exception("Job failed for {}".format(repo))
+                summary = collection.error_summary(repo, ex)
+            finally:
+                queue.done(owner, host)
+            results[number][position] = summary
+
+    def _start_workers(batch):
+        # Names differ between batches (see workorder.critical_path).
+        workers = [threading.Thread(target=_work, args=(queues[batch],),
+                                    name="sync-{}-{}".format(batch, i))
+                   for i in range(max(1, jobs or 1))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        return workers
+
+    with span("sync all", cat="phase", collections=len(collections)):
+        workers = _start_workers(0)
+        listed = run_pool(range(len(collections)), _list, jobs=list_jobs)
+        for collection, outcome in zip(collections, listed):
+            if isinstance(outcome, Exception):
+                logger.error("Could not list {}: {}"
+                             .format(collection.name, outcome))
+        for batch in range(1, len(queues)):
+            for worker in workers:
+                worker.join()
+            workers = _start_workers(batch)
+        for worker in workers:
+            worker.join()
+    for collection, summaries in zip(collections, results):
+        if summaries is not None:
+            print()
+            print("{}:".format(collection.name))
+            collection.finish_sync(summaries)
+    if quiet:
+        echo_critical_path([summary for summaries in results if summaries
+                            for summary in summaries], jobs)
+    return results
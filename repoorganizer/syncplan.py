@@ -0,0 +1,188 @@
+"""Decide which repos need a fetch by comparing refs before fetching."""
+from __future__ import print_function
+import asyncio
+import os
+
+from repoorganizer.moregitcli import (
+    gather_limited,
+    is_bare_repo_async,
+    read_repo_state_async,
+    ls_remote_async,
+    run_sync,
+)
+from repoorganizer.syncpool import url_host
+
+
+def diff_refs(local, remote):
+    """Compare two sets of branch heads.
+
+    Args:
+        local (dict[str,str]): Ref name to object id, as last fetched.
+        remote (dict[str,str]): Ref name to object id, as on the remote
+            now.
+
+    Returns:
+        dict[str,list[str]]: Sorted ref names under 'changed', 'added'
+            (only on the remote) and 'deleted' (only local).
+    """
+    return {
+        'changed': sorted(name for name in remote
+                          if name in local and local[name] != remote[name]),
+        'added': sorted(name for name in remote if name not in local),
+        'deleted': sorted(name for name in local if name not in remote),
+    }
+
+
+def tracked_heads(repo_path, remote="origin"):
+    """Get the remote branch heads recorded by the last fetch.
+
+    For a bare mirror, the branches themselves are the remote heads as
+    of the last fetch, so refs/heads is used instead of refs/remotes.
+
+    Returns:
+        dict[str,str]: Such as {"refs/heads/main": object id} (named as
+            on the remote, so the result can be compared to ls_remote).
+            None if git failed.
+    """
+    return run_sync(tracked_heads_async(repo_path, remote=remote))
+
+
+async def tracked_heads_async(repo_path, remote="origin"):
+    """See tracked_heads."""
+    bare, state = await asyncio.gather(is_bare_repo_async(repo_path),
+                                       read_repo_state_async(repo_path))
+    if state is None:
+        return None
+    if bare:
+        return state.heads()
+    return {"refs/heads/" + name: objectname
+            for name, objectname in state.remote_branches(remote).items()}
+
+
+def plan_repo(url, repo_path, full_name=None, remote_heads=None):
+    """Check whether one repo needs a fetch using git ls-remote.
+
+    Args:
+        remote_heads (dict[str,str], optional): Branch heads already
+            known (such as from a GraphQL listing), in which case
+            ls-remote is not needed.
+
+    Returns:
+        dict: Plan with 'full_name', 'path', 'needs_sync' (bool),
+            'reason' (str) and the result of diff_refs ('changed',
+            'added', 'deleted').
+    """
+    return run_sync(plan_repo_async(url, repo_path, full_name=full_name,
+                                    remote_heads=remote_heads))
+
+
+async def plan_repo_async(url, repo_path, full_name=None, remote_heads=None):
+    """See plan_repo."""
+    plan = {
+        'full_name': full_name,
+        'path': repo_path,
+        'needs_sync': True,
+        'reason': None,
+        'changed': [],
+        'added': [],
+        'deleted': [],
+    }
+    if not os.path.isdir(repo_path):
+        plan['reason'] = "not cloned"
+        return plan
+    if remote_heads is not None:
+        local = await tracked_heads_async(repo_path)
+        remote = remote_heads
+    else:
+        # Read local refs while waiting on the (slower) remote.
+        local, remote = await asyncio.gather(tracked_heads_async(repo_path),
+                                             ls_remote_async(url))
+    if local is None:
+        plan['reason'] = "could not read local refs"
+        return plan
+    if remote is None:
+        plan['reason'] = "ls-remote failed"
+        return plan
+    plan.update(diff_refs(local, remote))
+    if plan['changed'] or plan['added'] or plan['deleted']:
+        plan['reason'] = "refs moved"
+    else:
+        plan['needs_sync'] = False
+        plan['reason'] = "refs unchanged"
+    return plan
+
+
+def plan_repos(repos, repo_dir, jobs=1, per_host=None):
+    """Run plan_repo for each repo in the listing concurrently.
+
+    All checks run on one event loop, since each is only a couple of
+    short-lived git processes. Repos with "heads" in the listing (see
+    list_repos_graphql) are compared to those instead of ls-remote.
+
+    Args:
+        repos (list[dict]): Entries from the listing.
+        repo_dir (Callable): Get the local path for a listing entry.
+        jobs (int, optional): Number of ls-remote calls at once.
+        per_host (int, optional): Maximum number at once per host.
+
+    Returns:
+        list[dict]: A plan (see plan_repo) for each repo, in order.
+    """
+    return run_sync(plan_repos_async(repos, repo_dir, jobs=jobs,
+                                     per_host=per_host))
+
+
+async def plan_repos_async(repos, repo_dir, jobs=1, per_host=None):
+    """See plan_repos."""
+    host_semaphores = {}
+
+    async def _plan(repo):
+        host = url_host(repo.get('ssh_url'))
+        sem = None
+        if per_host:
+            sem = host_semaphores.get(host)
+            if sem is None:
+                sem = asyncio.Semaphore(per_host)
+                host_semaphores[host] = sem
+        try:
+            if sem is not None:
+                async with sem:
+                    return await plan_repo_async(
+                        repo['ssh_url'], repo_dir(repo),
+                        full_name=repo['full_name'],
+                        remote_heads=repo.get('heads'))
+            return await plan_repo_async(repo['ssh_url'], repo_dir(repo),
+                                         full_name=repo['full_name'],
+                                         remote_heads=repo.get('heads'))
+        except Exception as ex:
+            return {
+                'full_name': repo.get('full_name'),
+                'path': None,
+                'needs_sync': True,
+                'reason': "{}: {}".format(type(ex).__name__, ex),
+                'changed': [],
+                'added': [],
+                'deleted': [],
+            }
+
+    return await gather_limited([_plan(repo) for repo in repos],
+                                limit=max(1, jobs or 1))
+
+
+def echo_plan(plans):
+    """Show which refs moved for each repo that needs a sync."""
+    if not plans:
+        return
+    print()
+    print("Plan:")
+    unchanged = 0
+    for plan in plans:
+        if not plan['needs_sync']:
+            unchanged += 1
+            continue
+        print("- {}: {}".format(plan['full_name'], plan['reason']))
+        for key in ('changed', 'added', 'deleted'):
+            if plan.get(key):
+                print("  - {}: {}".format(key, ", ".join(plan[key])))
+    if unchanged:
+        print("- {} repo(s) with refs unchanged".format(unchanged))
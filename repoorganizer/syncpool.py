@@ -0,0 +1,119 @@
+"""Run per-repo jobs on a pool of worker threads.
+
+Each git operation is a separate process, so threads are enough to keep
+many clones or pulls in flight at once while Python itself only waits.
+"""
+from __future__ import print_function
+import os
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(MODULE_DIR)
+REPOS_DIR = os.path.dirname(REPO_DIR)
+if os.path.isfile(os.path.join(REPOS_DIR, "hierosoft", "hierosoft",
+                               "__init__.py")):
+    sys.path.insert(0, os.path.join(REPOS_DIR, "hierosoft"))
+
+from hierosoft.logging2 import getLogger  # noqa: E402  #type:ignore
+
+if sys.version_info.major >= 3:
+    from urllib.parse import urlparse
+else:
+    from urlparse import urlparse  # type:ignore
+
+logger = getLogger(__name__)
+
+
+def url_host(url):
+    """Get the host name from a git remote URL.
+
+    Args:
+        url (str): Such as "git@github.com:owner/repo.git" (scp-like
+            ssh syntax) or "https://github.com/owner/repo.git".
+
+    Returns:
+        str: Such as "github.com", or "" if url is a local path.
+    """
+    if not url:
+        return ""
+    if "://" in url:
+        return urlparse(url).hostname or ""
+    if ":" in url.split("/")[0]:
+        # scp-like syntax such as git@github.com:owner/repo.git
+        host = url.split(":", 1)[0]
+        return host.split("@")[-1]
+    return ""
+
+
+class HostLimiter:
+    """Limit how many jobs may talk to the same host at once.
+
+    Args:
+        per_host (int, optional): Maximum number of concurrent jobs per
+            host. None or 0 for no limit other than the pool size.
+    """
+
+    def __init__(self, per_host=None):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def semaphore(self, host):
+        """Get the semaphore for host (None if there is no limit)."""
+        if not self.per_host:
+            return None
+        with self._lock:
+            sem = self._semaphores.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = sem
+            return sem
+
+
+def run_pool(items, func, jobs=1, per_host=None, host_of=None,
+             on_error=None):
+    """Call func(item) for each item using up to jobs threads.
+
+    Args:
+        items (list): Work items, such as repo dicts from the listing.
+        func (Callable): Called with one item, returns its result.
+        jobs (int, optional): Number of worker threads. 1 (default) runs
+            everything in the calling thread, in order.
+        per_host (int, optional): Maximum jobs per host at once.
+        host_of (Callable, optional): Get the host for an item (required
+            for per_host to have an effect).
+        on_error (Callable, optional): Called with (item, exception) to
+            produce a result when func raises, so that one failure does
+            not stop the other items. If None, the exception itself is
+            used as the result.
+
+    Returns:
+        list: Results in the same order as items regardless of the order
+            in which they finished.
+    """
+    limiter = HostLimiter(per_host=per_host)
+
+    def _call(item):
+        sem = None
+        if host_of is not None:
+            sem = limiter.semaphore(host_of(item))
+        try:
+            if sem is not None:
+                with sem:
+                    return func(item)
+            return func(item)
+        except Exception as ex:
+            logger.exception("Job failed for {}".format(item))
+            if on_error is not None:
+                return on_error(item, ex)
+            return ex
+
+    items = list(items)
+    if not jobs or jobs < 2 or len(items) < 2:
+        return [_call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_call, item) for item in items]
+        return [future.result() for future in futures]
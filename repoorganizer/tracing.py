@@ -0,0 +1,257 @@
+"""Record how long each phase, repo, API request and git command takes.
+
+Nothing is recorded unless enable() was called (such as by --profile),
+so span() costs almost nothing otherwise. Spans are kept as Chrome
+trace events (see save), which can be opened in chrome://tracing or
+https://ui.perfetto.dev, and summarized with echo_summary.
+
+Example:
+    with span("fetch", cat="git", repo=path) as args:
+        code = run()
+        args['exit_code'] = code
+"""
+from __future__ import print_function
+import asyncio
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+_tracer = None
+_local = threading.local()
+
+
+def git_subcommand(cmd_parts):
+    """Get the subcommand (such as "fetch") from a git command.
+
+    Args:
+        cmd_parts (list[str]): Such as ["git", "-C", path, "fetch"].
+    """
+    index = 1 if cmd_parts and cmd_parts[0].endswith("git") else 0
+    while index < len(cmd_parts):
+        arg = cmd_parts[index]
+        if arg in ("-C", "-c"):
+            index += 2
+            continue
+        if arg.startswith("-"):
+            index += 1
+            continue
+        return arg
+    return ""
+
+
+class Tracer:
+    """Collect spans from any thread or asyncio task."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._tids = {}
+        self._thread_names = []
+        self.repo_git = {}  # full_name to {'count': n, 'failed': n}
+
+    def _tid(self):
+        """Get a small number for the current thread (and task).
+
+        Each asyncio task gets its own row, since concurrent git
+        processes in one thread would otherwise overlap in the viewer.
+        """
+        thread = threading.current_thread()
+        task = None
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            pass  # no event loop running in this thread
+        key = (thread.ident, id(task) if task is not None else None)
+        with self._lock:
+            tid = self._tids.get(key)
+            if tid is None:
+                tid = len(self._tids) + 1
+                self._tids[key] = tid
+                name = thread.name
+                if task is not None:
+                    name += " task {}".format(tid)
+                self._thread_names.append((tid, name))
+        return tid
+
+    def add(self, name, cat, start, end, args, tid):
+        """Add a complete span (times from time.perf_counter)."""
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': "X",
+            'ts': round((start - self.start) * 1e6),
+            'dur': round((end - start) * 1e6),
+            'pid': self.pid,
+            'tid': tid,
+            'args': args,
+        }
+        with self._lock:
+            self.events.append(event)
+            if cat == "git":
+                repo = args.get('repo')
+                if repo:
+                    counts = self.repo_git.setdefault(
+                        repo, {'count': 0, 'failed': 0})
+                    counts['count'] += 1
+                    if args.get('exit_code'):
+                        counts['failed'] += 1
+
+    def chrome_trace(self):
+        """Get the spans in Chrome trace event format (dict)."""
+        with self._lock:
+            events = list(self.events)
+            names = list(self._thread_names)
+        meta = [
+            {'name': "thread_name", 'ph': "M", 'pid': self.pid, 'tid': tid,
+             'args': {'name': name}}
+            for tid, name in names
+        ]
+        return {'traceEvents': meta + events, 'displayTimeUnit': "ms"}
+
+    def save(self, path):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(path, "w") as stream:
+            json.dump(self.chrome_trace(), stream)
+
+    def spans(self, cat=None):
+        with self._lock:
+            return [event for event in self.events
+                    if cat is None or event['cat'] == cat]
+
+    def totals(self, cat, key=None):
+        """Sum the duration (seconds) and count of spans by name.
+
+        Args:
+            cat (str): Category such as "git".
+            key (Callable, optional): Get the name to group by from an
+                event (default: its name).
+
+        Returns:
+            dict[str,dict]: {name: {'count': n, 'seconds': s,
+                'failed': n}} where failed counts nonzero exit codes.
+        """
+        totals = {}
+        for event in self.spans(cat):
+            name = key(event) if key else event['name']
+            total = totals.setdefault(
+                name, {'count': 0, 'seconds': 0.0, 'failed': 0})
+            total['count'] += 1
+            total['seconds'] += event['dur'] / 1e6
+            if event['args'].get('exit_code'):
+                total['failed'] += 1
+        return totals
+
+    def slowest(self, cat="repo", limit=10):
+        """Get the longest spans of a category, longest first."""
+        events = sorted(self.spans(cat), key=lambda e: e['dur'],
+                        reverse=True)
+        return events[:limit]
+
+    def echo_summary(self, limit=10):
+        """Show time by phase, git command totals, and slowest repos."""
+        print()
+        print("Profile:")
+        for name, total in sorted(self.totals("phase").items(),
+                                  key=lambda item: -item[1]['seconds']):
+            print("- {}: {:.1f}s".format(name, total['seconds']))
+        git = self.totals("git")
+        if git:
+            print("git commands (count, total time, failed):")
+            for name, total in sorted(git.items(),
+                                      key=lambda item: -item[1]['seconds']):
+                print("- {}: {} in {:.1f}s, {} failed".format(
+                    name, total['count'], total['seconds'], total['failed']))
+        api = self.totals("api", key=lambda event: "requests")
+        if api:
+            cached = len([event for event in self.spans("api")
+                          if event['args'].get('not_modified')])
+            print("API: {} request(s) in {:.1f}s, {} not modified".format(
+                api['requests']['count'], api['requests']['seconds'],
+                cached))
+        slowest = self.slowest("repo", limit=limit)
+        if slowest:
+            print("Slowest {} repo(s):".format(len(slowest)))
+            for event in slowest:
+                args = event['args']
+                print("- {}: {:.1f}s ({}, {} git command(s), {} bytes)"
+                      .format(event['name'], event['dur'] / 1e6,
+                              args.get('action') or "sync",
+                              args.get('git_count', 0),
+                              args.get('bytes', 0)))
+
+
+def enable():
+    """Start recording spans (only the first call has an effect).
+
+    Returns:
+        Tracer: The tracer receiving spans.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def get_tracer():
+    """Get the Tracer, or None if enable() was not called."""
+    return _tracer
+
+
+def current_repo():
+    """Get the full name of the repo being synced by this thread."""
+    return getattr(_local, 'repo', None)
+
+
+@contextmanager
+def span(name, cat="phase", **args):
+    """Time the block as a span if tracing is enabled.
+
+    Yields:
+        dict: args for the span, so results (such as 'exit_code') can
+            be added before the block ends.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    if cat == "git" and 'repo' not in args:
+        args['repo'] = current_repo()
+    tid = tracer._tid()
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        tracer.add(name, cat, start, time.perf_counter(), args, tid)
+
+
+@contextmanager
+def repo_span(full_name, **args):
+    """Time syncing a repo (git spans in this thread count toward it).
+
+    The 'git_count' and 'git_failed' args are set when it ends.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    previous = getattr(_local, 'repo', None)
+    _local.repo = full_name
+    before = dict(tracer.repo_git.get(full_name) or {})
+    try:
+        with span(full_name, cat="repo", **args) as span_args:
+            try:
+                yield span_args
+            finally:
+                counts = tracer.repo_git.get(full_name) or {}
+                for key in ('count', 'failed'):
+                    span_args['git_' + key] = (counts.get(key, 0)
+                                               - before.get(key, 0))
+    finally:
+        _local.repo = previous
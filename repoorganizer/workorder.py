@@ -0,0 +1,155 @@
+"""Start the longest syncs first, and report what set the finish time.
+
+When repos are synced concurrently, the run ends when the last one
+finishes, so a huge repo that happens to start last sets the finish
+time by itself. Starting the longest jobs first and filling in around
+them with short ones keeps every worker busy until the end (the
+"longest processing time first" rule). Durations come from earlier
+runs (see RepoIndex.recent_durations), or for a repo that was never
+cloned, are estimated from the listing's size.
+"""
+from __future__ import print_function
+
+CLONE_KB_PER_SECOND = 5 * 1024  # assumed when a repo has no history
+BASE_SECONDS = 1.0  # assumed time of any sync with no history
+UPDATE_ACTIONS = ("fetch", "pull", "update")
+
+
+def estimate_seconds(repo, durations=None, cloned=False):
+    """Estimate how long syncing a repo will take.
+
+    Args:
+        repo (dict): Listing entry (with 'size' in KB).
+        durations (dict[str,float], optional): Seconds the latest
+            successful sync of each action took for this repo (see
+            RepoIndex.recent_durations).
+        cloned (bool, optional): Whether the repo is already cloned (so
+            it will be updated instead).
+
+    Returns:
+        float: Seconds.
+    """
+    durations = durations or {}
+    if cloned:
+        updates = [durations[action] for action in UPDATE_ACTIONS
+                   if durations.get(action) is not None]
+        if updates:
+            return max(updates)
+        return BASE_SECONDS
+    if durations.get("clone") is not None:
+        return durations["clone"]
+    return BASE_SECONDS + (repo.get('size') or 0) / float(CLONE_KB_PER_SECOND)
+
+
+def longest_first(positions, estimates):
+    """Sort positions by estimates[position], longest first.
+
+    Ties keep their order (such as the listing order).
+    """
+    return sorted(positions, key=lambda position: -estimates[position])
+
+
+def _end(summary):
+    return summary['started'] + summary['duration']
+
+
+def critical_path(summaries):
+    """Find the repos that set the finish time of a run.
+
+    Each worker syncs one repo after another, and a batch (see
+    RepoCollection.sync_batches) only starts when the one before it has
+    ended, so the run ends when the repo that finished last is done.
+    The critical path leads back from it through the repos before it on
+    the same worker, and from the first repo of a worker to the repo
+    that ended the batch before. No other repo being faster would have
+    ended the run sooner.
+
+    Args:
+        summaries (Iterable[dict]): Summaries (see
+            RepoCollection._sync_if_changed). Only those with
+            'started', 'duration' and 'worker' are used (so skipped
+            repos are left out). Each thread has a different 'worker'
+            except when batches run one after another on one thread.
+
+    Returns:
+        dict: With 'repos' (summaries on the critical path, in order),
+            'workers' (names, in order), 'start' and 'end' (of the run,
+            in seconds since the epoch), 'busy' (seconds of work by
+            every worker) and 'longest' (summary of the longest repo).
+            None if no repo was timed.
+    """
+    timed = [summary for summary in summaries
+             if summary and summary.get('started') is not None
+             and summary.get('duration') is not None
+             and summary.get('worker')]
+    if not timed:
+        return None
+    timed.sort(key=lambda s: s['started'])
+    previous = {}  # id of a summary to the one before it on its worker
+    last_on_worker = {}
+    for summary in timed:
+        before = last_on_worker.get(summary['worker'])
+        if before is not None:
+            previous[id(summary)] = before
+        last_on_worker[summary['worker']] = summary
+    last = max(timed, key=_end)
+    path = []
+    summary = last
+    while summary is not None:
+        path.append(summary)
+        before = previous.get(id(summary))
+        if before is None:
+            # The first repo of a worker waited for the batch before.
+            ended = [other for other in timed
+                     if _end(other) <= summary['started']]
+            before = max(ended, key=_end) if ended else None
+        summary = before
+    path.reverse()
+    workers = []
+    for summary in path:
+        if summary['worker'] not in workers:
+            workers.append(summary['worker'])
+    return {
+        'repos': path,
+        'workers': workers,
+        'start': timed[0]['started'],
+        'end': _end(last),
+        'busy': sum(summary['duration'] for summary in timed),
+        'longest': max(timed, key=lambda s: s['duration']),
+    }
+
+
+def echo_critical_path(summaries, jobs, limit=10):
+    """Show the critical path (see critical_path) of a run.
+
+    Args:
+        summaries (Iterable[dict]): Summaries of every repo in the run.
+        jobs (int): Number of repos synced at once.
+        limit (int, optional): Show at most this many repos (the
+            longest ones on the path).
+    """
+    path = critical_path(summaries)
+    if path is None:
+        return
+    wall = path['end'] - path['start']
+    print()
+    print("Critical path ({} repo(s) on {}, {:.1f}s of {:.1f}s):".format(
+        len(path['repos']), ", ".join(path['workers']),
+        sum(summary['duration'] for summary in path['repos']), wall))
+    shown = sorted(path['repos'], key=lambda s: -s['duration'])[:limit]
+    for summary in path['repos']:
+        if summary not in shown:
+            continue
+        print("- {}: {:.1f}s ({}, started at +{:.1f}s)".format(
+            summary['full_name'], summary['duration'],
+            summary.get('action') or "sync",
+            summary['started'] - path['start']))
+    if len(path['repos']) > len(shown):
+        print("- ...and {} shorter repo(s)"
+              .format(len(path['repos']) - len(shown)))
+    longest = path['longest']
+    best = max(longest['duration'], path['busy'] / max(1, jobs or 1))
+    print("Longest repo: {} ({:.1f}s). {:.1f}s of work over {} job(s)"
+          " can't finish in less than {:.1f}s.".format(
+              longest['full_name'], longest['duration'], path['busy'],
+              jobs, best))
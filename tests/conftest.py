@@ -0,0 +1,79 @@
+"""Fixtures shared by the tests: local bare repos served by FakeGitHub.
+
+Nothing here uses the network. Each test gets its own cache (listing
+pages, index, journal) and backup directory under tmp_path.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from repoorganizer.benchmark import write_history
+from repoorganizer.fakegithub import FakeGitHub
+from repoorganizer.repocollection import RepoCollection, new_collection
+from repoorganizer.repoindex import RepoIndex
+
+GIT = shutil.which("git")
+
+
+def make_repo(root, owner, name, branches=("main",), commits=2):
+    """Create a bare repo with some history under root/remotes.
+
+    Returns:
+        str: Path of the bare repo.
+    """
+    path = os.path.join(str(root), "remotes", owner, name + ".git")
+    subprocess.run([GIT, "init", "-q", "--bare", "--initial-branch=main",
+                    path], check=True)
+    # Serve partial clones like GitHub does.
+    subprocess.run([GIT, "-C", path, "config", "uploadpack.allowFilter",
+                    "true"], check=True)
+    write_history(GIT, path, list(branches), commits, 64)
+    return path
+
+
+def push_commits(path, branches=("main",), commits=1, start=100):
+    """Add commits to branches of a bare repo (as if pushed)."""
+    write_history(GIT, path, list(branches), commits, 64, start=start)
+
+
+def rev_parse(path, rev):
+    return subprocess.check_output(
+        [GIT, "-C", path, "rev-parse", rev]).decode("utf-8").strip()
+
+
+@pytest.fixture
+def fake():
+    server = FakeGitHub()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Keep listings and the index of this test under tmp_path."""
+    path = str(tmp_path / "cache")
+    monkeypatch.setattr(RepoCollection, "cache_root", path)
+    return path
+
+
+@pytest.fixture
+def index(cache):
+    repo_index = RepoIndex(RepoCollection.index_path())
+    yield repo_index
+    repo_index.close()
+
+
+@pytest.fixture
+def destination(tmp_path):
+    return str(tmp_path / "backup")
+
+
+@pytest.fixture
+def collection(fake, cache):
+    """Make a collection listed from fake (org by default)."""
+    def _collection(name, is_org=True, token=None):
+        return new_collection(name, is_org, token=token, api_url=fake.url)
+    return _collection
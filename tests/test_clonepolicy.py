@@ -0,0 +1,50 @@
+from repoorganizer.clonepolicy import ClonePolicies, fetch_args
+from repoorganizer.moregitcli import is_shallow_repo
+
+from conftest import make_repo, push_commits, rev_parse
+
+
+def test_fetch_args_never_passes_depth():
+    assert fetch_args("shallow:2") == []
+    assert fetch_args("shallow") == []
+    assert fetch_args("blobless") == []
+
+
+def test_policy_precedence():
+    policies = ClonePolicies(
+        default="full",
+        policies={"o1": "blobless", "o1/huge": "shallow:1"},
+        large_repo_policy="treeless", large_repo_size_kb=100)
+    assert policies.policy_for({'full_name': "o1/huge"}, "o1") == "shallow:1"
+    assert policies.policy_for({'full_name': "o1/a"}, "o1") == "blobless"
+    assert policies.policy_for({'full_name': "o2/a", 'size': 200},
+                               "o2") == "treeless"
+    assert policies.policy_for({'full_name': "o2/a", 'size': 1}, "o2") \
+        == "full"
+
+
+def test_shallow_clone_fast_forwards_on_later_syncs(
+        tmp_path, fake, collection, index, destination):
+    path = make_repo(tmp_path, "o1", "r0", branches=("main", "b1"),
+                     commits=3)
+    fake.add_repo("o1", "r0", path)
+    policies = ClonePolicies(default="shallow:1")
+
+    def sync():
+        repos = collection("o1")
+        summaries = repos.clone_repos(destination=destination, index=index,
+                                      clone_policies=policies)
+        return repos.repo_dir(repos.repos[0]), summaries[0]
+
+    dst_dir, summary = sync()
+    assert summary['action'] == "clone" and summary['ok']
+    assert is_shallow_repo(dst_dir)
+    for sync_number in range(2):
+        push_commits(path, ("main", "b1"), start=10 + sync_number)
+        fake.touch("o1/r0")
+        dst_dir, summary = sync()
+        assert summary['action'] == "fetch" and summary['ok']
+        assert summary['branches']['diverged'] == []
+        assert rev_parse(dst_dir, "main") == rev_parse(path, "main")
+        assert rev_parse(dst_dir, "b1") == rev_parse(path, "b1")
+        assert is_shallow_repo(dst_dir)
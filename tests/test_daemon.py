@@ -0,0 +1,161 @@
+import json
+import sys
+import time
+
+import pytest
+
+from repoorganizer.daemon import (
+    SyncDaemon,
+    payload_signature,
+    sample_push_payload,
+)
+
+from conftest import make_repo, push_commits, rev_parse
+
+if sys.version_info.major >= 3:
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+else:
+    from urllib2 import HTTPError, Request, urlopen  # type:ignore
+
+SECRET = "test-secret"
+
+
+def wait_for(predicate, timeout=30.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.05)
+
+
+def post(daemon, payload, event="push", secret=SECRET):
+    """Deliver a webhook like GitHub would.
+
+    Returns:
+        tuple(int, dict): HTTP status and decoded response.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "X-GitHub-Event": event}
+    if secret:
+        headers["X-Hub-Signature-256"] = payload_signature(secret, body)
+    request = Request(daemon.url + "/webhook", data=body, headers=headers)
+    try:
+        response = urlopen(request, timeout=30)
+    except HTTPError as e:
+        data = json.loads(e.read().decode("utf-8"))
+        e.close()
+        return e.code, data
+    with response:
+        return response.getcode(), json.loads(response.read()
+                                              .decode("utf-8"))
+
+
+@pytest.fixture
+def daemon(tmp_path, fake, collection, index, destination):
+    path = make_repo(tmp_path, "o1", "r0", branches=("main", "b1"))
+    fake.add_repo("o1", "r0", path)
+    sync_daemon = SyncDaemon([collection("o1")], listen="127.0.0.1:0",
+                             secret=SECRET, reconcile_hours=0,
+                             destination=destination, index=index)
+    sync_daemon.remote_path = path
+    sync_daemon.start()
+    wait_for(lambda: sync_daemon.status()['reconciles']['ended'])
+    yield sync_daemon
+    sync_daemon.stop()
+
+
+def test_push_syncs_only_that_branch(daemon):
+    collection = daemon.collections[0]
+    dst_dir = collection.repo_dir({'full_name': "o1/r0"})
+    path = daemon.remote_path
+    assert rev_parse(dst_dir, "main") == rev_parse(path, "main")
+    b1_before = rev_parse(dst_dir, "b1")
+    push_commits(path, ("main", "b1"))
+    after = rev_parse(path, "main")
+    code, data = post(daemon, sample_push_payload("o1/r0", after=after))
+    assert code == 202 and data['refs'] == ["refs/heads/main"]
+    wait_for(lambda: daemon.status()['counts']['synced'])
+    assert rev_parse(dst_dir, "main") == after
+    assert rev_parse(dst_dir, "b1") == b1_before  # not pushed (yet)
+    status = daemon.status()
+    assert status['recent'][0]['full_name'] == "o1/r0"
+    assert status['pending'] == []
+
+    # A redelivery of the same push is ignored.
+    code, data = post(daemon, sample_push_payload("o1/r0", after=after))
+    assert code == 200 and "ignored" in data
+
+
+def test_bad_deliveries_are_refused(daemon):
+    payload = sample_push_payload("o1/r0")
+    assert post(daemon, payload, secret="wrong")[0] == 401
+    assert post(daemon, payload, secret=None)[0] == 401
+    assert post(daemon, {'ref': "refs/heads/main"})[0] == 400
+    assert post(daemon, {}, event="ping") == (200, {'ok': True})
+    code, data = post(daemon, sample_push_payload("someone-else/r0"))
+    assert code == 200 and "ignored" in data
+    assert daemon.status()['counts']['queued'] == 0
+
+
+def test_pushes_to_a_waiting_repo_are_merged(fake, collection):
+    fake.add_repo("o1", "new", "/nonexistent/new.git")
+    # Not started, so queued syncs wait.
+    sync_daemon = SyncDaemon([collection("o1")], listen="127.0.0.1:0",
+                             secret=SECRET)
+    code, data = sync_daemon.handle_event(
+        "push", sample_push_payload("o1/new", ref="refs/heads/main"))
+    assert code == 202 and data['queued']
+    code, data = sync_daemon.handle_event(
+        "push", sample_push_payload("o1/new", ref="refs/tags/v1"))
+    assert code == 202 and not data['queued']
+    assert sync_daemon._pending["o1/new"]['refs'] \
+        == ["refs/heads/main", "refs/tags/v1"]
+    payload = dict(sample_push_payload("o1/new"), deleted=True)
+    sync_daemon.handle_event("push", payload)
+    assert sync_daemon._pending["o1/new"]['refs'] is None  # fetch all
+    assert sync_daemon.status()['counts']['queued'] == 1
+
+
+def test_unlisted_repo_is_looked_up_with_the_api(fake, collection):
+    fake.add_repo("o1", "new", "/nonexistent/new.git")
+    sync_daemon = SyncDaemon([collection("o1")], listen="127.0.0.1:0",
+                             secret=SECRET)
+    payload = sample_push_payload(
+        "o1/new", clone_url="https://evil.example/x.git",
+        ssh_url="https://evil.example/x.git")
+    assert sync_daemon.handle_event("push", payload)[0] == 202
+    repo = sync_daemon._pending["o1/new"]['repo']
+    assert repo['ssh_url'] == "file:///nonexistent/new.git"
+    # Not on the server (such as a forged payload):
+    code, data = sync_daemon.handle_event(
+        "push", sample_push_payload("o1/missing"))
+    assert code == 200 and "ignored" in data
+
+
+@pytest.mark.parametrize("full_name", [
+    "o1/../../../tmp/pwned", "o1/..", "o1/.", "o1", "o1/a/b", "o1/a b",
+    "../o1", "o1/a\\b", "",
+])
+def test_unsafe_repo_names_are_refused(collection, full_name):
+    sync_daemon = SyncDaemon([collection("o1")], listen="127.0.0.1:0",
+                             secret=SECRET)
+    payload = sample_push_payload("o1/x")
+    payload['repository']['full_name'] = full_name
+    assert sync_daemon.handle_event("push", payload)[0] == 400
+    assert sync_daemon.status()['counts']['queued'] == 0
+
+
+def test_secret_is_required(collection):
+    with pytest.raises(ValueError):
+        SyncDaemon([collection("o1")], listen="127.0.0.1:0")
+
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_bad_content_length_is_refused(daemon, length):
+    request = Request(daemon.url + "/webhook", data=b"{}",
+                      headers={"Content-Length": length,
+                               "X-GitHub-Event": "ping"})
+    with pytest.raises(HTTPError) as info:
+        urlopen(request, timeout=30)
+    assert info.value.code == 400
+    info.value.close()
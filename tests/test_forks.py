@@ -0,0 +1,77 @@
+import subprocess
+
+from repoorganizer.clonepolicy import ClonePolicies
+from repoorganizer.moregitcli import is_partial_repo, read_alternates
+
+from conftest import GIT, make_repo, push_commits, rev_parse
+
+
+def add_fork(fake, tmp_path, parent_path, owner, name, parent):
+    """Serve a copy of parent_path with one more commit as a fork."""
+    path = str(tmp_path / "remotes" / owner / (name + ".git"))
+    subprocess.run([GIT, "clone", "-q", "--bare", parent_path, path],
+                   check=True)
+    push_commits(path, start=50)
+    fake.add_repo(owner, name, path, fork=True, parent=parent)
+    return path
+
+
+def test_fork_borrows_parent_objects_then_dissociates(
+        tmp_path, fake, collection, index, destination):
+    parent_path = make_repo(tmp_path, "o1", "parent", commits=3)
+    fake.add_repo("o1", "parent", parent_path)
+    fork_path = add_fork(fake, tmp_path, parent_path, "o1", "fork",
+                         "o1/parent")
+    repos = collection("o1")
+    summaries = repos.clone_repos(destination=destination, index=index)
+    assert all(summary['ok'] for summary in summaries)
+    # The fork is cloned last, so it can borrow from the new parent.
+    assert [summary['full_name'] for summary in summaries][-1] == "o1/fork"
+    parent_dir = repos.repo_dir({'full_name': "o1/parent"})
+    fork_dir = repos.repo_dir({'full_name': "o1/fork"})
+    assert read_alternates(fork_dir)
+    assert rev_parse(fork_dir, "main") == rev_parse(fork_path, "main")
+    assert subprocess.check_output(
+        [GIT, "-C", parent_dir, "config", "gc.pruneExpire"]
+    ).decode("utf-8").strip() == "never"
+
+    summaries = collection("o1").clone_repos(
+        destination=destination, index=index, share_forks=False)
+    assert all(summary['ok'] for summary in summaries)
+    assert read_alternates(fork_dir) == []
+    subprocess.run([GIT, "-C", fork_dir, "fsck", "--connectivity-only"],
+                   check=True, capture_output=True)
+
+
+def test_partial_parent_is_not_shared(tmp_path, fake, collection, index,
+                                      destination):
+    parent_path = make_repo(tmp_path, "o1", "parent")
+    fake.add_repo("o1", "parent", parent_path)
+    add_fork(fake, tmp_path, parent_path, "o1", "fork", "o1/parent")
+    repos = collection("o1")
+    policies = ClonePolicies(policies={"o1/parent": "blobless"})
+    summaries = repos.clone_repos(destination=destination, index=index,
+                                  clone_policies=policies)
+    assert all(summary['ok'] for summary in summaries)
+    assert is_partial_repo(repos.repo_dir({'full_name': "o1/parent"}))
+    assert read_alternates(repos.repo_dir({'full_name': "o1/fork"})) == []
+
+
+def test_blobless_clone_stays_partial(tmp_path, fake, collection, index,
+                                      destination):
+    path = make_repo(tmp_path, "o1", "r0")
+    fake.add_repo("o1", "r0", path)
+    policies = ClonePolicies(default="blobless")
+    repos = collection("o1")
+    summaries = repos.clone_repos(destination=destination, index=index,
+                                  clone_policies=policies)
+    dst_dir = repos.repo_dir(repos.repos[0])
+    assert summaries[0]['policy'] == "blobless" and summaries[0]['ok']
+    assert is_partial_repo(dst_dir)
+    push_commits(path)
+    fake.touch("o1/r0")
+    summaries = collection("o1").clone_repos(
+        destination=destination, index=index, clone_policies=policies)
+    assert summaries[0]['ok']
+    assert is_partial_repo(dst_dir)
+    assert rev_parse(dst_dir, "main") == rev_parse(path, "main")
@@ -0,0 +1,119 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from repoorganizer.httpclient import HTTPClient, proxy_parts
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Redirect /redirect/CODE to /target, and echo any other request.
+
+    Requests for a whole URL (as sent to a proxy) are echoed as well.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+        if self.path.startswith("/redirect/"):
+            self.send_response(int(self.path.split("/")[-1]))
+            self.send_header("Location", "/target")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = json.dumps({
+            'method': self.command,
+            'path': self.path,
+            'body': body,
+            'content_type': self.headers.get("Content-Type"),
+            'proxy_auth': self.headers.get("Proxy-Authorization"),
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), EchoHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def no_proxies(monkeypatch):
+    for scheme in ("http", "https", "all", "no"):
+        for name in (scheme + "_proxy", scheme.upper() + "_PROXY"):
+            monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def echo(client, method, url, body=None):
+    headers = {"Content-Type": "application/json"} if body else None
+    response = client.request(method, url, headers=headers, body=body)
+    return json.loads(response.body.decode("utf-8"))
+
+
+@pytest.mark.parametrize("status", [301, 302, 303])
+def test_post_redirect_becomes_get(server, no_proxies, status):
+    data = echo(HTTPClient(), "POST", "{}/redirect/{}".format(server, status),
+                body=b'{"query": "{}"}')
+    assert data['method'] == "GET" and data['path'] == "/target"
+    assert data['body'] == "" and data['content_type'] is None
+
+
+@pytest.mark.parametrize("status", [307, 308])
+def test_post_redirect_is_repeated(server, no_proxies, status):
+    data = echo(HTTPClient(), "POST", "{}/redirect/{}".format(server, status),
+                body=b'{"query": "{}"}')
+    assert data['method'] == "POST" and data['body'] == '{"query": "{}"}'
+
+
+def test_put_redirect_keeps_its_method(server, no_proxies):
+    data = echo(HTTPClient(), "PUT", server + "/redirect/302", body=b"x")
+    assert data['method'] == "PUT" and data['body'] == "x"
+
+
+def test_http_proxy_is_sent_the_whole_url(server, no_proxies):
+    proxy = server.replace("http://", "http://user:p%40ss@")
+    no_proxies.setenv("http_proxy", proxy)
+    client = HTTPClient()
+    data = echo(client, "GET", "http://api.example.invalid/orgs/o1/repos")
+    assert data['path'] == "http://api.example.invalid/orgs/o1/repos"
+    assert data['proxy_auth'] == proxy_parts(proxy)[3]
+    assert proxy_parts(proxy)[3] == "Basic dXNlcjpwQHNz"  # user:p@ss
+
+
+def test_no_proxy_hosts_are_reached_directly(server, no_proxies):
+    no_proxies.setenv("http_proxy", "http://127.0.0.1:9")  # discard port
+    no_proxies.setenv("no_proxy", "127.0.0.1")
+    data = echo(HTTPClient(), "GET", server + "/direct")
+    assert data['path'] == "/direct"
+
+
+def test_https_is_tunneled_through_the_proxy(no_proxies):
+    no_proxies.setenv("https_proxy", "http://user:pw@proxy.invalid:3128")
+    client = HTTPClient()
+    proxy = client.proxy_for("https", "api.github.com")
+    assert proxy == "http://user:pw@proxy.invalid:3128"
+    conn = client._connect(("https", "api.github.com", 443, proxy))
+    assert (conn.host, conn.port) == ("proxy.invalid", 3128)
+    assert conn._tunnel_host == "api.github.com"
+    assert conn._tunnel_headers["Proxy-Authorization"] \
+        == proxy_parts(proxy)[3]
@@ -0,0 +1,75 @@
+import json
+import os
+
+from repoorganizer.journal import RunJournal, load_unfinished
+
+from conftest import make_repo, rev_parse
+
+
+def interrupt(journal):
+    """Stop writing like a killed run would (no "end" event)."""
+    journal._stream.close()
+    journal._stream = None
+
+
+def test_load_unfinished(tmp_path):
+    path = str(tmp_path / "run-journal.jsonl")
+    journal = RunJournal(path)
+    journal.mark_listed(["o1/a", "o1/b"])
+    journal.mark("o1/a", "started", action="clone")
+    journal.mark("o1/a", "done")
+    journal.mark("o1/b", "started", action="clone")
+    interrupt(journal)
+    with open(path, "a") as stream:
+        stream.write('{"repo": "o1/b", "pha')  # cut off
+    run_id, repos = load_unfinished(path)
+    assert run_id == journal.run_id
+    assert repos == {'o1/a': {'phase': "done", 'action': "clone"},
+                     'o1/b': {'phase': "started", 'action': "clone"}}
+
+    resumed = RunJournal(path, resume=True)
+    assert resumed.run_id == journal.run_id and resumed.interrupted == 1
+    assert resumed.is_done("o1/a") and resumed.was_cloning("o1/b")
+    resumed.finish()
+    assert load_unfinished(path) == (None, {})
+
+
+def test_resume_keeps_progress_across_interruptions(
+        tmp_path, fake, collection, index, destination):
+    paths = {}
+    for name in ("r0", "r1"):
+        paths[name] = make_repo(tmp_path, "o1", name)
+        fake.add_repo("o1", name, paths[name])
+    journal_path = str(tmp_path / "run-journal.jsonl")
+
+    journal = RunJournal(journal_path)
+    repos = collection("o1")
+    repos.clone_repos(destination=destination, index=index, journal=journal)
+    interrupt(journal)
+    # A clone the run was in the middle of is started over.
+    r1_dir = repos.repo_dir({'full_name': "o1/r1"})
+    with open(journal_path, "a") as stream:
+        stream.write(json.dumps({'repo': "o1/r1", 'phase': "started",
+                                 'action': "clone"}) + "\n")
+    with open(os.path.join(r1_dir, "partial"), "w") as stream:
+        stream.write("left by the interrupted clone")
+
+    for run in range(2):
+        journal = RunJournal(journal_path, resume=True)
+        assert journal.is_done("o1/r0")
+        summaries = collection("o1").clone_repos(
+            destination=destination, index=index, force=True,
+            journal=journal)
+        by_name = {summary['full_name']: summary for summary in summaries}
+        assert by_name['o1/r0'].get('resumed')
+        if run == 0:
+            assert by_name['o1/r1']['action'] == "clone"
+            assert by_name['o1/r1']['ok']
+        else:
+            assert by_name['o1/r1'].get('resumed')
+        interrupt(journal)
+    assert not os.path.exists(os.path.join(r1_dir, "partial"))
+    assert rev_parse(r1_dir, "main") == rev_parse(paths['r1'], "main")
+    journal = RunJournal(journal_path, resume=True)
+    assert journal.is_done("o1/r0") and journal.is_done("o1/r1")
+    journal.finish()
@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+from repoorganizer import repocollection
+from repoorganizer.githubapi import PER_PAGE, GraphQLError
+from repoorganizer.listing import write_if_changed
+
+
+def add_repos(fake, owner, start, stop, fork=False):
+    for number in range(start, stop):
+        fake.add_repo(owner, "r{:03}".format(number),
+                      "/nonexistent/r{:03}.git".format(number), fork=fork)
+
+
+def list_names(repos):
+    repos._load_repos()
+    return [repo['full_name'] for repo in repos.repos]
+
+
+def test_pages_are_merged_in_order_and_reused(fake, collection):
+    add_repos(fake, "o1", 0, 2 * PER_PAGE + 5)
+    names = list_names(collection("o1"))
+    assert names == ["o1/r{:03}".format(number)
+                     for number in range(2 * PER_PAGE + 5)]
+    assert fake.not_modified == 0
+    requests = fake.requests
+    assert list_names(collection("o1")) == names
+    assert fake.requests - requests == 3
+    assert fake.not_modified == 3
+
+
+def test_repo_added_after_a_full_page_is_listed(fake, collection):
+    """The first page is unchanged (304) but a second one now exists."""
+    add_repos(fake, "o1", 0, PER_PAGE)
+    assert len(list_names(collection("o1"))) == PER_PAGE
+    add_repos(fake, "o1", PER_PAGE, PER_PAGE + 1)
+    names = list_names(collection("o1"))
+    assert fake.not_modified == 1
+    assert len(names) == PER_PAGE + 1
+    assert names[-1] == "o1/r{:03}".format(PER_PAGE)
+
+
+def test_repo_added_to_a_full_last_page_is_listed(fake, collection):
+    add_repos(fake, "o1", 0, 2 * PER_PAGE)
+    assert len(list_names(collection("o1"))) == 2 * PER_PAGE
+    add_repos(fake, "o1", 2 * PER_PAGE, 2 * PER_PAGE + 1)
+    assert len(list_names(collection("o1"))) == 2 * PER_PAGE + 1
+
+
+def test_user_listings_include_forks(fake, collection):
+    """Full and incremental listings of a user list the same repos."""
+    add_repos(fake, "u1", 0, 2)
+    add_repos(fake, "u1", 2, 3, fork=True)
+    expected = ["u1/r000", "u1/r001", "u1/r002"]
+    repos = collection("u1", is_org=False, token="t1")
+    assert list_names(repos) == expected
+    assert "fork:true" in fake.paths[-1]
+    repos = collection("u1", is_org=False, token="t1")
+    repos.discovery = "incremental"
+    assert sorted(list_names(repos)) == expected
+    assert "pushed:" in fake.paths[-1]
+
+
+def test_graphql_errors_fall_back_to_rest(fake, collection, monkeypatch):
+    add_repos(fake, "o1", 0, 2)
+
+    def list_repos_graphql(url, login, headers=None):
+        raise GraphQLError("Something went wrong while executing your query")
+
+    monkeypatch.setattr(repocollection, "list_repos_graphql",
+                        list_repos_graphql)
+    repos = collection("o1", token="t1")
+    repos.listing = "graphql"
+    assert list_names(repos) == ["o1/r000", "o1/r001"]
+    assert fake.paths[-1].startswith("/orgs/o1/repos")
+
+
+def test_unchanged_listing_leaves_the_cache_alone(fake, cache, collection,
+                                                 index):
+    add_repos(fake, "o1", 0, 3)
+    repos = collection("o1")
+    repos._load_repos()
+    index.update_listing("o1", repos.repos)
+
+    def states():
+        result = {}
+        for parent, _, files in os.walk(cache):
+            for name in files:
+                info = os.stat(os.path.join(parent, name))
+                result[name] = (info.st_ino, info.st_mtime_ns)
+        return result
+
+    before = states()
+    repos = collection("o1")
+    repos._load_repos()
+    index.update_listing("o1", repos.repos)
+    after = states()
+    # Only the discovery state (the time of the listing) is rewritten.
+    assert [name for name in after if after[name] != before.get(name)] \
+        == ["discovery.json"]
+
+
+def test_write_if_changed_leaves_an_unchanged_file_alone(tmp_path):
+    path = str(tmp_path / "repos.json")
+    assert write_if_changed(path, ["a", "b\n"])
+    before = os.stat(path)
+    assert oct(before.st_mode & 0o777) != oct(0o600)  # not mkstemp's
+
+    def chunks():
+        yield "a"
+        yield "b\n"
+
+    assert not write_if_changed(path, chunks)
+    after = os.stat(path)
+    assert (after.st_ino, after.st_mtime_ns) \
+        == (before.st_ino, before.st_mtime_ns)
+    assert os.listdir(str(tmp_path)) == ["repos.json"]
+    assert write_if_changed(path, chunks=lambda: iter(["c\n"]))
+    with open(path) as stream:
+        assert stream.read() == "c\n"
+
+
+def test_write_if_changed_removes_its_temporary_file_on_error(tmp_path):
+    path = str(tmp_path / "repos.json")
+    calls = []
+
+    def chunks():
+        calls.append(1)
+        yield "a"
+        if len(calls) > 1:  # fail while writing, not while hashing
+            raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        write_if_changed(path, chunks)
+    assert os.listdir(str(tmp_path)) == []
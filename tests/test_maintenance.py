@@ -0,0 +1,114 @@
+import os
+import subprocess
+
+import pytest
+
+from repoorganizer.maintenance import (
+    LOOSE_OBJECTS_LIMIT,
+    PACKS_LIMIT,
+    PRUNE_EXPIRE_DAYS,
+    RECHECK_DAYS,
+    is_due,
+    maintain_repo,
+    plan_tasks,
+    task_command,
+)
+from repoorganizer.moregitcli import count_objects
+
+from conftest import GIT, make_repo
+
+DAY = 86400.0
+NOW = 1700000000.0
+
+
+def last_run(days_ago, loose_after=0, ok=True, synced_days_ago=None):
+    return {
+        'started_at': NOW - days_ago * DAY,
+        'tasks': ["gc"],
+        'ok': ok,
+        'loose_after': loose_after,
+        'garbage_after': 0,
+        'synced_at': (None if synced_days_ago is None
+                      else NOW - synced_days_ago * DAY),
+    }
+
+
+@pytest.fixture
+def repo_path(tmp_path):
+    """A bare repo with one pack and no commit-graph or index."""
+    path = make_repo(tmp_path, "o1", "r0")
+    subprocess.run([GIT, "-C", path, "repack", "-a", "-d", "-q"],
+                   check=True)
+    return path
+
+
+def test_plan_tasks_thresholds(repo_path):
+    stats = {'count': LOOSE_OBJECTS_LIMIT - 1, 'packs': 1}
+    assert plan_tasks(repo_path, stats, now=NOW) == ["commit-graph"]
+    stats = {'count': LOOSE_OBJECTS_LIMIT, 'packs': 1}
+    assert plan_tasks(repo_path, stats, now=NOW) == ["gc"]
+    stats = {'count': 0, 'packs': PACKS_LIMIT}
+    assert plan_tasks(repo_path, stats, now=NOW) \
+        == ["repack", "commit-graph"]
+    stats = {'count': 0, 'packs': 2}
+    assert plan_tasks(repo_path, stats, now=NOW) \
+        == ["commit-graph", "multi-pack-index"]
+    for task in ("commit-graph", "multi-pack-index"):
+        subprocess.run([GIT] + task_command(repo_path, task)[1:], check=True)
+    assert plan_tasks(repo_path, stats, now=NOW) == []
+
+
+def test_loose_objects_a_recent_gc_left_are_not_counted(repo_path):
+    stats = {'count': LOOSE_OBJECTS_LIMIT + 10, 'packs': 1}
+    last = last_run(1, loose_after=LOOSE_OBJECTS_LIMIT)
+    assert "gc" not in plan_tasks(repo_path, stats, last=last, now=NOW)
+    # By now gc may prune them, so it is run again.
+    last = last_run(PRUNE_EXPIRE_DAYS + 1, loose_after=LOOSE_OBJECTS_LIMIT)
+    assert plan_tasks(repo_path, stats, last=last, now=NOW) == ["gc"]
+
+
+def test_shared_repos_keep_unreachable_objects():
+    assert task_command("r", "gc") == ["git", "-C", "r", "gc", "--quiet"]
+    assert task_command("r", "gc", keep_unreachable=True)[-1] \
+        == "--prune=never"
+    repack = task_command("r", "repack")
+    assert "-A" in repack and "--keep-unreachable" not in repack
+    repack = task_command("r", "repack", keep_unreachable=True)
+    assert "-a" in repack and "--keep-unreachable" in repack
+    with pytest.raises(ValueError):
+        task_command("r", "prune")
+
+
+@pytest.mark.parametrize("last, due", [
+    (None, True),
+    (last_run(1), False),
+    (last_run(2, synced_days_ago=1), True),
+    (last_run(1, synced_days_ago=2), False),
+    (last_run(1, ok=False), True),
+    (last_run(RECHECK_DAYS), True),
+])
+def test_is_due(last, due):
+    assert is_due(last, now=NOW) is due
+
+
+def test_garbage_gc_leaves_is_not_retried(tmp_path, index):
+    path = make_repo(tmp_path, "o1", "r0")
+    with open(os.path.join(path, "objects", "pack", "stray"), "w") as stream:
+        stream.write("not a pack")
+    stats = count_objects(path)
+    assert stats['garbage'] == 1
+    assert plan_tasks(path, stats) == ["gc"]
+    repo = {'full_name': "o1/r0", 'path': path, 'stats': stats,
+            'tasks': ["gc"]}
+    summary = maintain_repo(repo, deadline=float("inf"))
+    assert summary['ok'] and summary['after']['garbage'] == 1
+    index.record_maintenance("o1/r0", summary['tasks'], True,
+                             before=summary['before'],
+                             after=summary['after'])
+    last = index.last_maintenance()["o1/r0"]
+    assert last['garbage_after'] == 1
+    assert "gc" not in plan_tasks(path, count_objects(path), last=last)
+    # New garbage is still cleaned up.
+    with open(os.path.join(path, "objects", "pack", "stray2"), "w") as stream:
+        stream.write("not a pack")
+    assert plan_tasks(path, count_objects(path), last=last) == ["gc"]
@@ -0,0 +1,34 @@
+import os
+import subprocess
+
+from conftest import GIT, make_repo, push_commits, rev_parse
+
+
+def list_heads(path):
+    return subprocess.check_output(
+        [GIT, "-C", path, "for-each-ref", "--format=%(refname) %(objectname)",
+         "refs/heads"]).decode("utf-8").splitlines()
+
+
+def test_mirror_is_cloned_bare_and_updated(
+        tmp_path, fake, collection, index, destination):
+    path = make_repo(tmp_path, "o1", "r0", branches=("main", "b1"))
+    fake.add_repo("o1", "r0", path)
+    repos = collection("o1")
+    summaries = repos.clone_repos(destination=destination, index=index,
+                                  mirror=True)
+    assert summaries[0]['action'] == "clone" and summaries[0]['ok']
+    dst_dir = repos.repo_dir({'full_name': "o1/r0"})
+    assert dst_dir.endswith("r0.git")
+    assert not os.path.exists(os.path.join(dst_dir, ".git"))
+    assert list_heads(dst_dir) == list_heads(path)
+
+    push_commits(path, ("main", "b2"))
+    subprocess.run([GIT, "-C", path, "update-ref", "-d", "refs/heads/b1"],
+                   check=True)
+    fake.touch("o1/r0")
+    summaries = collection("o1").clone_repos(
+        destination=destination, index=index, mirror=True)
+    assert summaries[0]['action'] == "update" and summaries[0]['ok']
+    assert list_heads(dst_dir) == list_heads(path)  # b1 pruned
+    assert rev_parse(dst_dir, "b2") == rev_parse(path, "b2")
@@ -0,0 +1,75 @@
+import subprocess
+
+from repoorganizer.moregitcli import read_repo_state, update_branches
+
+from conftest import GIT, make_repo, push_commits, rev_parse
+
+
+def git(path, *args):
+    subprocess.run([GIT, "-C", path, "-c", "user.name=Test",
+                    "-c", "user.email=test@example.com"] + list(args),
+                   check=True, capture_output=True)
+
+
+def commit_on(path, branch):
+    """Add a local commit to branch (then check out main again)."""
+    git(path, "checkout", "-q", branch)
+    git(path, "commit", "-q", "--allow-empty", "-m", "local")
+    git(path, "checkout", "-q", "main")
+
+
+def diverge(tmp_path):
+    """Clone a repo, then add commits to the clone and the remote.
+
+    Returns:
+        tuple(str, str): Paths of the remote and the clone (fetched).
+    """
+    remote = make_repo(tmp_path, "o1", "r0",
+                       branches=("main", "b1", "b2", "b3"))
+    path = str(tmp_path / "clone")
+    subprocess.run([GIT, "clone", "-q", remote, path], check=True)
+    for name in ("b1", "b2", "b3"):
+        git(path, "branch", "-q", "--track", name, "origin/" + name)
+    git(path, "branch", "-q", "topic")
+    commit_on(path, "b2")  # diverged once the remote moves too
+    commit_on(path, "b3")  # only ahead
+    push_commits(remote, ("main", "b1", "b2"))
+    push_commits(remote, ("b4",), start=200)
+    git(path, "fetch", "-q", "origin")
+    return remote, path
+
+
+def test_repo_state(tmp_path):
+    remote, path = diverge(tmp_path)
+    state = read_repo_state(path, cached=False)
+    assert state.head == "main"
+    assert sorted(state.local) == ["b1", "b2", "b3", "main", "topic"]
+    assert sorted(state.remote_branches()) \
+        == ["b1", "b2", "b3", "b4", "main"]
+    assert "origin/HEAD" not in state.remote
+    assert state.upstream['b2'] == "origin/b2"
+    assert "topic" not in state.upstream
+    assert (state.ahead['b2'], state.behind['b2']) == (1, 1)
+    assert (state.ahead['b3'], state.behind['b3']) == (1, 0)
+    assert (state.ahead['main'], state.behind['main']) == (0, 1)
+    assert state.heads()["refs/heads/b1"] == rev_parse(path, "b1")
+    assert read_repo_state(path) is read_repo_state(path)
+
+
+def test_update_branches(tmp_path):
+    remote, path = diverge(tmp_path)
+    b2_before = rev_parse(path, "b2")
+    results = update_branches(path)
+    assert results['updated'] == ["b1", "main"]
+    assert results['created'] == ["b4"]
+    assert results['diverged'] == ["b2"]
+    assert results['ahead'] == ["b3"]
+    assert results['local_only'] == ["topic"]
+    assert results['errors'] == []
+    for name in ("main", "b1", "b4"):
+        assert rev_parse(path, name) == rev_parse(remote, name)
+    assert rev_parse(path, "b2") == b2_before  # not forced
+    # The checked-out branch was merged, so the working tree moved too.
+    status = subprocess.check_output([GIT, "-C", path, "status",
+                                      "--porcelain"])
+    assert status == b""
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from repoorganizer import ratelimit
+from repoorganizer.githubapi import fetch_json
+from repoorganizer.ratelimit import QuotaExhausted, RateLimiter
+
+KEY = ("anonymous", "core")
+
+
+class FakeTime(object):
+    """A clock that only moves when sleep is called."""
+
+    def __init__(self):
+        self.now = float(int(time.time()))
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def quota_headers(remaining, reset, limit=100):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(int(reset)),
+    }
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Make the limiter every request uses wait without sleeping."""
+    fake_time = FakeTime()
+    limiter = RateLimiter(clock=fake_time.clock, sleep=fake_time.sleep)
+    limiter.fake_time = fake_time
+    monkeypatch.setattr(ratelimit, "_default_limiter", limiter)
+    return limiter
+
+
+def test_waits_for_reset_when_used_up(limiter):
+    now = limiter.clock()
+    limiter.update(KEY, quota_headers(0, now + 10))
+    limiter.wait(KEY)
+    assert limiter.fake_time.sleeps == [11]
+
+
+def test_paces_the_rest_of_the_quota(limiter):
+    now = limiter.clock()
+    limiter.update(KEY, quota_headers(10, now + 100))
+    assert limiter.delay_for(KEY) == 0.0
+    # Each further request waits for its share of the window.
+    assert limiter.delay_for(KEY) == pytest.approx(10.0)
+    assert limiter.delay_for(KEY) == pytest.approx(10.0 + 100.0 / 9)
+
+
+def test_raises_quota_exhausted_past_max_wait(limiter):
+    limiter.update(KEY, quota_headers(0, limiter.clock() + 7200))
+    with pytest.raises(QuotaExhausted) as info:
+        limiter.wait(KEY)
+    assert info.value.key == KEY and info.value.delay > limiter.max_wait
+    assert limiter.fake_time.sleeps == []
+
+
+@pytest.mark.parametrize("status", [429, 403])
+def test_secondary_limit_is_retried(fake, limiter, status):
+    fake.add_repo("o1", "r0", "/nonexistent/r0.git")
+    fake.fail_next(2, status=status, retry_after=3)
+    data, _ = fetch_json(fake.url + "/orgs/o1/repos", limiter=limiter)
+    assert [item['name'] for item in data] == ["r0"]
+    assert limiter.fake_time.sleeps == [3, 3]
+    assert limiter.report()[0]['retries'] == 2
+
+
+def test_secondary_limit_without_retry_after_backs_off(fake, limiter):
+    fake.fail_next(2, retry_after=None)
+    fetch_json(fake.url + "/orgs/o1/repos", limiter=limiter)
+    assert limiter.fake_time.sleeps == [limiter.backoff,
+                                        limiter.backoff * 2]
+
+
+def test_listing_falls_back_to_cache_when_quota_is_used_up(
+        fake, collection, limiter):
+    fake.add_repo("o1", "r0", "/nonexistent/r0.git")
+    fake.rate_limit = 1
+    fake.rate_window = 7200
+    repos = collection("o1")
+    repos._load_repos()
+    assert [repo['full_name'] for repo in repos.repos] == ["o1/r0"]
+    requests = fake.requests
+    repos = collection("o1")
+    repos._load_repos()
+    assert [repo['full_name'] for repo in repos.repos] == ["o1/r0"]
+    assert fake.requests == requests
+    with pytest.raises(QuotaExhausted):
+        collection("o1")._load_repos(refresh=True)
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from repoorganizer.scheduler import WorkQueue, sync_collections
+
+from conftest import make_repo, rev_parse
+
+
+def drain(queue):
+    """Take every task, finishing each one before taking the next."""
+    taken = []
+    while True:
+        item = queue.get()
+        if item is None:
+            return taken
+        task, owner, host = item
+        taken.append(task)
+        queue.done(owner, host)
+
+
+@pytest.mark.parametrize("fairness, expected", [
+    ("round-robin", ["a1", "b1", "a2", "b2", "a3"]),
+    ("fifo", ["a1", "a2", "a3", "b1", "b2"]),
+    ("longest-first", ["b1", "a1", "a2", "a3", "b2"]),
+])
+def test_fairness_ordering(fairness, expected):
+    queue = WorkQueue(1, fairness=fairness)
+    for task, cost in (("a1", 3.0), ("a2", 2.0), ("a3", 1.0)):
+        queue.add(task, "o1", "github.com", cost=cost)
+    for task, cost in (("b1", 9.0), ("b2", 0.5)):
+        queue.add(task, "o2", "github.com", cost=cost)
+    queue.close_producer()
+    assert drain(queue) == expected
+
+
+def test_per_owner_and_per_host_limits():
+    queue = WorkQueue(1, fairness="fifo", per_owner=1, per_host=2)
+    queue.add("a1", "o1", "h1")
+    queue.add("a2", "o1", "h1")
+    queue.add("b1", "o2", "h1")
+    queue.add("c1", "o3", "h2")
+    queue.add("d1", "o4", "h1")
+    queue.close_producer()
+    # a2 waits for o1, d1 for a free slot on h1.
+    assert [queue.get()[0] for _ in range(3)] == ["a1", "b1", "c1"]
+    taken = []
+    waiter = threading.Thread(target=lambda: taken.append(queue.get()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    queue.done("o2", "h1")  # b1 finished
+    waiter.join(5)
+    assert taken[0][0] == "d1"
+    queue.done("o1", "h1")  # a1 finished
+    assert queue.get()[0] == "a2"
+
+
+def test_every_collection_is_synced_from_one_queue(
+        tmp_path, fake, collection, index, destination):
+    paths = {}
+    for owner in ("o1", "o2"):
+        for name in ("r0", "r1", "r2"):
+            paths[owner, name] = make_repo(tmp_path, owner, name)
+            fake.add_repo(owner, name, paths[owner, name])
+    collections = [collection("o1"), collection("o2")]
+    results = sync_collections(collections, jobs=3, jobs_per_owner=2,
+                               destination=destination, index=index)
+    for repos, summaries in zip(collections, results):
+        assert [summary['ok'] for summary in summaries] == [True] * 3
+        for repo in repos.repos:
+            owner, name = repo['full_name'].split("/")
+            assert rev_parse(repos.repo_dir(repo), "main") \
+                == rev_parse(paths[owner, name], "main")
@@ -0,0 +1,45 @@
+from repoorganizer.syncplan import plan_repos
+
+from conftest import make_repo, push_commits
+
+
+def clone_all(tmp_path, fake, collection, index, destination):
+    paths = {}
+    for name in ("r0", "r1"):
+        paths[name] = make_repo(tmp_path, "o1", name)
+        fake.add_repo("o1", name, paths[name])
+    repos = collection("o1")
+    repos.clone_repos(destination=destination, index=index)
+    return repos, paths
+
+
+def test_plan_finds_moved_refs(
+        tmp_path, fake, collection, index, destination):
+    repos, paths = clone_all(tmp_path, fake, collection, index, destination)
+    plans = plan_repos(repos.repos, repos.repo_dir)
+    assert [(plan['needs_sync'], plan['reason']) for plan in plans] \
+        == [(False, "refs unchanged")] * 2
+    push_commits(paths['r0'], ("main",))
+    push_commits(paths['r1'], ("b2",))
+    fake.add_repo("o1", "r2", "/nonexistent/r2.git")
+    repos = collection("o1")
+    repos.configure(destination=destination, index=index)
+    repos._load_repos()
+    by_name = {plan['full_name']: plan
+               for plan in plan_repos(repos.repos, repos.repo_dir)}
+    assert by_name['o1/r0']['changed'] == ["refs/heads/main"]
+    assert by_name['o1/r1']['added'] == ["refs/heads/b2"]
+    assert by_name['o1/r1']['needs_sync']
+    assert by_name['o1/r2']['reason'] == "not cloned"
+
+
+def test_precheck_skips_a_push_that_moved_no_branch(
+        tmp_path, fake, collection, index, destination):
+    """Such as a pushed tag, which only changes pushed_at."""
+    repos, paths = clone_all(tmp_path, fake, collection, index, destination)
+    fake.touch("o1/r0")
+    summaries = collection("o1").clone_repos(
+        destination=destination, index=index, precheck=True)
+    assert [summary['action'] for summary in summaries] == ["skip"] * 2
+    # Confirmed, so the next run can skip it without ls-remote.
+    assert index.stale() == []
@@ -0,0 +1,36 @@
+from repoorganizer.workorder import critical_path, longest_first
+
+
+def timed(name, worker, started, duration):
+    return {'full_name': name, 'worker': worker, 'started': started,
+            'duration': duration}
+
+
+def test_longest_first_keeps_the_order_of_ties():
+    estimates = {0: 1.0, 1: 5.0, 2: 1.0, 3: 9.0}
+    assert longest_first(range(4), estimates) == [3, 1, 0, 2]
+
+
+def test_critical_path_spans_batches():
+    summaries = [
+        # First batch: w1 finishes last (at 10).
+        timed("o1/a", "w0", 0.0, 2.0),
+        timed("o1/b", "w0", 2.0, 3.0),
+        timed("o1/c", "w1", 0.0, 10.0),
+        # Second batch (new threads) starts when the first has ended.
+        timed("o1/d", "w2", 10.5, 1.0),
+        timed("o1/e", "w3", 10.5, 4.0),
+        timed("o1/f", "w3", 14.5, 1.0),
+        {'full_name': "o1/skipped", 'action': "skip"},
+    ]
+    path = critical_path(summaries)
+    assert [s['full_name'] for s in path['repos']] \
+        == ["o1/c", "o1/e", "o1/f"]
+    assert path['workers'] == ["w1", "w3"]
+    assert (path['start'], path['end']) == (0.0, 15.5)
+    assert path['busy'] == 21.0
+    assert path['longest']['full_name'] == "o1/c"
+
+
+def test_critical_path_of_nothing_timed():
+    assert critical_path([None, {'full_name': "o1/a"}]) is None